@@ -2,6 +2,8 @@ from os import sys, makedirs
 from PIL import Image
 import numpy as np
 import os
+from Image_IO import open_image
+from Tiling import PRECISIONS, check_precision, tiled_filter
 
 
 class AverageFilter:
@@ -12,8 +14,11 @@ class AverageFilter:
     value with the average value of the pixels in the neighborhood.
 
     Attributes:
-    input_path: The path of the input image file.
+    input_path: The path of the input image file, or the image as bytes, a file object or an array.
     image: The input image.
+    workers: The number of threads filtering strips of the image at the same time.
+    precision: "uint8" (rounded results) or "float32" (unrounded results).
+    progress: Called as progress(rows, total) while filtering, or None (see tiled_filter).
 
     Methods:
     __init__: The constructor method used to initialize the class attributes.
@@ -23,20 +28,28 @@ class AverageFilter:
     new_image_size: The method used to get the size of the new image.
     """
 
-    def __init__(self, input_path=None):
+    def __init__(self, input_path=None, workers=1, precision="uint8", progress=None):
         """Constructor Documentation
         This method is used to initialize the class attributes.
 
         Args:
-        input_path: The path of the input image file.
+        input_path: The path of the input image file, or the image as bytes, a file object or an array.
+        workers: The number of threads filtering strips of the image at the same time (default 1).
+        precision: "uint8" for rounded uint8 results (default) or "float32" for unrounded float32 results.
+        progress: Called as progress(rows, total) while filtering (default None).
 
         Returns:
         None
         """
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        self.workers = workers
+        self.precision = check_precision(precision)
+        self.progress = progress
         self.input_path = input_path
-        if input_path:
+        if input_path is not None:
             try:
-                self.image = Image.open(input_path).convert("L")
+                self.image = open_image(input_path).convert("L")
             except FileNotFoundError:
                 print("File not found. Please provide a valid path.")
                 sys.exit(1)
@@ -48,7 +61,7 @@ class AverageFilter:
         This function applies an average filter to an image or array using different edge-handling methods.
 
         Args:
-        image_array: The input 2D array (image or custom array).
+        image_array: The input 2D or 3D array (image or custom array).
         size: The size of the neighborhood (e.g., 3 for a 3x3 filter).
         method: The method for edge handling. Options are:
             - "padding": Add constant padding (default is 0)
@@ -58,42 +71,70 @@ class AverageFilter:
             - "symmetric": Symmetrically mirror the edge values
 
         Returns:
-        filtered_img: The filtered image/array.
+        filtered_img: The filtered image/array, as uint8 or float32 (see precision).
         """
-        pad = size // 2
-
-        # Handle different padding methods
-        if method == "padding":
-            padded_img = np.pad(image_array, pad, mode="constant", constant_values=0)
-        elif method == "reflect":
-            padded_img = np.pad(image_array, pad, mode="reflect")
-        elif method == "edge":
-            padded_img = np.pad(image_array, pad, mode="edge")
-        elif method == "symmetric":
-            padded_img = np.pad(image_array, pad, mode="symmetric")
-        elif method == "crop":
-            filtered_img = np.zeros(
-                (image_array.shape[0] - 2 * pad, image_array.shape[1] - 2 * pad)
-            )
-            # Apply filter with no padding (direct crop)
-            for i in range(pad, image_array.shape[0] - pad):
-                for j in range(pad, image_array.shape[1] - pad):
-                    window = image_array[i - pad : i + pad + 1, j - pad : j + pad + 1]
-                    filtered_img[i - pad, j - pad] = np.mean(window)
-            return filtered_img.astype(np.uint8)
+
+        # each strip is padded at the true border only and filtered in valid mode
+        return tiled_filter(
+            image_array,
+            size,
+            method,
+            self.strip_kernel(),
+            out_dtype=PRECISIONS[self.precision],
+            workers=self.workers,
+            progress=self.progress,
+        )
+
+    def strip_kernel(self):
+        """Function Documentation
+        This function builds the kernel(strip, window) that tiled_filter runs on each strip.
+
+        Returns:
+        kernel: The mean of every fully covered window of a strip.
+        """
+
+        def kernel(strip, window):
+            sums = self._box_sum(strip, window)
+            n = window * window
+            if not np.issubdtype(sums.dtype, np.integer):
+                return sums / n
+            if self.precision == "uint8":
+                # mean rounded half up, without leaving integers
+                return (sums + n // 2) // n
+            return sums.astype(np.float32) / np.float32(n)
+
+        return kernel
+
+    def _box_sum(self, padded_img, size):
+        """Function Documentation
+        This function sums every size x size window of an array with separable running sums.
+        Each axis is reduced with a cumulative sum and a single subtraction, so the cost
+        per pixel does not depend on the window size.
+
+        Args:
+        padded_img: The input 2D or 3D array (channels last), already padded if needed.
+        size: The size of the window.
+
+        Returns:
+        window_sums: The window sums, of shape (rows - size + 1, cols - size + 1[, channels]).
+        """
+        if np.issubdtype(padded_img.dtype, np.floating):
+            acc_dtype = np.float64
+        elif padded_img.dtype.itemsize == 1 and 255 * size * size < 2**31:
+            # the running sums may wrap around, but differences of wrapped
+            # sums are exact as long as every window sum fits in int32
+            acc_dtype = np.int32
         else:
-            raise ValueError(
-                "Invalid method. Choose from 'padding', 'reflect', 'edge', 'symmetric', 'crop'."
-            )
+            acc_dtype = np.int64
 
-        # Applying the filter to the padded image
-        filtered_img = np.zeros_like(image_array)
-        for i in range(image_array.shape[0]):
-            for j in range(image_array.shape[1]):
-                window = padded_img[i : i + size, j : j + size]
-                filtered_img[i, j] = np.mean(window)
+        csum = np.cumsum(padded_img, axis=0, dtype=acc_dtype)
+        row_sums = csum[size - 1 :].copy()
+        row_sums[1:] -= csum[:-size]
 
-        return filtered_img.astype(np.uint8)
+        csum = np.cumsum(row_sums, axis=1, dtype=acc_dtype)
+        window_sums = csum[:, size - 1 :].copy()
+        window_sums[:, 1:] -= csum[:, :-size]
+        return window_sums
 
     def process_image(self, size=3, method="padding"):
         """Function Documentation
@@ -121,11 +162,13 @@ class AverageFilter:
 
         filtered_image = Image.fromarray(filtered_image_array.astype(np.uint8))
 
-        output_dir = "filtered"
-        os.makedirs(output_dir, exist_ok=True)
+        # in-memory sources (bytes, arrays, file objects) are not written to disk
+        if isinstance(self.input_path, (str, os.PathLike)):
+            output_dir = "filtered"
+            os.makedirs(output_dir, exist_ok=True)
 
-        output_path = f"{output_dir}/{os.path.basename(self.input_path).split('.')[0]}_average_filtered.jpg"
-        filtered_image.save(output_path)
+            output_path = f"{output_dir}/{os.path.basename(self.input_path).split('.')[0]}_average_filtered.jpg"
+            filtered_image.save(output_path)
 
         return filtered_image
 
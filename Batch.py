@@ -0,0 +1,420 @@
+"""
+Module Documentation:
+This module runs one filter or compression setting over many images.
+Images flow through a three-stage pipeline:
+1. Decode: a few images ahead of processing, on a small thread pool.
+2. Process: the filter or compression, on a WorkerPool (or inline).
+3. Encode & write: the result is written atomically next to its siblings.
+
+Every finished image is appended to manifest.jsonl in the output directory
+with its timings. A rerun skips images whose output already exists, so an
+interrupted batch resumes where it stopped.
+
+Usage:
+python Batch.py images/ out/ --operation filter --filter-type "Median Filter" --kernel-size 5
+python Batch.py "scans/*.png" out/ --operation compress --quality 60 --workers 4
+"""
+
+import argparse
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from Image_IO import load_pixels, encode_image
+from JPEG_Compression import SUBSAMPLING
+from Pipeline import normalize_spec
+from Worker_Pool import (
+    FILTER_TYPES,
+    PoolSaturated,
+    WorkerPool,
+    run_compress,
+    run_filter,
+)
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff", ".webp")
+
+# output suffix of each operation, as process_image names its files
+SUFFIXES = {
+    "Median Filter": "median_filtered",
+    "Average Filter": "average_filtered",
+    "Gauss Filter": "gauss_filtered",
+    "Min-Max Filter": "minmax_filtered",
+}
+
+MANIFEST = "manifest.jsonl"
+
+# seconds between attempts to get a slot of a saturated worker pool
+BUSY_WAIT = 0.05
+
+
+def normalize_params(operation, params):
+    """
+    Function Documentation:
+    Validate the parameters of a batch and fill in their defaults
+    Args:
+    operation: "filter" or "compress"
+    params: For filters, a dict as for Pipeline.normalize_spec; for compression,
+    quality, subsampling and at most one of target_size and target_psnr
+    Returns:
+    A new dict of keyword arguments of run_filter (with filter_type) or run_compress
+    """
+    if not isinstance(params, dict):
+        raise ValueError("params must be an object")
+    if operation == "filter":
+        if params.get("filter_type") not in FILTER_TYPES:
+            raise ValueError(f"filter_type must be one of {FILTER_TYPES}")
+        return normalize_spec(params)
+    if operation != "compress":
+        raise ValueError("operation must be 'filter' or 'compress'")
+
+    unknown = set(params) - {"quality", "subsampling", "target_size", "target_psnr"}
+    if unknown:
+        raise ValueError(f"Unknown compress params: {sorted(unknown)}")
+    normalized = {
+        "quality": int(params.get("quality", 50)),
+        "subsampling": params.get("subsampling", "4:2:0"),
+        "target_size": None,
+        "target_psnr": None,
+    }
+    if normalized["subsampling"] not in SUBSAMPLING:
+        raise ValueError(f"subsampling must be one of {tuple(SUBSAMPLING)}")
+    for name, kind in (("target_size", int), ("target_psnr", float)):
+        if params.get(name) is not None:
+            normalized[name] = kind(params[name])
+    if normalized["target_size"] is not None and normalized["target_psnr"] is not None:
+        raise ValueError("Give target_size or target_psnr, not both")
+    return normalized
+
+
+def find_images(source):
+    """
+    Function Documentation:
+    List the images of a directory (recursively) or of a glob pattern
+    Args:
+    source: A directory or a glob pattern
+    Returns:
+    root: The directory the output layout is relative to
+    paths: The sorted image paths
+    """
+    if os.path.isdir(source):
+        root = source
+        paths = [
+            os.path.join(folder, name)
+            for folder, _, names in os.walk(source)
+            for name in names
+        ]
+    else:
+        paths = glob.glob(source, recursive=True)
+        root = os.path.commonpath([os.path.dirname(p) for p in paths]) if paths else ""
+    paths = sorted(
+        p for p in paths if os.path.isfile(p) and p.lower().endswith(IMAGE_EXTENSIONS)
+    )
+    return root, paths
+
+
+def atomic_write(path, data):
+    """Write bytes to a temporary file and move it into place in one step."""
+    folder = os.path.dirname(path) or "."
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=folder, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+class BatchProcessor:
+    """
+    Class Documentation:
+    Apply one parameter set to many images.
+    Args:
+    operation: "filter" or "compress"
+    params: The parameters of every image, see normalize_params
+    output_dir: Directory of the results and the manifest
+    workers: Images processed at the same time
+    prefetch: Images decoded ahead of the workers
+    pool: WorkerPool running the processing; None processes inline. While
+    it is saturated (by other users of the pool) images wait for a slot.
+
+    Attributes:
+    operation, output_dir, workers, prefetch, pool: As given.
+    params: The normalized parameters.
+    """
+
+    def __init__(self, operation, params, output_dir, workers=1, prefetch=2, pool=None):
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        self.operation = operation
+        self.params = normalize_params(operation, params)
+        self.output_dir = output_dir
+        self.workers = workers
+        self.prefetch = prefetch
+        self.pool = pool
+        self._manifest_lock = threading.Lock()
+
+    def output_path(self, root, path):
+        """
+        Function Documentation:
+        Where the result of an image is written
+        The layout below root is kept, so equal file names in different folders do not clash.
+        Args:
+        root: The directory the layout is relative to
+        path: The input image path
+        Returns:
+        The output path
+        """
+        relative = os.path.relpath(path, root) if root else os.path.basename(path)
+        stem = os.path.splitext(relative)[0]
+        if self.operation == "compress":
+            return os.path.join(self.output_dir, f"{stem}_compressed.jpg")
+        suffix = SUFFIXES[self.params["filter_type"]]
+        return os.path.join(self.output_dir, f"{stem}_{suffix}.png")
+
+    def check_manifest(self):
+        """Refuse to resume into an output directory made with other parameters."""
+        manifest = os.path.join(self.output_dir, MANIFEST)
+        if not os.path.exists(manifest):
+            return
+        with open(manifest) as f:
+            for line in f:
+                entry = json.loads(line)
+                if (
+                    entry["operation"] != self.operation
+                    or entry["params"] != self.params
+                ):
+                    raise ValueError(
+                        f"{self.output_dir} holds results of other parameters; "
+                        "use another output directory"
+                    )
+
+    def record(self, result):
+        """Append a finished image to the manifest."""
+        line = json.dumps(
+            {**result, "operation": self.operation, "params": self.params}
+        )
+        with self._manifest_lock:
+            with open(os.path.join(self.output_dir, MANIFEST), "a") as f:
+                f.write(line + "\n")
+
+    def process(self, pixels):
+        """Run the operation on decoded pixels; returns the encoded result."""
+        params = dict(self.params)
+        if self.operation == "compress":
+            if self.pool is not None:
+                encoded, _, _ = self.when_free(
+                    lambda: self.pool.compress(pixels, **params)
+                )
+            else:
+                encoded, _, _ = run_compress(pixels, **params)
+            return encoded
+
+        filter_type = params.pop("filter_type")
+        if self.pool is not None:
+            filtered = self.when_free(
+                lambda: self.pool.filter(pixels, filter_type, **params)
+            )
+        else:
+            filtered = run_filter(pixels, filter_type, **params)
+        return encode_image(filtered, "PNG")
+
+    @staticmethod
+    def when_free(func):
+        """Call func, waiting while the worker pool is saturated."""
+        while True:
+            try:
+                return func()
+            except PoolSaturated:
+                time.sleep(BUSY_WAIT)
+
+    def _run_one(self, path, output, decoded):
+        start = time.perf_counter()
+        pixels, decode_time = decoded.result()
+        waited = time.perf_counter() - start
+
+        start = time.perf_counter()
+        encoded = self.process(pixels)
+        process_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        atomic_write(output, encoded)
+        write_time = time.perf_counter() - start
+
+        result = {
+            "input": path,
+            "output": output,
+            "status": "done",
+            "decode_ms": round(decode_time * 1000, 1),
+            "wait_ms": round(waited * 1000, 1),
+            "process_ms": round(process_time * 1000, 1),
+            "write_ms": round(write_time * 1000, 1),
+            "bytes": len(encoded),
+        }
+        self.record(result)
+        return result
+
+    @staticmethod
+    def _decode(path):
+        start = time.perf_counter()
+        pixels = load_pixels(path)
+        return pixels, time.perf_counter() - start
+
+    def run(self, source, resume=True):
+        """
+        Function Documentation:
+        Process every image of a directory or glob pattern
+        Results are produced in input order while later images are decoded
+        and processed in the background.
+        Args:
+        source: A directory or a glob pattern
+        resume: Skip images whose output already exists
+        Returns:
+        A generator of one dict per image: input, output, status ("done",
+        "skipped" or "error") and, for processed images, timings in ms
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        if resume:
+            self.check_manifest()
+        root, paths = find_images(source)
+        # never pick up our own results when the output lies inside the source
+        output_dir = os.path.abspath(self.output_dir)
+        paths = [
+            p
+            for p in paths
+            if os.path.commonpath([os.path.abspath(p), output_dir]) != output_dir
+        ]
+
+        in_flight = self.workers + self.prefetch
+        pending = deque()
+        decoders = ThreadPoolExecutor(max_workers=max(self.prefetch, 1))
+        processors = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            for path in paths:
+                output = self.output_path(root, path)
+                if resume and os.path.exists(output):
+                    pending.append((path, output, None))
+                else:
+                    decoded = decoders.submit(self._decode, path)
+                    job = processors.submit(self._run_one, path, output, decoded)
+                    pending.append((path, output, job))
+                while len(pending) > in_flight or (pending and pending[0][2] is None):
+                    yield self._result(*pending.popleft())
+            while pending:
+                yield self._result(*pending.popleft())
+        finally:
+            # on interruption, finish the running images and drop the queued ones
+            decoders.shutdown(cancel_futures=True)
+            processors.shutdown(cancel_futures=True)
+
+    def _result(self, path, output, future):
+        if future is None:
+            return {"input": path, "output": output, "status": "skipped"}
+        try:
+            return future.result()
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            return {"input": path, "output": output, "status": "error", "error": error}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Apply one filter or compression setting to a directory or glob of images."
+    )
+    parser.add_argument("source", help="directory or glob pattern of input images")
+    parser.add_argument(
+        "output_dir", help="directory of the results and manifest.jsonl"
+    )
+    parser.add_argument("--operation", choices=("filter", "compress"), default="filter")
+    parser.add_argument("--filter-type", choices=FILTER_TYPES, default="Median Filter")
+    parser.add_argument("--kernel-size", type=int, default=3)
+    parser.add_argument(
+        "--method",
+        choices=("padding", "crop", "reflect", "edge", "symmetric"),
+        default="padding",
+    )
+    parser.add_argument("--sigma", type=float, default=None, help="Gauss Filter only")
+    parser.add_argument("--mode", choices=("min", "max", "range"), default="min")
+    parser.add_argument("--quality", type=int, default=50)
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument(
+        "--target-size", type=int, help="largest file size in bytes (searches quality)"
+    )
+    target.add_argument(
+        "--target-psnr", type=float, help="lowest PSNR in dB (searches quality)"
+    )
+    parser.add_argument(
+        "--subsampling", choices=("4:4:4", "4:2:2", "4:2:0"), default="4:2:0"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=os.cpu_count() or 1, help="worker processes"
+    )
+    parser.add_argument("--prefetch", type=int, default=2, help="images decoded ahead")
+    parser.add_argument(
+        "--no-resume",
+        action="store_true",
+        help="reprocess images that already have an output",
+    )
+    args = parser.parse_args(argv)
+
+    if args.operation == "compress":
+        params = {
+            "quality": args.quality,
+            "subsampling": args.subsampling,
+            "target_size": args.target_size,
+            "target_psnr": args.target_psnr,
+        }
+    else:
+        params = {
+            "filter_type": args.filter_type,
+            "size": args.kernel_size,
+            "method": args.method,
+        }
+        if args.filter_type == "Gauss Filter":
+            params["sigma"] = args.sigma
+        elif args.filter_type == "Min-Max Filter":
+            params["mode"] = args.mode
+
+    pool = WorkerPool(workers=args.workers, queue_size=args.prefetch)
+    processor = BatchProcessor(
+        args.operation,
+        params,
+        args.output_dir,
+        workers=max(args.workers, 1),
+        prefetch=args.prefetch,
+        pool=pool,
+    )
+
+    results = processor.run(args.source, resume=not args.no_resume)
+    counts = {"done": 0, "skipped": 0, "error": 0}
+    start = time.perf_counter()
+    try:
+        for result in results:
+            counts[result["status"]] += 1
+            if result["status"] == "done":
+                print(
+                    f"{result['input']}: decode {result['decode_ms']} ms, "
+                    f"process {result['process_ms']} ms, write {result['write_ms']} ms"
+                )
+            elif result["status"] == "error":
+                print(f"{result['input']}: error: {result['error']}")
+    except ValueError as e:
+        parser.error(str(e))
+    finally:
+        pool.shutdown()
+    elapsed = time.perf_counter() - start
+    print(
+        f"{counts['done']} processed, {counts['skipped']} skipped, "
+        f"{counts['error']} failed in {elapsed:.1f} s"
+    )
+    return 1 if counts["error"] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -2,18 +2,56 @@ from os import sys, makedirs
 from PIL import Image
 import numpy as np
 import os
+from Image_IO import open_image
+from Tiling import PRECISIONS, check_precision, tiled_filter
+from Precompute import gaussian_kernel, gaussian_kernel_1d
+from scipy.signal import fftconvolve
+
+
+def separable_correlate(padded_img, kernel_1d):
+    """Correlate rows then columns with kernel_1d in float32, keeping only fully covered pixels."""
+    size = kernel_1d.size
+    rows = padded_img.shape[0] - size + 1
+    cols = padded_img.shape[1] - size + 1
+
+    vertical = np.zeros((rows,) + padded_img.shape[1:], dtype=np.float32)
+    for k, weight in enumerate(kernel_1d):
+        vertical += weight * padded_img[k : k + rows]
+
+    filtered_img = np.zeros((rows, cols) + padded_img.shape[2:], dtype=np.float32)
+    for k, weight in enumerate(kernel_1d):
+        filtered_img += weight * vertical[:, k : k + cols]
+    return filtered_img
 
 
 class GaussFilter:
     """
     Applies a Gaussian (gauss) filter to an image or array.
+
+    The Gaussian kernel is separable, so small kernels run as two 1D passes
+    (rows, then columns). Large kernels on large images switch to FFT-based
+    convolution, whose cost does not grow with the kernel size.
+
+    With workers > 1, strips of the image are filtered on that many threads;
+    the result is identical to the single-threaded one.
+    Both engines accumulate in float32. With precision="uint8" (default) the
+    result is rounded to uint8; with precision="float32" it is returned unrounded.
+    An optional progress(rows, total) callback follows the strips (see tiled_filter).
     """
 
-    def __init__(self, input_path=None):
+    # relative per-pixel cost of an FFT pass, in units of log2(pixels)
+    _FFT_COST = 1.0
+
+    def __init__(self, input_path=None, workers=1, precision="uint8", progress=None):
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        self.workers = workers
+        self.precision = check_precision(precision)
+        self.progress = progress
         self.input_path = input_path
-        if input_path:
+        if input_path is not None:
             try:
-                self.image = Image.open(input_path).convert("L")
+                self.image = open_image(input_path).convert("L")
             except FileNotFoundError:
                 print("File not found. Please provide a valid path.")
                 sys.exit(1)
@@ -21,84 +59,74 @@ class GaussFilter:
             self.image = None
 
     def _gaussian_kernel(self, size=3, sigma=None):
-        if sigma is None:
-            sigma = size / 6.0 if size > 1 else 0.5
+        return gaussian_kernel(size, sigma)
+
+    def _gaussian_kernel_1d(self, size=3, sigma=None):
+        return gaussian_kernel_1d(size, sigma)
+
+    def _choose_engine(self, size, image_shape):
+        """
+        Separable passes cost about 2 * size operations per pixel, an FFT pass
+        about log2(pixels). Pick whichever is cheaper for this kernel and image.
+        """
+        pixels = image_shape[0] * image_shape[1]
+        if pixels > 1 and 2 * size > self._FFT_COST * np.log2(pixels):
+            return "fft"
+        return "separable"
+
+    def _separable_correlate(self, padded_img, kernel_1d):
+        return separable_correlate(padded_img, kernel_1d)
+
+    def _fft_correlate(self, padded_img, kernel):
+        """Correlate with the 2D kernel through the FFT, keeping only fully covered pixels."""
+        # convolution with the flipped kernel is correlation with the kernel
+        flipped = kernel[::-1, ::-1]
+        if padded_img.ndim == 3:
+            flipped = flipped[..., np.newaxis]
+        return fftconvolve(
+            padded_img.astype(np.float32), flipped, mode="valid", axes=(0, 1)
+        )
 
-        ax = np.arange(-size // 2 + 1.0, size // 2 + 1.0)
-        xx, yy = np.meshgrid(ax, ax)
-        kernel = np.exp(-(xx**2 + yy**2) / (2.0 * sigma**2))
-        kernel = kernel / np.sum(kernel)
-        return kernel
+    def gauss_filter_custom(
+        self, image_array, size=3, method="padding", sigma=None, engine="auto"
+    ):
+        """
+        method: padding | crop | reflect | edge | symmetric
+        engine: 'auto' | 'separable' | 'fft'
+        """
+        # each strip is padded at the true border only and filtered in valid mode
+        return tiled_filter(
+            image_array,
+            size,
+            method,
+            self.strip_kernel(size, sigma, engine, image_array.shape),
+            window=size,
+            out_dtype=PRECISIONS[self.precision],
+            workers=self.workers,
+            progress=self.progress,
+        )
 
-    def gauss_filter_custom(self, image_array, size=3, method="padding", sigma=None):
-        pad = size // 2
-        kernel = self._gaussian_kernel(size, sigma)
-        # Handle 2D (grayscale) and 3D (color) arrays differently when padding
-        if image_array.ndim == 3:
-            pad_width = ((pad, pad), (pad, pad), (0, 0))
-        else:
-            pad_width = ((pad, pad), (pad, pad))
-
-        if method == "padding":
-            padded_img = np.pad(
-                image_array, pad_width, mode="constant", constant_values=0
-            )
-        elif method == "reflect":
-            padded_img = np.pad(image_array, pad_width, mode="reflect")
-        elif method == "edge":
-            padded_img = np.pad(image_array, pad_width, mode="edge")
-        elif method == "symmetric":
-            padded_img = np.pad(image_array, pad_width, mode="symmetric")
-        elif method == "crop":
-            # Prepare output with channel awareness
-            if image_array.ndim == 3:
-                filtered_img = np.zeros(
-                    (
-                        image_array.shape[0] - 2 * pad,
-                        image_array.shape[1] - 2 * pad,
-                        image_array.shape[2],
-                    ),
-                    dtype=float,
-                )
-                for i in range(pad, image_array.shape[0] - pad):
-                    for j in range(pad, image_array.shape[1] - pad):
-                        window = image_array[
-                            i - pad : i + pad + 1, j - pad : j + pad + 1, :
-                        ]
-                        # apply kernel across spatial dims and keep channels
-                        filtered_img[i - pad, j - pad] = np.sum(
-                            window * kernel[..., np.newaxis], axis=(0, 1)
-                        )
-            else:
-                filtered_img = np.zeros(
-                    (image_array.shape[0] - 2 * pad, image_array.shape[1] - 2 * pad),
-                    dtype=float,
-                )
-                for i in range(pad, image_array.shape[0] - pad):
-                    for j in range(pad, image_array.shape[1] - pad):
-                        window = image_array[
-                            i - pad : i + pad + 1, j - pad : j + pad + 1
-                        ]
-                        filtered_img[i - pad, j - pad] = np.sum(window * kernel)
-            return filtered_img.astype(np.uint8)
+    def strip_kernel(self, size=3, sigma=None, engine="auto", image_shape=None):
+        """
+        The kernel(strip, window) tiled_filter runs on each strip, with a window of size.
+        image_shape: The shape of the whole image, for engine='auto'
+        """
+        if engine == "auto":
+            engine = self._choose_engine(size, image_shape)
+
+        if engine == "separable":
+            kernel_1d = self._gaussian_kernel_1d(size, sigma).astype(np.float32)
+            correlate = lambda strip: self._separable_correlate(strip, kernel_1d)
+        elif engine == "fft":
+            kernel_2d = self._gaussian_kernel(size, sigma).astype(np.float32)
+            correlate = lambda strip: self._fft_correlate(strip, kernel_2d)
         else:
-            raise ValueError(
-                "Invalid method. Choose from 'padding', 'reflect', 'edge', 'symmetric', 'crop'."
-            )
-
-        filtered_img = np.zeros_like(image_array, dtype=float)
-        for i in range(image_array.shape[0]):
-            for j in range(image_array.shape[1]):
-                if image_array.ndim == 3:
-                    window = padded_img[i : i + size, j : j + size, :]
-                    # kernel shape -> (size,size,1) to broadcast over channels
-                    vals = np.sum(window * kernel[..., np.newaxis], axis=(0, 1))
-                    filtered_img[i, j] = vals
-                else:
-                    window = padded_img[i : i + size, j : j + size]
-                    filtered_img[i, j] = np.sum(window * kernel)
-
-        return np.clip(filtered_img, 0, 255).astype(np.uint8)
+            raise ValueError("engine must be 'auto', 'separable' or 'fft'")
+
+        def kernel(strip, window):
+            return np.clip(correlate(strip), 0, 255)
+
+        return kernel
 
     def process_image(self, size=3, method="padding", sigma=None):
         if self.image is None:
@@ -110,11 +138,13 @@ class GaussFilter:
         )
         filtered_image = Image.fromarray(filtered_image_array.astype(np.uint8))
 
-        output_dir = "filtered"
-        os.makedirs(output_dir, exist_ok=True)
+        # in-memory sources (bytes, arrays, file objects) are not written to disk
+        if isinstance(self.input_path, (str, os.PathLike)):
+            output_dir = "filtered"
+            os.makedirs(output_dir, exist_ok=True)
 
-        output_path = f"{output_dir}/{os.path.basename(self.input_path).split('.')[0]}_gauss_filtered.jpg"
-        filtered_image.save(output_path)
+            output_path = f"{output_dir}/{os.path.basename(self.input_path).split('.')[0]}_gauss_filtered.jpg"
+            filtered_image.save(output_path)
 
         return filtered_image
 
@@ -0,0 +1,90 @@
+"""
+Module Documentation:
+This module decodes and encodes images in memory, so the filter and
+compression classes can work on uploads without temporary files.
+A source can be a file path, encoded bytes, a binary file object, a PIL image
+or a NumPy pixel array.
+"""
+
+import io
+import numpy as np
+from PIL import Image
+
+
+def open_image(source):
+    """
+    Function Documentation:
+    Open an image from a path, bytes, a file object, a PIL image or an array
+    The pixels are decoded right away, so byte buffers and file objects can be
+    released after the call.
+    Args:
+    source: The image source
+    Returns:
+    image: The PIL image
+    """
+    if isinstance(source, Image.Image):
+        return source
+    if isinstance(source, np.ndarray):
+        return Image.fromarray(source)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    image = Image.open(source)
+    image.load()
+    return image
+
+
+def load_pixels(source):
+    """
+    Function Documentation:
+    Decode an image into the pixel array the filters and Compressor work on
+    Palette and other modes without a direct array form are converted to RGB.
+    Args:
+    source: The image source, as for open_image
+    Returns:
+    The pixel array (2D for "L", 3D for "RGB" and "RGBA")
+    """
+    image = open_image(source)
+    if image.mode not in ("L", "RGB", "RGBA"):
+        image = image.convert("RGB")
+    return np.array(image)
+
+
+def downscale(image_array, max_side):
+    """
+    Function Documentation:
+    Shrink an image so that its longer side is at most max_side
+    Large images are first decimated by an integer step, then box-filtered to
+    the exact size, which keeps the cost low for very large inputs.
+    Args:
+    image_array: The 2D or 3D pixel array
+    max_side: The longest side of the result in pixels
+    Returns:
+    small: The downscaled array (the input itself when it is small enough)
+    scale: The size of small relative to the input
+    """
+    height, width = image_array.shape[:2]
+    if max(height, width) <= max_side:
+        return image_array, 1.0
+    scale = max_side / max(height, width)
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    # leave at least a factor of 2 to the box filter, to limit aliasing
+    step = max(1, int(1 / scale) // 2)
+    decimated = np.ascontiguousarray(image_array[::step, ::step])
+    small = Image.fromarray(decimated).resize(size, Image.BOX)
+    return np.asarray(small), scale
+
+
+def encode_image(image_array, format="PNG", **options):
+    """
+    Function Documentation:
+    Encode a pixel array into image file bytes
+    Args:
+    image_array: The 2D or 3D array to encode (converted to uint8)
+    format: The PIL format name, e.g. "PNG" or "JPEG"
+    options: Encoder options for PIL, e.g. compress_level=1 for a fast PNG
+    Returns:
+    The encoded file as bytes
+    """
+    buf = io.BytesIO()
+    Image.fromarray(image_array.astype(np.uint8)).save(buf, format=format, **options)
+    return buf.getvalue()
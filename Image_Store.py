@@ -0,0 +1,178 @@
+"""
+Module Documentation:
+This module keeps decoded uploads in memory under an ID, so a client can
+upload an image once and then run many filters or compressions on it
+without sending or decoding the file again.
+
+Images are kept in least-recently-used order, within a total size in bytes,
+and expire after a time without use. The downscaled copies kept for previews
+count toward the size of their image.
+
+Configuration (environment variables):
+DIP_STORE_BYTES: Total size of the stored pixel arrays and previews (default: 512 MB).
+DIP_STORE_TTL: Seconds an unused image is kept (default: 1800).
+"""
+
+import functools
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from Image_IO import downscale
+
+
+class StoredImage:
+    """
+    Class Documentation:
+    One uploaded image.
+
+    Attributes:
+    pixels: The decoded pixel array.
+    digest: Hex SHA-256 of the uploaded file, as used by ResultCache.
+    file_size: Size of the uploaded file in bytes.
+    nbytes: Size of the pixel array and the previews kept with it.
+    """
+
+    def __init__(self, pixels, digest, file_size, on_grow=None):
+        self.pixels = pixels
+        self.digest = digest
+        self.file_size = file_size
+        self.nbytes = pixels.nbytes
+        self.last_used = time.monotonic()
+        self._previews = {}
+        self._on_grow = on_grow
+        self._lock = threading.Lock()
+
+    def preview(self, max_side):
+        """
+        Function Documentation:
+        The image downscaled for previews, computed once per size
+        Args:
+        max_side: The longest side of the preview in pixels
+        Returns:
+        The (pixels, scale) pair of Image_IO.downscale
+        """
+        with self._lock:
+            if max_side in self._previews:
+                return self._previews[max_side]
+            small, scale = self._previews[max_side] = downscale(self.pixels, max_side)
+            # a small image is its own preview and costs nothing more
+            grown = 0 if small is self.pixels else small.nbytes
+        if grown and self._on_grow is not None:
+            self._on_grow(self, grown)
+        elif grown:
+            self.nbytes += grown
+        return small, scale
+
+
+class ImageStore:
+    """
+    Class Documentation:
+    A bounded LRU of decoded images with a time-to-live.
+    Args:
+    max_bytes: Total size of the stored pixel arrays and previews in bytes.
+    ttl: Seconds an image is kept after it was last used.
+
+    Attributes:
+    max_bytes: Total size of the stored pixel arrays and previews in bytes.
+    ttl: Seconds an image is kept after it was last used.
+    """
+
+    def __init__(self, max_bytes=None, ttl=None):
+        if max_bytes is None:
+            max_bytes = int(os.environ.get("DIP_STORE_BYTES", 512 << 20))
+        if ttl is None:
+            ttl = float(os.environ.get("DIP_STORE_TTL", 1800))
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._images = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def add(self, pixels, digest, file_size):
+        """
+        Function Documentation:
+        Store a decoded image, evicting the least recently used ones if needed
+        Args:
+        pixels: The decoded pixel array
+        digest: Hex SHA-256 of the uploaded file
+        file_size: Size of the uploaded file in bytes
+        Returns:
+        The image ID
+        """
+        if pixels.nbytes > self.max_bytes:
+            raise MemoryError("Image is too large to keep on the server")
+        image_id = uuid.uuid4().hex
+        with self._lock:
+            self._expire()
+            self._images[image_id] = StoredImage(
+                pixels,
+                digest,
+                file_size,
+                on_grow=functools.partial(self._grown, image_id),
+            )
+            self._bytes += pixels.nbytes
+            self._evict()
+        return image_id
+
+    def _grown(self, image_id, entry, nbytes):
+        # a preview was added to entry, which may have been evicted meanwhile;
+        # both sizes change under the lock so that _remove subtracts the same
+        with self._lock:
+            entry.nbytes += nbytes
+            if self._images.get(image_id) is entry:
+                self._bytes += nbytes
+                self._evict()
+
+    def get(self, image_id):
+        """
+        Function Documentation:
+        Look up a stored image and mark it as used
+        Args:
+        image_id: An ID returned by add
+        Returns:
+        The StoredImage, or None if it is unknown or expired
+        """
+        with self._lock:
+            self._expire()
+            entry = self._images.get(image_id)
+            if entry is not None:
+                entry.last_used = time.monotonic()
+                self._images.move_to_end(image_id)
+            return entry
+
+    def discard(self, image_id):
+        """Forget a stored image; unknown IDs are ignored."""
+        with self._lock:
+            if image_id in self._images:
+                self._remove(image_id)
+
+    def _remove(self, image_id):
+        self._bytes -= self._images.pop(image_id).nbytes
+
+    def _evict(self):
+        # least recently used first; the entry in use was just moved to the end
+        while self._bytes > self.max_bytes and self._images:
+            self._remove(next(iter(self._images)))
+
+    def _expire(self):
+        # entries are in order of last use, so expired ones are at the front
+        deadline = time.monotonic() - self.ttl
+        while self._images:
+            image_id, entry = next(iter(self._images.items()))
+            if entry.last_used > deadline:
+                break
+            self._remove(image_id)
+
+    def stats(self):
+        """
+        Function Documentation:
+        Number and total size of the stored images
+        Returns:
+        A dict of images and bytes
+        """
+        with self._lock:
+            self._expire()
+            return {"images": len(self._images), "bytes": self._bytes}
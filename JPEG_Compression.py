@@ -4,7 +4,7 @@ This module is used to apply JPEG compression to an image.
 The JPEG compression is a lossy compression technique.
 It is based on the fact that the human eye is less sensitive to high-frequency components.
 Steps of JPEG compression:
-1. Convert the image to YCbCr color space.
+1. Convert the image to YCbCr color space (and subsample the chroma planes).
 2. Apply DCT to the image.
 3. Quantize the DCT coefficients.
 4. Huffman encode & run-length encode the quantized coefficients.
@@ -12,39 +12,135 @@ Steps of JPEG compression:
 6. Decode the encoded coefficients.
 7. Dequantize the coefficients.
 8. Apply IDCT to the coefficients.
-9. Convert the image back to RGB color space.
+9. Upsample the chroma planes and convert the image back to RGB color space.
+
+Instead of a fixed quality, compress() can take a target file size or PSNR:
+the quality is then found by a binary search that runs the DCT only once and
+re-quantizes the kept coefficients for every probe (see compress_to_target).
 """
 
 from os import sys
+import functools
+import io
 import numpy as np
 from PIL import Image
 from scipy.fftpack import dct  as DCT
 from scipy.fftpack import idct  as IDCT
+from JPEG_Encoder import JPEGEncoder, Component, parallel_map
+from Image_IO import open_image
+from Precompute import quant_tables
+from Metrics import Timings
+from Quality_Metrics import mse
+
+# 2D DCT of a flattened 8x8 block as a single 64x64 matrix, so a whole stack
+# of blocks is transformed by one matrix product
+DCT_MATRIX = DCT(np.eye(8), axis=0, norm='ortho')
+DCT_BASIS = np.kron(DCT_MATRIX, DCT_MATRIX)
+
+# JFIF (full-range BT.601) colour transform
+RGB_TO_YCBCR = np.array([[0.299, 0.587, 0.114],
+                         [-0.168736, -0.331264, 0.5],
+                         [0.5, -0.418688, -0.081312]])
+YCBCR_TO_RGB = np.array([[1.0, 0.0, 1.402],
+                         [1.0, -0.344136, -0.714136],
+                         [1.0, 1.772, 0.0]])
+
+# blocks transformed per batch; the batches are the same for any number of
+# workers, so parallel and serial runs give identical coefficients
+BLOCK_CHUNK = 4096
+
+# luminance sampling factors (horizontal, vertical) relative to chrominance
+SUBSAMPLING = {"4:4:4": (1, 1), "4:2:2": (2, 1), "4:2:0": (2, 2)}
+
+# blocks quantized (and coded) by each probe of a rate search
+SAMPLE_BLOCKS = 4096
+
+# measurements over every block a rate search may run to correct its estimates
+TARGET_RETRIES = 4
+
+def mse_limit(target_psnr):
+    """The largest mean squared error of 8-bit samples with a PSNR of at least target_psnr dB."""
+    return 255 ** 2 / 10 ** (target_psnr / 10)
+
+def bisect_quality(accept, highest, largest=False):
+    """
+    Function Documentation:
+    Binary search over the qualities 1..highest
+    Args:
+    accept: Function of a quality, monotonic in it
+    highest: The highest quality
+    largest: Find the largest accepted quality (accept turns False as the quality grows)
+    instead of the smallest (accept turns True)
+    Returns:
+    The quality found; the closest end of the range when none is accepted
+    """
+    low, high = 1, highest
+    while low < high:
+        if largest:
+            middle = (low + high + 1) // 2
+            if accept(middle):
+                low = middle
+            else:
+                high = middle - 1
+        else:
+            middle = (low + high) // 2
+            if accept(middle):
+                high = middle
+            else:
+                low = middle + 1
+    return low
 
 class Compressor:
     """
     Class Documentation:
     This class is used to apply JPEG compression to an image.
     Args:
-    image_path: The path of the input image file.
+    image_path: The path of the input image file, or the image as bytes, a file object or an array.
     quality: The quality of the compressed image.
+    optimize: Use Huffman tables optimized for the image instead of the standard ones.
+    subsampling: Chroma subsampling of colour images: "4:4:4", "4:2:2" or "4:2:0".
+    workers: Number of threads transforming and coding blocks at the same time.
 
     Attributes:
     quality: The quality of the compressed image.
-    image_path: The path of the input image file.
-    quant_matrix: The quantization matrix.
+    image_path: The path of the input image file, or the in-memory image it was given.
+    subsampling: Chroma subsampling of colour images.
+    quant_matrix: The quantization matrix (luminance).
+    chroma_quant_matrix: The quantization matrix of the Cb and Cr planes.
     image: The input image.
+    encoder: The JPEGEncoder that writes the entropy-coded file.
+    encoded: The bytes of the last compressed file.
+    target_met: Whether the last compression to a target met it (None for a fixed quality).
+    timings: The stage durations (color, dct, quantize, encode, idct, save, search) of the last compression.
+    workers: Number of threads transforming and coding blocks at the same time.
+    coefficients: The DCT blocks of the "luma" and "chroma" planes kept by a rate search, else empty.
+    planes: The "luma" (and "chroma") planes of the last compression.
     """
-    def __init__(self,image_path, quality=100):
+    def __init__(self,image_path, quality=100, optimize=False, subsampling="4:2:0", workers=1):
         """
         Function Documentation:
         The constructor method used to initialize the class attributes.
         Args:
-        image_path: The path of the input image file.
+        image_path: The path of the input image file, or the image as bytes, a file object or an array.
         quality: The quality of the compressed image.
+        optimize: Use Huffman tables optimized for the image.
+        subsampling: Chroma subsampling of colour images: "4:4:4", "4:2:2" or "4:2:0".
+        workers: Number of threads transforming and coding blocks at the same time.
         """
+        if subsampling not in SUBSAMPLING:
+            raise ValueError("subsampling must be '4:4:4', '4:2:2' or '4:2:0'")
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
         self.quality = quality
         self.image_path = image_path
+        self.subsampling = subsampling
+        self.workers = workers
+        self.encoder = JPEGEncoder(optimize=optimize, workers=workers)
+        self.encoded = None
+        self.target_met = None
+        self.timings = Timings()
+        self.coefficients = {}
+        self.planes = {}
         self.quant_matrix = np.array([[16, 11, 10, 16, 24, 40, 51, 61],
                                       [12, 12, 14, 19, 26, 58, 60, 55],
                                       [14, 13, 16, 24, 40, 57, 69, 56],
@@ -53,11 +149,22 @@ class Compressor:
                                       [24, 35, 55, 64, 81, 104, 113, 92],
                                       [49, 64, 78, 87, 103, 121, 120, 101],
                                       [72, 92, 95, 98, 112, 100, 103, 99]])
+        self.chroma_quant_matrix = np.array([[17, 18, 24, 47, 99, 99, 99, 99],
+                                             [18, 21, 26, 66, 99, 99, 99, 99],
+                                             [24, 26, 56, 99, 99, 99, 99, 99],
+                                             [47, 66, 99, 99, 99, 99, 99, 99],
+                                             [99, 99, 99, 99, 99, 99, 99, 99],
+                                             [99, 99, 99, 99, 99, 99, 99, 99],
+                                             [99, 99, 99, 99, 99, 99, 99, 99],
+                                             [99, 99, 99, 99, 99, 99, 99, 99]])
         try :
-            self.image = Image.open(self.image_path)
+            self.image = open_image(self.image_path)
         except FileNotFoundError:
             print("File not found")
             sys.exit(1)
+        # palette, alpha and other modes are compressed as RGB
+        if self.image.mode not in ("L", "RGB"):
+            self.image = self.image.convert("RGB")
 
     def apply_dct(self, sub_image):
         """
@@ -65,67 +172,560 @@ class Compressor:
         apply Discrete Cosine Transform to the sub-image block
         
         Args:
-        sub_image: The sub-image block
+        sub_image: The sub-image block, or a stack of blocks of shape (N, 8, 8)
         Returns:
-        The DCT coefficients of the sub-image block
+        The DCT coefficients of the sub-image block(s)
         """
-        return DCT(DCT(sub_image.T, norm='ortho').T, norm='ortho')
+        if sub_image.shape[-2:] == (8, 8):
+            flat = sub_image.reshape(-1, 64) @ DCT_BASIS.T
+            return flat.reshape(sub_image.shape)
+        return DCT(DCT(sub_image, axis=-1, norm='ortho'), axis=-2, norm='ortho')
 
     def apply_idct(self, sub_image):
         """
         Function Documentation:
         apply Inverse Discrete Cosine Transform to the sub-image
         Args:
-        sub_image: The sub-image block
+        sub_image: The sub-image block, or a stack of blocks of shape (N, 8, 8)
         Returns:
-        The IDCT coefficients of the sub-image block
+        The IDCT coefficients of the sub-image block(s)
         """
-        return IDCT(IDCT(sub_image.T, norm='ortho').T, norm='ortho')
+        if sub_image.shape[-2:] == (8, 8):
+            flat = sub_image.reshape(-1, 64) @ DCT_BASIS
+            return flat.reshape(sub_image.shape)
+        return IDCT(IDCT(sub_image, axis=-1, norm='ortho'), axis=-2, norm='ortho')
 
-    def quantize(self, sub_image):
+    def quantize(self, sub_image, quant_matrix=None, quality=None):
         """
         Function Documentation:
         Quantize the DCT coefficients
         Args:
-        sub_image: The sub-image block (8x8)
+        sub_image: The sub-image block (8x8), or a stack of blocks of shape (N, 8, 8)
+        quant_matrix: The quantization matrix to scale (default: quant_matrix)
+        quality: The quality to scale it by (default: self.quality)
         Returns:
-        The quantized sub-image block
+        The quantized sub-image block(s)
         """
-        ret = sub_image
-        for i in range(min(8,sub_image.shape[0])):
-            for j in range(min(8,sub_image.shape[1])):
-                ret[i, j] = np.round(sub_image[i, j] / (self.quant_matrix[i, j] * self.quality / 100))
-        return ret
+        h, w = sub_image.shape[-2:]
+        reciprocal = self.quant_tables(quant_matrix, quality)[1]
+        quantized = np.round(sub_image * reciprocal[:h, :w])
+        # baseline JPEG codes AC magnitudes on at most 10 bits
+        return np.clip(quantized, -1023, 1023)
 
-    def dequantize(self, sub_image):
+    def dequantize(self, sub_image, quant_matrix=None, quality=None):
         """
         Function Documentation:
         Dequantize the sub-image block (8x8)
         Args:
-        sub_image: The sub-image block
+        sub_image: The sub-image block, or a stack of blocks of shape (N, 8, 8)
+        quant_matrix: The quantization matrix to scale (default: quant_matrix)
+        quality: The quality to scale it by (default: self.quality)
         Returns:
-        The dequantized sub-image block
+        The dequantized sub-image block(s)
         """
-        ret = sub_image
-        for i in range(min(8,sub_image.shape[0])):
-            for j in range(min(8,sub_image.shape[1])):
-                ret[i, j] = sub_image[i, j] * (self.quant_matrix[i, j] * self.quality / 100)
-        return ret
-    
+        h, w = sub_image.shape[-2:]
+        return sub_image * self.quant_tables(quant_matrix, quality)[0][:h, :w]
 
-    def save_image(self, compressed_image):
+    def quant_tables(self, quant_matrix=None, quality=None):
+        """
+        Function Documentation:
+        The scaled quantization table and its reciprocal, computed once per table and quality
+        Args:
+        quant_matrix: The quantization matrix to scale (default: quant_matrix)
+        quality: The quality to scale it by (default: self.quality)
+        Returns:
+        The (scaled, reciprocal) tables from Precompute.quant_tables
+        """
+        if quant_matrix is None:
+            quant_matrix = self.quant_matrix
+        return quant_tables(quant_matrix, self.quality if quality is None else quality)
+
+    def scaled_quant_matrix(self, quant_matrix=None, quality=None):
+        """
+        Function Documentation:
+        The quantization matrix scaled by the quality, as written to the JPEG file
+        Baseline JPEG stores 8-bit integer steps, so the scaled steps are rounded
+        and kept in [1, 255].
+        Args:
+        quant_matrix: The quantization matrix to scale (default: quant_matrix)
+        quality: The quality to scale it by (default: self.quality)
+        Returns:
+        The 8x8 integer quantization table (read-only)
+        """
+        return self.quant_tables(quant_matrix, quality)[0]
+
+    def split_blocks(self, planes):
+        """
+        Function Documentation:
+        Cut image planes into a stack of 8x8 blocks
+        Planes whose height or width is not a multiple of 8 are extended by
+        repeating their last row/column, as baseline JPEG encoders do.
+        Args:
+        planes: Array of shape (C, h, w)
+        Returns:
+        blocks: Array of shape (C * ceil(h/8) * ceil(w/8), 8, 8), plane by plane in raster order
+        """
+        c, h, w = planes.shape
+        padded = np.pad(planes, ((0, 0), (0, -h % 8), (0, -w % 8)), mode='edge')
+        rows, cols = padded.shape[1] // 8, padded.shape[2] // 8
+        blocks = padded.reshape(c, rows, 8, cols, 8).transpose(0, 1, 3, 2, 4)
+        return blocks.reshape(-1, 8, 8)
+
+    def merge_blocks(self, blocks, shape):
+        """
+        Function Documentation:
+        Inverse of split_blocks
+        Args:
+        blocks: Array of shape (N, 8, 8) as returned by split_blocks
+        shape: The (C, h, w) shape of the planes that were split
+        Returns:
+        planes: Array of shape (C, h, w)
+        """
+        c, h, w = shape
+        rows, cols = -(-h // 8), -(-w // 8)
+        planes = blocks.reshape(c, rows, cols, 8, 8).transpose(0, 1, 3, 2, 4)
+        return planes.reshape(c, rows * 8, cols * 8)[:, :h, :w]
+
+    def map_blocks(self, func, blocks):
+        """
+        Function Documentation:
+        Apply a block-wise function to a stack of blocks, BLOCK_CHUNK blocks at a time
+        The batches run on self.workers threads and are written into one output array.
+        Args:
+        func: Function of a (n, 8, 8) stack returning a (n, 8, 8) stack
+        blocks: Array of shape (N, 8, 8)
+        Returns:
+        Array of shape (N, 8, 8), as floats
+        """
+        out = np.empty(blocks.shape)
+        def run(start):
+            out[start:start + BLOCK_CHUNK] = func(blocks[start:start + BLOCK_CHUNK])
+        for _ in parallel_map(run, range(0, len(blocks), BLOCK_CHUNK), self.workers):
+            pass
+        return out
+
+    def dct_planes(self, planes):
+        """
+        Function Documentation:
+        Level-shift and DCT every 8x8 block of the planes, without quantizing
+        Args:
+        planes: Array of shape (C, h, w) with samples in [0, 255]
+        Returns:
+        The DCT coefficients, shape (N, 8, 8), as returned by split_blocks
+        """
+        blocks = self.split_blocks(planes.astype(float) - 128)
+        def transform(chunk):
+            with self.timings.stage("dct"):
+                return self.apply_dct(chunk)
+        return self.map_blocks(transform, blocks)
+
+    def transform_planes(self, planes, quant_matrix=None, coefficients=None, quality=None):
+        """
+        Function Documentation:
+        Level-shift, DCT and quantize every 8x8 block of the planes at once
+        Args:
+        planes: Array of shape (C, h, w) with samples in [0, 255]
+        quant_matrix: The quantization matrix to scale (default: quant_matrix)
+        coefficients: The blocks of the planes from dct_planes, to only quantize them
+        quality: The quality to quantize at (default: self.quality)
+        Returns:
+        The quantized blocks, shape (N, 8, 8), as returned by split_blocks
+        """
+        if coefficients is not None:
+            def requantize(chunk):
+                with self.timings.stage("quantize"):
+                    return self.quantize(chunk, quant_matrix, quality)
+            return self.map_blocks(requantize, coefficients)
+        blocks = self.split_blocks(planes.astype(float) - 128)
+        def transform(chunk):
+            with self.timings.stage("dct"):
+                coefficients = self.apply_dct(chunk)
+            with self.timings.stage("quantize"):
+                return self.quantize(coefficients, quant_matrix, quality)
+        return self.map_blocks(transform, blocks)
+
+    def reconstruct_planes(self, quantized_blocks, shape, quant_matrix=None, quality=None):
+        """
+        Function Documentation:
+        Dequantize and IDCT quantized blocks back to pixel planes, as a decoder would
+        Args:
+        quantized_blocks: Array of shape (N, 8, 8) as returned by transform_planes
+        shape: The (C, h, w) shape of the planes that were transformed
+        quant_matrix: The quantization matrix to scale (default: quant_matrix)
+        quality: The quality the blocks were quantized at (default: self.quality)
+        Returns:
+        The reconstructed planes, shape (C, h, w), as floats
+        """
+        def reconstruct(chunk):
+            with self.timings.stage("idct"):
+                return self.apply_idct(self.dequantize(chunk, quant_matrix, quality))
+        idct_blocks = self.map_blocks(reconstruct, quantized_blocks)
+        return self.merge_blocks(idct_blocks, shape) + 128
+
+    def block_grid(self, quantized_blocks, shape):
+        """
+        Function Documentation:
+        Arrange quantized blocks as one block grid per plane, for the encoder
+        Args:
+        quantized_blocks: Array of shape (N, 8, 8) as returned by transform_planes
+        shape: The (C, h, w) shape of the planes that were transformed
+        Returns:
+        Array of shape (C, ceil(h/8), ceil(w/8), 8, 8) of int16 coefficients
+        """
+        c, h, w = shape
+        return quantized_blocks.reshape(c, -(-h // 8), -(-w // 8), 8, 8).astype(np.int16)
+
+    def components(self, luma_blocks, luma_shape, chroma_blocks=None, chroma_shape=None,
+                   quality=None):
+        """
+        Function Documentation:
+        The encoder components of quantized planes
+        Args:
+        luma_blocks, luma_shape: The quantized luminance (or grey) blocks and the shape of their planes
+        chroma_blocks, chroma_shape: The same for the Cb and Cr planes of colour images
+        quality: The quality the blocks were quantized at (default: self.quality)
+        Returns:
+        List of Component
+        """
+        luma_grid = self.block_grid(luma_blocks, luma_shape)
+        luma_table = self.scaled_quant_matrix(quality=quality)
+        if chroma_blocks is None:
+            return [Component(1, luma_grid[0], luma_table)]
+
+        h_samp, v_samp = SUBSAMPLING[self.subsampling]
+        chroma_grid = self.block_grid(chroma_blocks, chroma_shape)
+        chroma_table = self.scaled_quant_matrix(self.chroma_quant_matrix, quality)
+        return [
+            Component(1, luma_grid[0], luma_table, h_samp, v_samp, table_class=0),
+            Component(2, chroma_grid[0], chroma_table, table_class=1),
+            Component(3, chroma_grid[1], chroma_table, table_class=1),
+        ]
+
+    def quantize_planes(self, quality=None):
         """
         Function Documentation:
-        Save the image to the disk
+        Quantize every block of self.planes
+        The DCT blocks kept in self.coefficients are only re-quantized.
         Args:
-        compressed_image: The image to be saved
+        quality: The quality to quantize at (default: self.quality)
         Returns:
+        Dict mapping each plane name ("luma", and "chroma" for colour images) to its quantized blocks
+        """
+        tables = {"luma": self.quant_matrix, "chroma": self.chroma_quant_matrix}
+        return {name: self.transform_planes(plane, tables[name], self.coefficients.get(name), quality)
+                for name, plane in self.planes.items()}
+
+    def encode_planes(self, quantized, quality=None):
+        """
+        Function Documentation:
+        Entropy-code quantized planes into a JPEG file
+        Args:
+        quantized: The quantized blocks of self.planes, from quantize_planes
+        quality: The quality they were quantized at (default: self.quality)
+        Returns:
+        The JPEG file as bytes
+        """
+        w, h = self.image.size
+        args = []
+        for name, blocks in quantized.items():
+            args += [blocks, self.planes[name].shape]
+        components = self.components(*args, quality=quality)
+        color_space = "YCbCr" if "chroma" in quantized else "L"
+        with self.timings.stage("encode"):
+            return self.encoder.encode(w, h, components, color_space)
+
+    def reconstruct_image(self, quantized, quality=None):
+        """
+        Function Documentation:
+        Decode quantized planes back to an image, as a decoder would
+        Args:
+        quantized: The quantized blocks of self.planes, from quantize_planes
+        quality: The quality they were quantized at (default: self.quality)
+        Returns:
+        Array of shape (h, w) or (h, w, 3), as floats
+        """
+        w, h = self.image.size
+        luma = self.reconstruct_planes(quantized["luma"], self.planes["luma"].shape, quality=quality)
+        if "chroma" not in quantized:
+            return luma[0]
+        chroma = self.reconstruct_planes(quantized["chroma"], self.planes["chroma"].shape,
+                                         self.chroma_quant_matrix, quality)
+        with self.timings.stage("color"):
+            return self.ycbcr_to_rgb(luma, chroma, (h, w))
+
+    def rate_model(self, target_size=None, target_psnr=None, sample=True):
+        """
+        Function Documentation:
+        The estimate a rate search probes, for a file size or a PSNR target
+        The planes are transformed once: the DCT coefficients are kept in
+        self.coefficients (and the planes in self.planes), so every later
+        compression only quantizes them. A sampled probe quantizes one MCU row
+        in every few, about SAMPLE_BLOCKS blocks, and scales the result to the
+        whole image. Its file size comes from the Huffman code lengths
+        (JPEGEncoder.estimate_size), its error from the quantization error of
+        the coefficients, which equals the pixel error because the DCT is
+        orthonormal (Parseval), plus the error of the chroma subsampling.
+        Args:
+        target_size, target_psnr: The target, which chooses what is estimated (give one)
+        sample: Probe a sample of the blocks; else every block is quantized (the
+        chroma subsampling error is still taken over the sampled rows)
+        Returns:
+        estimate: Function of a quality returning the estimated file size in bytes,
+        or the estimated mean squared error of the output (memoized)
+        highest: The highest useful quality; beyond it every quantization step is 255
+        """
+        if (target_size is None) == (target_psnr is None):
+            raise ValueError("Give exactly one of target_size and target_psnr")
+        image_array = np.array(self.image)
+        h, w = image_array.shape[:2]
+        h_samp, v_samp = SUBSAMPLING[self.subsampling]
+        if not self.coefficients:
+            if self.image.mode == "RGB":
+                with self.timings.stage("color"):
+                    luma, chroma = self.rgb_to_ycbcr(image_array)
+                self.planes = {"luma": luma, "chroma": chroma}
+            else:
+                self.planes = {"luma": image_array[np.newaxis]}
+            self.coefficients = {name: self.dct_planes(plane) for name, plane in self.planes.items()}
+        tables = {"luma": self.quant_matrix, "chroma": self.chroma_quant_matrix}
+        highest = int(np.ceil(255 * 100 / min(tables[name].min() for name in self.planes)))
+
+        # the sample: every step-th MCU row, which holds v_samp rows of luminance blocks
+        colour = "chroma" in self.planes
+        step = max(1, sum(len(blocks) for blocks in self.coefficients.values()) // SAMPLE_BLOCKS)
+        blocks, shapes = {}, {}
+        for name, plane in self.planes.items():
+            c, ph, pw = plane.shape
+            grid = self.coefficients[name].reshape(c, -(-ph // 8), -(-pw // 8), 8, 8)
+            mcu_rows = np.arange(grid.shape[1]) // (v_samp if colour and name == "luma" else 1)
+            if sample:
+                grid = grid[:, mcu_rows % step == 0]
+            blocks[name] = grid.reshape(-1, 8, 8)
+            shapes[name] = (c, grid.shape[1] * 8, grid.shape[2] * 8)
+        fraction = len(blocks["luma"]) / len(self.coefficients["luma"])
+
+        if target_size is not None:
+            def estimate(quality):
+                args = []
+                for name in self.planes:
+                    args += [self.transform_planes(None, tables[name], blocks[name], quality), shapes[name]]
+                components = self.components(*args, quality=quality)
+                color_space = "YCbCr" if colour else "L"
+                return self.encoder.estimate_size(w, h, components, color_space, scale=1 / fraction)
+            return functools.cache(estimate), highest
+
+        # error of each Y, Cb, Cr plane before quantizing (from chroma subsampling,
+        # over the image rows of the sample, even when every block is quantized),
+        # and the weight of each plane's error in the output channels
+        if colour:
+            weights = (YCBCR_TO_RGB ** 2).mean(axis=0)
+            with self.timings.stage("color"):
+                rows = np.flatnonzero(np.arange(h) // (8 * v_samp) % step == 0)
+                full = image_array[rows].astype(np.float32) @ RGB_TO_YCBCR[1:].T.astype(np.float32) + 128
+                chroma = self.planes["chroma"][:, rows // v_samp].astype(np.float32)
+                upsampled = np.repeat(chroma, h_samp, axis=2)[:, :, :w]
+                lost = ((full.transpose(2, 0, 1) - upsampled) ** 2).mean(axis=(1, 2))
+            base = np.concatenate([[0.0], lost])
+        else:
+            weights, base = np.ones(1), np.zeros(1)
+
+        def estimate(quality):
+            errors = []
+            for name, plane in self.planes.items():
+                quantized = self.transform_planes(None, tables[name], blocks[name], quality)
+                error = blocks[name] - self.dequantize(quantized, tables[name], quality)
+                # the blocks of split_blocks are plane by plane
+                errors.extend((error.reshape(len(plane), -1) ** 2).mean(axis=1))
+            # output pixels are rounded to integers, which adds 1/12
+            return float(weights @ (base + np.array(errors))) + 1 / 12
+        return functools.cache(estimate), highest
+
+    def compress_to_target(self, target_size=None, target_psnr=None):
+        """
+        Function Documentation:
+        Compress at the quality that meets a file size or PSNR target
+        The quality is searched on the sampled estimates of rate_model. The
+        quality found is then measured on every block, which calibrates the
+        estimates for the next search, at most TARGET_RETRIES times. A file
+        size is measured by entropy-coding the blocks, and that file is kept;
+        an error by the coefficient model of rate_model over every block. Only
+        the chosen quality is decoded. The error model is an estimate, so the
+        decoded image checks it, and a finer quality is searched if it falls short.
+        Args:
+        target_size: Largest file size in bytes
+        target_psnr: Lowest PSNR in dB
+        Returns:
+        compressed_image: The compressed image; self.quality holds the quality used
+        and self.target_met whether the target was met (when it cannot be, the
+        quality closest to it is used: the coarsest for a size, the finest for a PSNR)
+        """
+        estimate, highest = self.rate_model(target_size, target_psnr)
+        if target_size is not None:
+            limit, largest = target_size, False
+            files = {}
+            def measure(quality):
+                files[quality] = self.encode_planes(self.quantize_planes(quality), quality)
+                return len(files[quality])
+        else:
+            limit, largest = mse_limit(target_psnr), True
+            measure = self.rate_model(target_psnr=target_psnr, sample=False)[0]
+
+        def search(highest, calibration):
+            with self.timings.stage("search"):
+                return bisect_quality(lambda q: estimate(q) * calibration <= limit, highest, largest)
+
+        calibration, results = 1.0, {}
+        for _ in range(TARGET_RETRIES):
+            quality = search(highest, calibration)
+            if quality in results:
+                break
+            results[quality] = measure(quality)
+            calibration = results[quality] / estimate(quality)
+
+        # the best quality that met the target, else the closest to meeting it
+        meeting = [q for q, value in results.items() if value <= limit]
+        if meeting:
+            best = max(meeting) if largest else min(meeting)
+        else:
+            best = min(results) if largest else max(results)
+
+        original = np.array(self.image)
+        for attempt in range(TARGET_RETRIES):
+            quantized = self.quantize_planes(best)
+            compressed_image = self.to_image(self.reconstruct_image(quantized, best))
+            if target_size is not None:
+                met = results[best] <= limit
+                break
+            with self.timings.stage("search"):
+                error = mse(original, np.asarray(compressed_image))
+            met = error <= limit
+            # the last attempt keeps what it decoded
+            if met or best == 1 or attempt == TARGET_RETRIES - 1:
+                break
+            # the model underestimated the error: correct it and try finer qualities
+            calibration *= error / results[best]
+            best = search(best - 1, calibration)
+            results[best] = measure(best)
+
+        self.quality = best
+        self.target_met = met
+        self.encoded = files[best] if target_size is not None else self.encode_planes(quantized, best)
+        return self.save_image(compressed_image)
+
+    def rgb_to_ycbcr(self, image_array):
+        """
+        Function Documentation:
+        Convert an RGB image to a luminance plane and subsampled chrominance planes
+        The image is first extended by edge replication to whole MCUs
+        (8 x 8 luminance blocks per chrominance block in each direction).
+        Args:
+        image_array: Array of shape (h, w, 3)
+        Returns:
+        luma: Array of shape (1, H, W)
+        chroma: Array of shape (2, H / v, W / h) holding Cb and Cr
+        """
+        h_samp, v_samp = SUBSAMPLING[self.subsampling]
+        h, w = image_array.shape[:2]
+        padded = np.pad(image_array, ((0, -h % (8 * v_samp)), (0, -w % (8 * h_samp)), (0, 0)),
+                        mode='edge')
+        # one float32 multiply-add per weight on contiguous channel planes is
+        # several times faster than a float64 matrix product over interleaved pixels
+        channels = [np.ascontiguousarray(padded[..., k], dtype=np.float32) for k in range(3)]
+        ycbcr = np.empty((3,) + padded.shape[:2], dtype=np.float32)
+        product = np.empty(padded.shape[:2], dtype=np.float32)
+        for plane, weights, offset in zip(ycbcr, RGB_TO_YCBCR.astype(np.float32), (0, 128, 128)):
+            np.multiply(channels[0], weights[0], out=plane)
+            for channel, weight in zip(channels[1:], weights[1:]):
+                plane += np.multiply(channel, weight, out=product)
+            plane += offset
+        luma = ycbcr[:1]
+        if (h_samp, v_samp) == (1, 1):
+            return luma, ycbcr[1:]
+        # block means as sums of strided slices, which beat reducing short axes
+        chroma = ycbcr[1:, ::v_samp, ::h_samp].copy()
+        for dy in range(v_samp):
+            for dx in range(h_samp):
+                if dy or dx:
+                    chroma += ycbcr[1:, dy::v_samp, dx::h_samp]
+        chroma *= np.float32(1 / (h_samp * v_samp))
+        return luma, chroma
+
+    def ycbcr_to_rgb(self, luma, chroma, size):
+        """
+        Function Documentation:
+        Upsample the chrominance planes and convert back to an RGB image
+        Chrominance samples are repeated (nearest neighbour); decoders such as
+        libjpeg interpolate them, so their output can differ slightly from this
+        reconstruction for subsampled images.
+        Args:
+        luma: Array of shape (1, H, W)
+        chroma: Array of shape (2, H / v, W / h)
+        size: The (h, w) size of the original image
+        Returns:
+        Array of shape (h, w, 3), as float32 (a view of planes stored channel by channel)
+        """
+        h_samp, v_samp = SUBSAMPLING[self.subsampling]
+        h, w = size
+        # each chroma sample covers v x h pixels: repeat it by broadcasting
+        rows, cols = -(-h // v_samp), -(-w // h_samp)
+        chroma = chroma[:, :rows, :cols].astype(np.float32) - 128
+        cb, cr = (np.broadcast_to(plane[:, np.newaxis, :, np.newaxis], (rows, v_samp, cols, h_samp))
+                  .reshape(rows * v_samp, cols * h_samp)[:h, :w] for plane in chroma)
+        y = luma[0, :h, :w]
+        # planes are computed contiguously and returned as a channels-last view
+        rgb = np.empty((3, h, w), dtype=np.float32)
+        product = np.empty((h, w), dtype=np.float32)
+        for plane, (_, cb_weight, cr_weight) in zip(rgb, YCBCR_TO_RGB.astype(np.float32)):
+            plane[...] = y
+            if cb_weight:
+                plane += np.multiply(cb, cb_weight, out=product)
+            if cr_weight:
+                plane += np.multiply(cr, cr_weight, out=product)
+        return rgb.transpose(1, 2, 0)
+
+    def output_path(self):
+        """
+        Function Documentation:
+        Path of the compressed file on disk
+        Args:
         None
+        Returns:
+        The path under compressed/, or None when the image was given in memory
         """
-        compressed_image = np.clip(compressed_image, 0, 255)
-        compressed_image = Image.fromarray(compressed_image.astype(np.uint8))
-        output_path = "compressed/" + self.image_path.split("/")[-1].split(".")[0] + "_compressed.jpg"
-        compressed_image.save(output_path)
+        if not isinstance(self.image_path, str):
+            return None
+        return "compressed/" + self.image_path.split("/")[-1].split(".")[0] + "_compressed.jpg"
+
+    def to_image(self, compressed_image):
+        """
+        Function Documentation:
+        Round reconstructed samples to 8 bits, as a decoder outputs them
+        Args:
+        compressed_image: The reconstructed image, as floats
+        Returns:
+        The image as a PIL image
+        """
+        with self.timings.stage("save"):
+            compressed_image = np.clip(np.round(compressed_image), 0, 255)
+            return Image.fromarray(compressed_image.astype(np.uint8))
+
+    def save_image(self, compressed_image):
+        """
+        Function Documentation:
+        Save the encoded JPEG file to the disk
+        Images given in memory are not written; their file stays in self.encoded.
+        Args:
+        compressed_image: The reconstructed image, as the saved file decodes, or the PIL image from to_image
+        Returns:
+        compressed_image: The reconstructed image as a PIL image
+        """
+        if not isinstance(compressed_image, Image.Image):
+            compressed_image = self.to_image(compressed_image)
+        with self.timings.stage("save"):
+            output_path = self.output_path()
+            if output_path is not None:
+                with open(output_path, "wb") as f:
+                    f.write(self.encoded)
         return compressed_image
 
 
@@ -139,23 +739,11 @@ class Compressor:
         Returns:
         compressed_image: The compressed image
         """
-        image = self.image
-        image_array = np.array(image)
-        h = image_array.shape[0]
-        w = image_array.shape[1]
-
-        compressed_image = np.zeros((h, w))
-
-        for i in range(0, h, 8):
-            for j in range(0, w, 8):
-                block = image_array[i:i+8, j:j+8]
-                dct_block = self.apply_dct(block)
-                quantized_block = self.quantize(dct_block)
-                dequantized_block = self.dequantize(quantized_block)
-                idct_block = self.apply_idct(dequantized_block)
-                compressed_image[i:i+8, j:j+8] = idct_block
-
-        return self.save_image(compressed_image)
+        if not self.planes:
+            self.planes = {"luma": np.array(self.image)[np.newaxis]}
+        quantized = self.quantize_planes()
+        self.encoded = self.encode_planes(quantized)
+        return self.save_image(self.reconstruct_image(quantized))
 
     def rgb_compression(self):
         """
@@ -167,24 +755,14 @@ class Compressor:
         Returns:
         compressed_image: The compressed image
         """
-        image = self.image
-        image_array = np.array(image)
-        h = image_array.shape[0]
-        w = image_array.shape[1]
-
-        compressed_image = np.zeros((h, w, 3))
-
-        for i in range(0, h, 8):
-            for j in range(0, w, 8):
-                for k in range(3):
-                    block = image_array[i:i+8, j:j+8, k]
-                    dct_block = self.apply_dct(block)
-                    quantized_block = self.quantize(dct_block)
-                    dequantized_block = self.dequantize(quantized_block)
-                    idct_block = self.apply_idct(dequantized_block)
-                    compressed_image[i:i+8, j:j+8, k] = idct_block
-
-        return self.save_image(compressed_image)
+        # Cb and Cr share a table, so they go through the block pipeline as one batch
+        if not self.planes:
+            with self.timings.stage("color"):
+                luma, chroma = self.rgb_to_ycbcr(np.array(self.image))
+            self.planes = {"luma": luma, "chroma": chroma}
+        quantized = self.quantize_planes()
+        self.encoded = self.encode_planes(quantized)
+        return self.save_image(self.reconstruct_image(quantized))
 
     def old_size(self)->int:
         """
@@ -206,19 +784,30 @@ class Compressor:
         Returns:
         The size of the compressed image
         """
-        compressed_image = Image.open("compressed/" + self.image_path.split("/")[-1].split(".")[0] + "_compressed.jpg")
+        if self.encoded is not None:
+            compressed_image = Image.open(io.BytesIO(self.encoded))
+        else:
+            compressed_image = Image.open(self.output_path())
         return compressed_image.size
 
-    def compress(self):
+    def compress(self, target_size=None, target_psnr=None):
         """
         Function Documentation:
         Compress the image
         Saves the compressed image to the disk (adds a suffix "_compressed" to the original image name)
         Args:
-        None
+        target_size: Largest file size in bytes; the quality is searched instead of using self.quality
+        target_psnr: Lowest PSNR in dB, likewise (give at most one target)
         Returns:
         compressed_image: The compressed image
         """
+        self.timings = Timings()
+        self.coefficients, self.planes = {}, {}
+        if target_size is not None or target_psnr is not None:
+            return self.compress_to_target(target_size, target_psnr)
+        return self._compress()
+
+    def _compress(self):
         if self.image.mode == "RGB":
             return self.rgb_compression()
         
@@ -0,0 +1,627 @@
+"""
+Module Documentation:
+This module writes quantized DCT coefficients as a baseline JPEG file.
+It implements steps 4 and 5 of the JPEG pipeline described in JPEG_Compression:
+1. Zigzag-scan every quantized 8x8 block.
+2. Code the DC coefficient as the difference from the previous block of the same component.
+3. Run-length code the AC coefficients as (zero run, size) symbols.
+4. Huffman code the symbols with the standard tables (ITU T.81 Annex K.3) or with
+   tables optimized for the image (Annex K.2).
+5. Write the markers (SOI, APP0/APP14, DQT, SOF0, DHT, SOS, EOI) around the entropy-coded data.
+The symbol stream and the bit packing are built with NumPy over all blocks at once,
+or over chunks of MCU rows on a thread pool when the encoder has several workers.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# natural (row-major) index of the k-th coefficient in zigzag order
+ZIGZAG = np.array(
+    sorted(
+        range(64),
+        key=lambda k: (k // 8 + k % 8, k // 8 if (k // 8 + k % 8) % 2 else k % 8),
+    )
+)
+
+# standard Huffman tables: (number of codes of each length 1..16, symbols)
+DC_LUMINANCE = (
+    [0, 1, 5, 1, 1, 1, 1, 1, 1, 0, 0, 0, 0, 0, 0, 0],
+    list(range(12)),
+)
+DC_CHROMINANCE = (
+    [0, 3, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0, 0, 0, 0, 0],
+    list(range(12)),
+)
+AC_LUMINANCE = (
+    [0, 2, 1, 3, 3, 2, 4, 3, 5, 5, 4, 4, 0, 0, 1, 0x7D],
+    [0x01, 0x02, 0x03, 0x00, 0x04, 0x11, 0x05, 0x12, 0x21, 0x31, 0x41, 0x06]
+    + [0x13, 0x51, 0x61, 0x07, 0x22, 0x71, 0x14, 0x32, 0x81, 0x91, 0xA1, 0x08]
+    + [0x23, 0x42, 0xB1, 0xC1, 0x15, 0x52, 0xD1, 0xF0, 0x24, 0x33, 0x62, 0x72]
+    + [0x82, 0x09, 0x0A, 0x16, 0x17, 0x18, 0x19, 0x1A, 0x25, 0x26, 0x27, 0x28]
+    + [0x29, 0x2A]
+    + list(range(0x34, 0x3B))
+    + [v for hi in range(0x40, 0x90, 0x10) for v in range(hi + 3, hi + 0xB)]
+    + [v for hi in range(0x90, 0xE0, 0x10) for v in range(hi + 2, hi + 0xB)]
+    + [v for hi in range(0xE0, 0x100, 0x10) for v in range(hi + 1, hi + 0xB)],
+)
+AC_CHROMINANCE = (
+    [0, 2, 1, 2, 4, 4, 3, 4, 7, 5, 4, 4, 0, 1, 2, 0x77],
+    [0x00, 0x01, 0x02, 0x03, 0x11, 0x04, 0x05, 0x21, 0x31, 0x06, 0x12, 0x41]
+    + [0x51, 0x07, 0x61, 0x71, 0x13, 0x22, 0x32, 0x81, 0x08, 0x14, 0x42, 0x91]
+    + [0xA1, 0xB1, 0xC1, 0x09, 0x23, 0x33, 0x52, 0xF0, 0x15, 0x62, 0x72, 0xD1]
+    + [0x0A, 0x16, 0x24, 0x34, 0xE1, 0x25, 0xF1, 0x17, 0x18, 0x19, 0x1A, 0x26]
+    + [0x27, 0x28, 0x29, 0x2A]
+    + list(range(0x35, 0x3B))
+    + [v for hi in range(0x40, 0x80, 0x10) for v in range(hi + 3, hi + 0xB)]
+    + [v for hi in range(0x80, 0x100, 0x10) for v in range(hi + 2, hi + 0xB)],
+)
+
+EOB = 0x00
+ZRL = 0xF0
+
+# symbols packed into bits per batch, to bound the temporary bit arrays
+PACK_CHUNK = 1 << 16
+
+
+def parallel_map(func, items, workers=1):
+    """
+    Function Documentation:
+    Apply func to every item, on a thread pool when workers > 1
+    Results come back in the order of the items whatever the number of workers.
+    Args:
+    func: The function to apply
+    items: A sequence of arguments
+    workers: The number of threads
+    Returns:
+    A generator of the results
+    """
+    if workers <= 1 or len(items) <= 1:
+        yield from map(func, items)
+        return
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(func, items)
+
+
+def magnitude_category(values):
+    """
+    Function Documentation:
+    Number of bits needed for each |value| (the JPEG "SSSS" category)
+    Args:
+    values: Integer array
+    Returns:
+    Integer array of categories, 0 for zero values
+    """
+    return np.frexp(np.abs(values).astype(np.float64))[1].astype(np.int64)
+
+
+def amplitude_bits(values, categories):
+    """
+    Function Documentation:
+    The extra bits that follow a size symbol: the value itself when positive,
+    its one's complement in `categories` bits when negative
+    Args:
+    values: Integer array
+    categories: magnitude_category(values)
+    Returns:
+    Integer array of amplitude bits
+    """
+    values = values.astype(np.int64)
+    return np.where(values < 0, values + (1 << categories) - 1, values)
+
+
+class HuffmanTable:
+    """
+    Class Documentation:
+    A JPEG Huffman table and its code lookup arrays.
+
+    Attributes:
+    bits: Number of codes of each length 1..16.
+    values: The symbols, ordered by code length.
+    codes: Code of every symbol 0..255 (0 where the symbol is absent).
+    lengths: Code length of every symbol 0..255 (0 where the symbol is absent).
+    """
+
+    def __init__(self, bits, values):
+        """
+        Function Documentation:
+        Build the canonical codes (ITU T.81 Annex C) for a BITS/HUFFVAL pair
+        Args:
+        bits: Number of codes of each length 1..16
+        values: The symbols, ordered by code length
+        """
+        self.bits = [int(b) for b in bits]
+        self.values = [int(v) for v in values]
+        self.codes = np.zeros(256, dtype=np.int64)
+        self.lengths = np.zeros(256, dtype=np.int64)
+        code = 0
+        k = 0
+        for length in range(1, 17):
+            for _ in range(self.bits[length - 1]):
+                self.codes[self.values[k]] = code
+                self.lengths[self.values[k]] = length
+                code += 1
+                k += 1
+            code <<= 1
+
+    @classmethod
+    def from_frequencies(cls, frequencies):
+        """
+        Function Documentation:
+        Build the table that minimizes the coded size of the given symbol counts,
+        with code lengths limited to 16 bits (ITU T.81 Annex K.2)
+        Args:
+        frequencies: Count of every symbol 0..255
+        Returns:
+        A HuffmanTable
+        """
+        freq = [int(f) for f in frequencies] + [1]  # reserved symbol 256
+        code_size = [0] * 257
+        others = [-1] * 257
+
+        while True:
+            # two least frequent symbols; on ties the larger symbol value
+            candidates = sorted((f, -v) for v, f in enumerate(freq) if f > 0)
+            if len(candidates) < 2:
+                break
+            v1, v2 = -candidates[0][1], -candidates[1][1]
+            freq[v1] += freq[v2]
+            freq[v2] = 0
+            code_size[v1] += 1
+            while others[v1] != -1:
+                v1 = others[v1]
+                code_size[v1] += 1
+            others[v1] = v2
+            code_size[v2] += 1
+            while others[v2] != -1:
+                v2 = others[v2]
+                code_size[v2] += 1
+
+        bits = [0] * 33
+        for size in code_size:
+            if size:
+                bits[size] += 1
+
+        # move codes longer than 16 bits up the tree
+        for i in range(32, 16, -1):
+            while bits[i] > 0:
+                j = i - 2
+                while bits[j] == 0:
+                    j -= 1
+                bits[i] -= 2
+                bits[i - 1] += 1
+                bits[j + 1] += 2
+                bits[j] -= 1
+        # drop the reserved symbol from the longest codes
+        i = 16
+        while bits[i] == 0:
+            i -= 1
+        bits[i] -= 1
+
+        values = [
+            v for size in range(1, 33) for v in range(256) if code_size[v] == size
+        ]
+        return cls(bits[1:17], values)
+
+
+class Component:
+    """
+    Class Documentation:
+    One colour component of a frame.
+
+    Attributes:
+    component_id: The component identifier written in SOF0 and SOS.
+    blocks: Quantized coefficients, shape (block_rows, block_cols, 8, 8), natural order.
+    quant_table: The 8x8 integer quantization table used for the blocks.
+    h: Horizontal sampling factor.
+    v: Vertical sampling factor.
+    table_class: 0 for luminance tables, 1 for chrominance tables.
+    """
+
+    def __init__(self, component_id, blocks, quant_table, h=1, v=1, table_class=0):
+        self.component_id = component_id
+        self.blocks = blocks
+        self.quant_table = quant_table
+        self.h = h
+        self.v = v
+        self.table_class = table_class
+
+
+class JPEGEncoder:
+    """
+    Class Documentation:
+    This class writes quantized DCT coefficients as a baseline (SOF0) JPEG file.
+    Args:
+    optimize: Build Huffman tables from the image's own symbol counts instead of
+              using the standard tables.
+    workers: Number of threads coding chunks of MCU rows at the same time.
+
+    Attributes:
+    optimize: Whether Huffman tables are optimized per image.
+    workers: Number of threads used by encode.
+    """
+
+    def __init__(self, optimize=False, workers=1):
+        """
+        Function Documentation:
+        The constructor method used to initialize the class attributes.
+        Args:
+        optimize: Build optimized Huffman tables instead of the standard ones.
+        workers: Number of threads coding chunks of MCU rows at the same time.
+        """
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        self.optimize = optimize
+        self.workers = workers
+
+    def scan_order(self, components):
+        """
+        Function Documentation:
+        Arrange the blocks of all components in the order they are written to the scan
+        A single component is scanned block by block in raster order; several
+        components are interleaved MCU by MCU.
+        Args:
+        components: List of Component
+        Returns:
+        blocks: Array of shape (N, 64) in zigzag order
+        owner: Array of shape (N,) with the index of each block's component
+        """
+        if len(components) == 1:
+            blocks = components[0].blocks.reshape(-1, 64)
+            return blocks[:, ZIGZAG], np.zeros(len(blocks), dtype=np.int64)
+
+        mcu_rows = components[0].blocks.shape[0] // components[0].v
+        mcu_cols = components[0].blocks.shape[1] // components[0].h
+        grouped = []
+        owners = []
+        for index, comp in enumerate(components):
+            # (mcu_rows, v, mcu_cols, h) -> (mcu_rows, mcu_cols, v * h)
+            blocks = comp.blocks.reshape(mcu_rows, comp.v, mcu_cols, comp.h, 64)
+            blocks = blocks.transpose(0, 2, 1, 3, 4)
+            grouped.append(blocks.reshape(mcu_rows, mcu_cols, comp.v * comp.h, 64))
+            owners.append(np.full(comp.v * comp.h, index))
+        blocks = np.concatenate(grouped, axis=2).reshape(-1, 64)
+        owner = np.tile(np.concatenate(owners), mcu_rows * mcu_cols)
+        return blocks[:, ZIGZAG], owner
+
+    def scan_chunks(self, components, blocks, owner):
+        """
+        Function Documentation:
+        Split the scan into chunks of whole MCU rows that can be coded independently
+        Each chunk carries the DC value that precedes it in every component, so
+        coding the chunks one after the other gives the same stream as coding
+        the whole scan at once.
+        Args:
+        components: List of Component
+        blocks, owner: As returned by scan_order
+        Returns:
+        List of (blocks, owner, dc_pred)
+        """
+        if self.workers <= 1:
+            return [(blocks, owner, None)]
+
+        if len(components) == 1:
+            row_blocks = components[0].blocks.shape[1]
+        else:
+            mcu_cols = components[0].blocks.shape[1] // components[0].h
+            row_blocks = mcu_cols * sum(comp.h * comp.v for comp in components)
+        mcu_rows = len(blocks) // row_blocks
+        # a few chunks per worker evens out rows of different cost
+        step = -(-mcu_rows // (4 * self.workers)) * row_blocks
+
+        dc = blocks[:, 0].astype(np.int64)
+        positions = [np.nonzero(owner == index)[0] for index in range(len(components))]
+        chunks = []
+        for start in range(0, len(blocks), step):
+            dc_pred = []
+            for mine in positions:
+                before = np.searchsorted(mine, start)
+                dc_pred.append(dc[mine[before - 1]] if before else 0)
+            end = start + step
+            chunks.append((blocks[start:end], owner[start:end], dc_pred))
+        return chunks
+
+    def symbols(self, blocks, owner, table_class, dc_pred=None):
+        """
+        Function Documentation:
+        Turn zigzag-ordered blocks into the Huffman symbols of the scan
+        Every symbol is written straight to its place in the stream: the DC symbol
+        first, then for each non-zero AC coefficient its ZRL symbols and its own
+        symbol, then EOB unless the block ends on a non-zero coefficient.
+        Args:
+        blocks: Array of shape (N, 64) in zigzag order
+        owner: Component index of every block
+        table_class: Table class (0 luminance, 1 chrominance) of every component
+        dc_pred: DC value preceding the first block of each component (default 0)
+        Returns:
+        table: Table of each symbol: 2 * table_class, plus 1 for AC tables
+        symbol: The Huffman symbol
+        extra: The amplitude bits that follow the symbol
+        extra_len: Number of amplitude bits
+        """
+        n = len(blocks)
+
+        # DC: difference from the previous block of the same component
+        dc = blocks[:, 0].astype(np.int64)
+        dc_diff = np.empty(n, dtype=np.int64)
+        for index in np.unique(owner):
+            mine = np.nonzero(owner == index)[0]
+            start = 0 if dc_pred is None else dc_pred[index]
+            dc_diff[mine] = np.diff(dc[mine], prepend=start)
+        dc_size = magnitude_category(dc_diff)
+
+        # AC: each non-zero coefficient with the zero run before it
+        ac_block, ac_pos = np.nonzero(blocks[:, 1:])
+        ac_pos = ac_pos + 1
+        ac_value = blocks[ac_block, ac_pos].astype(np.int64)
+        ac_size = magnitude_category(ac_value)
+        first = np.ones(len(ac_block), dtype=bool)
+        first[1:] = ac_block[1:] != ac_block[:-1]
+        previous = np.zeros(len(ac_pos), dtype=np.int64)
+        previous[1:] = ac_pos[:-1]
+        previous[first] = 0
+        run = ac_pos - previous - 1
+        # runs of 16 or more zeros need ZRL symbols first
+        zrl_count = run // 16
+
+        # end of block unless the last coefficient is non-zero
+        last = np.zeros(n, dtype=np.int64)
+        last[ac_block] = ac_pos
+        has_eob = last < 63
+
+        # stream layout: where each block starts and where each AC symbol lands
+        group = zrl_count + 1
+        per_block = 1 + has_eob + np.bincount(ac_block, weights=group, minlength=n)
+        per_block = per_block.astype(np.int64)
+        block_start = np.cumsum(per_block) - per_block
+        group_end = np.cumsum(group)
+        group_first = np.maximum.accumulate(np.where(first, np.arange(len(first)), 0))
+        in_block = group_end - (group_end - group)[group_first]
+        ac_at = block_start[ac_block] + in_block
+        zrl_owner = np.repeat(np.arange(len(ac_at)), zrl_count)
+        zrl_rank = np.arange(len(zrl_owner)) - np.repeat(
+            np.cumsum(zrl_count) - zrl_count, zrl_count
+        )
+        zrl_at = ac_at[zrl_owner] - zrl_count[zrl_owner] + zrl_rank
+        eob_at = (block_start + per_block - 1)[has_eob]
+
+        total = int(per_block.sum())
+        block_class = np.asarray(table_class)[owner]
+        table = np.empty(total, dtype=np.int64)
+        symbol = np.empty(total, dtype=np.int64)
+        extra = np.zeros(total, dtype=np.int64)
+        extra_len = np.zeros(total, dtype=np.int64)
+
+        table[block_start] = 2 * block_class
+        symbol[block_start] = dc_size
+        extra[block_start] = amplitude_bits(dc_diff, dc_size)
+        extra_len[block_start] = dc_size
+
+        table[ac_at] = 2 * block_class[ac_block] + 1
+        symbol[ac_at] = (run % 16) * 16 + ac_size
+        extra[ac_at] = amplitude_bits(ac_value, ac_size)
+        extra_len[ac_at] = ac_size
+
+        table[zrl_at] = 2 * block_class[ac_block[zrl_owner]] + 1
+        symbol[zrl_at] = ZRL
+
+        table[eob_at] = 2 * block_class[has_eob] + 1
+        symbol[eob_at] = EOB
+
+        return table, symbol, extra, extra_len
+
+    def build_tables(self, classes, table, symbol):
+        """
+        Function Documentation:
+        Choose the DC and AC Huffman tables of each table class
+        Args:
+        classes: The table classes used by the frame
+        table, symbol: As returned by symbols
+        Returns:
+        dc_tables, ac_tables: Dicts mapping table class to HuffmanTable
+        """
+        if not self.optimize:
+            dc_tables = {
+                0: HuffmanTable(*DC_LUMINANCE),
+                1: HuffmanTable(*DC_CHROMINANCE),
+            }
+            ac_tables = {
+                0: HuffmanTable(*AC_LUMINANCE),
+                1: HuffmanTable(*AC_CHROMINANCE),
+            }
+            return (
+                {c: dc_tables[c] for c in classes},
+                {c: ac_tables[c] for c in classes},
+            )
+
+        counts = np.bincount(table * 256 + symbol, minlength=4 * 256).reshape(4, 256)
+        dc_tables = {c: HuffmanTable.from_frequencies(counts[2 * c]) for c in classes}
+        ac_tables = {
+            c: HuffmanTable.from_frequencies(counts[2 * c + 1]) for c in classes
+        }
+        return dc_tables, ac_tables
+
+    def code_words(self, tables, table, symbol, extra, extra_len):
+        """
+        Function Documentation:
+        Look up the Huffman code of every symbol and append its amplitude bits
+        Args:
+        tables: (dc_tables, ac_tables) as returned by build_tables
+        table, symbol, extra, extra_len: As returned by symbols
+        Returns:
+        words: The code words, most significant bit first
+        word_len: Length in bits of every code word
+        """
+        dc_tables, ac_tables = tables
+        codes = np.zeros((4, 256), dtype=np.int64)
+        lengths = np.zeros((4, 256), dtype=np.int64)
+        for c in dc_tables:
+            codes[2 * c], lengths[2 * c] = dc_tables[c].codes, dc_tables[c].lengths
+            codes[2 * c + 1] = ac_tables[c].codes
+            lengths[2 * c + 1] = ac_tables[c].lengths
+        words = (codes[table, symbol] << extra_len) | extra
+        return words, lengths[table, symbol] + extra_len
+
+    def pack_bits(self, words, word_len):
+        """
+        Function Documentation:
+        Concatenate code words into bytes, pad the last byte with 1 bits and
+        stuff a zero byte after every 0xFF
+        Args:
+        words: The code words, most significant bit first
+        word_len: Length in bits of every code word
+        Returns:
+        The entropy-coded segment as bytes
+        """
+
+        def word_bits(start):
+            w = words[start : start + PACK_CHUNK]
+            lengths = word_len[start : start + PACK_CHUNK]
+            ends = np.cumsum(lengths)
+            owner = np.repeat(np.arange(len(w)), lengths)
+            shift = ends[owner] - 1 - np.arange(ends[-1] if len(ends) else 0)
+            return ((w[owner] >> shift) & 1).astype(np.uint8)
+
+        chunks = []
+        carry = np.zeros(0, dtype=np.uint8)
+        starts = range(0, len(words), PACK_CHUNK)
+        for bits in parallel_map(word_bits, starts, self.workers):
+            bits = np.concatenate([carry, bits])
+            whole = len(bits) - len(bits) % 8
+            chunks.append(np.packbits(bits[:whole]))
+            carry = bits[whole:]
+        if len(carry):
+            padded = np.concatenate([carry, np.ones(8 - len(carry), dtype=np.uint8)])
+            chunks.append(np.packbits(padded))
+
+        data = np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.uint8)
+        data = np.insert(data, np.nonzero(data == 0xFF)[0] + 1, 0)
+        return data.tobytes()
+
+    def segment(self, marker, payload):
+        """
+        Function Documentation:
+        A marker segment: marker, big-endian length, payload
+        """
+        return bytes([0xFF, marker]) + (len(payload) + 2).to_bytes(2, "big") + payload
+
+    def headers(self, width, height, components, tables, color_space):
+        """
+        Function Documentation:
+        The marker segments written before the entropy-coded data
+        Args:
+        width, height: Image size in pixels
+        components: List of Component
+        tables: (dc_tables, ac_tables) as returned by build_tables
+        color_space: "YCbCr"/"L" (JFIF) or "RGB" (Adobe APP14, no colour transform)
+        Returns:
+        The header bytes, starting with SOI
+        """
+        out = bytearray(b"\xff\xd8")
+        if color_space == "RGB":
+            out += self.segment(0xEE, b"Adobe\x00\x64\x00\x00\x00\x00\x00")
+        else:
+            out += self.segment(0xE0, b"JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00")
+
+        quant_ids = {}
+        for comp in components:
+            key = comp.quant_table.astype(np.uint8).tobytes()
+            quant_ids.setdefault(key, (len(quant_ids), comp.quant_table))
+        dqt = b"".join(
+            bytes([table_id]) + table.reshape(64)[ZIGZAG].astype(np.uint8).tobytes()
+            for table_id, table in quant_ids.values()
+        )
+        out += self.segment(0xDB, dqt)
+
+        sof = bytes([8]) + height.to_bytes(2, "big") + width.to_bytes(2, "big")
+        sof += bytes([len(components)])
+        for comp in components:
+            table_id = quant_ids[comp.quant_table.astype(np.uint8).tobytes()][0]
+            sof += bytes([comp.component_id, comp.h * 16 + comp.v, table_id])
+        out += self.segment(0xC0, sof)
+
+        dc_tables, ac_tables = tables
+        dht = b""
+        for table_type, table_set in ((0, dc_tables), (1, ac_tables)):
+            for table_id, table in table_set.items():
+                dht += bytes([table_type * 16 + table_id] + table.bits + table.values)
+        out += self.segment(0xC4, dht)
+
+        sos = bytes([len(components)])
+        for comp in components:
+            sos += bytes([comp.component_id, comp.table_class * 17])
+        sos += bytes([0, 63, 0])
+        out += self.segment(0xDA, sos)
+        return bytes(out)
+
+    def code_symbols(self, components):
+        """
+        Function Documentation:
+        The Huffman symbols of the scan and the tables that code them
+        Args:
+        components: List of Component, with block grids already padded to whole MCUs
+        Returns:
+        coded: For every scan chunk, the (table, symbol, extra, extra_len) of symbols
+        tables: (dc_tables, ac_tables) as returned by build_tables
+        """
+        blocks, owner = self.scan_order(components)
+        table_class = [comp.table_class for comp in components]
+        chunks = self.scan_chunks(components, blocks, owner)
+        coded = list(
+            parallel_map(
+                lambda chunk: self.symbols(chunk[0], chunk[1], table_class, chunk[2]),
+                chunks,
+                self.workers,
+            )
+        )
+        # optimized tables need the symbol counts of the whole scan
+        table = np.concatenate([part[0] for part in coded])
+        symbol = np.concatenate([part[1] for part in coded])
+        tables = self.build_tables(sorted(set(table_class)), table, symbol)
+        return coded, tables
+
+    def estimate_size(self, width, height, components, color_space="YCbCr", scale=1):
+        """
+        Function Documentation:
+        The size of the file encode would write, from the code lengths alone
+        No bits are packed, and the zero bytes stuffed after 0xFF bytes of the
+        entropy-coded data are not counted, so the estimate can be a little low.
+        Args:
+        width, height: Image size in pixels
+        components: List of Component, with block grids already padded to whole MCUs
+        color_space: "L", "YCbCr" or "RGB"
+        scale: Factor for the entropy-coded data, when the components hold a
+        sample of the image's blocks
+        Returns:
+        The estimated file size in bytes
+        """
+        coded, tables = self.code_symbols(components)
+        bits = sum(int(self.code_words(tables, *part)[1].sum()) for part in coded)
+        header = self.headers(width, height, components, tables, color_space)
+        # entropy-coded bytes, then EOI
+        return len(header) + int(np.ceil(bits * scale / 8)) + 2
+
+    def encode(self, width, height, components, color_space="YCbCr"):
+        """
+        Function Documentation:
+        Write a complete baseline JPEG file
+        Args:
+        width, height: Image size in pixels
+        components: List of Component, with block grids already padded to whole MCUs
+        color_space: "L", "YCbCr" or "RGB"
+        Returns:
+        The JPEG file as bytes
+        """
+        coded, tables = self.code_symbols(components)
+        coded = list(
+            parallel_map(
+                lambda part: self.code_words(tables, *part), coded, self.workers
+            )
+        )
+        words = np.concatenate([part[0] for part in coded])
+        word_len = np.concatenate([part[1] for part in coded])
+        return (
+            self.headers(width, height, components, tables, color_space)
+            + self.pack_bits(words, word_len)
+            + b"\xff\xd9"
+        )
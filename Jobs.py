@@ -0,0 +1,194 @@
+"""
+Module Documentation:
+This module runs work in the background and keeps its result for a while,
+so a route can answer at once and the client can fetch the result later by
+job ID. Finished jobs are dropped once they are older than the TTL, or
+oldest first once more than DIP_JOB_RESULTS of them are kept.
+
+The number of unfinished jobs is bounded: when every thread is busy and the
+queue is full, submitting raises JobQueueFull. Jobs can be cancelled; a
+running job stops the next time it reports progress.
+
+Configuration (environment variables):
+DIP_JOB_THREADS: Jobs running at the same time (default: 2).
+DIP_JOB_QUEUE: Jobs allowed to wait for a thread (default: 16).
+DIP_JOB_TTL: Seconds a finished job and its result are kept (default: 600).
+DIP_JOB_RESULTS: Finished jobs and results kept at most (default: 64).
+"""
+
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class JobCancelled(Exception):
+    """Raised inside a job that was cancelled, to stop it."""
+
+
+class JobQueueFull(Exception):
+    """Raised when every job thread is busy and the waiting queue is full."""
+
+
+class Job:
+    """
+    Class Documentation:
+    One background job.
+
+    Attributes:
+    id: The job ID.
+    status: "queued", "running", "done", "error" or "cancelled".
+    result: The return value of the job function, once done.
+    error: The error message, if the job failed.
+    finished: time.monotonic() when the job finished, or None.
+    progress: Set by the job function to an object whose rows() returns
+    (rows done, rows in total) and whose cancel() stops the work, or None.
+    cancelled: Event set when the job is cancelled.
+    """
+
+    def __init__(self, job_id):
+        self.id = job_id
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.finished = None
+        self.progress = None
+        self.cancelled = threading.Event()
+        self._future = None
+
+    def check(self):
+        """Raise JobCancelled if the job was cancelled."""
+        if self.cancelled.is_set():
+            raise JobCancelled()
+
+    def as_dict(self):
+        """The status and progress of the job, without its result."""
+        status = {"job_id": self.id, "status": self.status}
+        progress = self.progress
+        if progress is not None:
+            status["rows_done"], status["rows_total"] = progress.rows()
+        if self.error is not None:
+            status["error"] = self.error
+        return status
+
+
+class JobQueue:
+    """
+    Class Documentation:
+    Background jobs on a few threads, with a bounded number of results kept for a TTL.
+    Args:
+    threads: Jobs running at the same time.
+    queue_size: Jobs allowed to wait for a thread.
+    ttl: Seconds a finished job is kept.
+    max_results: Finished jobs kept at most; the oldest finished go first.
+
+    Attributes:
+    threads: Jobs running at the same time.
+    queue_size: Jobs allowed to wait for a thread.
+    ttl: Seconds a finished job is kept.
+    max_results: Finished jobs kept at most.
+    """
+
+    def __init__(self, threads=None, queue_size=None, ttl=None, max_results=None):
+        if threads is None:
+            threads = int(os.environ.get("DIP_JOB_THREADS", 2))
+        if queue_size is None:
+            queue_size = int(os.environ.get("DIP_JOB_QUEUE", 16))
+        if ttl is None:
+            ttl = float(os.environ.get("DIP_JOB_TTL", 600))
+        if max_results is None:
+            max_results = int(os.environ.get("DIP_JOB_RESULTS", 64))
+        self.threads = threads
+        self.queue_size = queue_size
+        self.ttl = ttl
+        self.max_results = max_results
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=threads, thread_name_prefix="job"
+        )
+
+    def submit(self, func):
+        """
+        Function Documentation:
+        Run func(job) in the background
+        Args:
+        func: The job function; its return value becomes the job result. It
+        may set job.progress, and stops by raising JobCancelled.
+        Returns:
+        The job ID
+        """
+        job = Job(uuid.uuid4().hex)
+        with self._lock:
+            self._expire()
+            unfinished = sum(j.finished is None for j in self._jobs.values())
+            if unfinished >= self.threads + self.queue_size:
+                raise JobQueueFull()
+            self._jobs[job.id] = job
+            job._future = self._executor.submit(self._run, job, func)
+        return job.id
+
+    def _run(self, job, func):
+        job.status = "running"
+        try:
+            job.check()
+            job.result = func(job)
+            job.status = "done"
+        except JobCancelled:
+            job.status = "cancelled"
+        except Exception as e:
+            job.error = str(e)
+            job.status = "error"
+        with self._lock:
+            job.finished = time.monotonic()
+            self._expire()
+
+    def cancel(self, job_id):
+        """
+        Function Documentation:
+        Cancel a job; a finished job keeps its result
+        Args:
+        job_id: An ID returned by submit
+        Returns:
+        The Job, or None if it is unknown or expired
+        """
+        with self._lock:
+            self._expire()
+            job = self._jobs.get(job_id)
+            if job is None or job.finished is not None:
+                return job
+            job.cancelled.set()
+            if job._future.cancel():
+                # it never started
+                job.status = "cancelled"
+                job.finished = time.monotonic()
+        progress = job.progress
+        if progress is not None:
+            progress.cancel()
+        return job
+
+    def get(self, job_id):
+        """
+        Function Documentation:
+        Look up a job
+        Args:
+        job_id: An ID returned by submit
+        Returns:
+        The Job, or None if it is unknown or expired
+        """
+        with self._lock:
+            self._expire()
+            return self._jobs.get(job_id)
+
+    def _expire(self):
+        deadline = time.monotonic() - self.ttl
+        finished = sorted(
+            (job for job in self._jobs.values() if job.finished is not None),
+            key=lambda job: job.finished,
+        )
+        excess = len(finished) - self.max_results
+        for i, job in enumerate(finished):
+            if i < excess or job.finished < deadline:
+                del self._jobs[job.id]
@@ -1,6 +1,9 @@
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 from PIL import Image
 import os
+from Image_IO import open_image
+from Tiling import PRECISIONS, check_precision, tiled_filter
 
 
 class MedianFilter:
@@ -8,71 +11,169 @@ class MedianFilter:
     Class Documentation:
      This class is used to apply a median filter to an image or a custom array.
      The median filter replaces each pixel's value with the median value of the pixels in the neighborhood.
+     For uint8 images with large kernels the median is read from running column histograms
+     (Perreault & Hebert), so the cost per pixel does not depend on the kernel size.
 
     Attributes:
-     input_path: The path of the input image file.
+     input_path: The path of the input image file, or the image as bytes, a file object or an array.
      image: The input image.
+     workers: The number of threads filtering strips of the image at the same time.
+     precision: "uint8" (rounded results) or "float32" (unrounded results, which keeps
+     the halves of even-sized windows).
+     progress: Called as progress(rows, total) while filtering, or None (see tiled_filter).
 
     Methods:
      __init__: The constructor method used to initialize the class attributes.
      median_filter_custom: The method used to apply median filter to an image or array.
+     _sort_median: Median of every window by partial sorting, for small kernels or non-uint8 data.
+     _histogram_median: Constant-time median of every window of a uint8 plane.
      process_image: The method used to process the image.
     """
 
-    def __init__(self, input_path=None):
+    def __init__(self, input_path=None, workers=1, precision="uint8", progress=None):
         """Constructor Documentation"""
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        self.workers = workers
+        self.precision = check_precision(precision)
+        self.progress = progress
         self.input_path = input_path
-        if input_path:
+        if input_path is not None:
             try:
-                self.image = Image.open(input_path).convert("L")
+                self.image = open_image(input_path).convert("L")
             except FileNotFoundError:
                 print("File not found")
                 exit(1)
         else:
             self.image = None
 
-    def median_filter_custom(self, image_array, size=3, method="padding"):
-        """Applies median filter to an image or array"""
-
-        pad = size // 2
-
-        if method == "padding":
-            padded_img = np.pad(image_array, pad, mode="constant", constant_values=0)
-            filtered_img = np.zeros_like(image_array)
-        elif method == "reflect":
-            padded_img = np.pad(image_array, pad, mode="reflect")
-            filtered_img = np.zeros_like(image_array)
-        elif method == "edge":
-            padded_img = np.pad(image_array, pad, mode="edge")
-            filtered_img = np.zeros_like(image_array)
-        elif method == "symmetric":
-            padded_img = np.pad(image_array, pad, mode="symmetric")
-            filtered_img = np.zeros_like(image_array)
-        elif method == "crop":
-            filtered_img = np.zeros(
-                (image_array.shape[0] - 2 * pad, image_array.shape[1] - 2 * pad)
-            )
-        else:
-            raise ValueError(
-                "Invalid method. Choose from 'padding', 'reflect', 'edge', 'symmetric', 'crop'."
+    # smallest window for which the histogram engine beats sorting
+    HISTOGRAM_MIN_SIZE = 11
+
+    def median_filter_custom(
+        self, image_array, size=3, method="padding", engine="auto"
+    ):
+        """Applies median filter to an image or array
+
+        engine: 'auto' | 'histogram' | 'sort'. 'histogram' needs a uint8 array.
+        """
+
+        if engine == "histogram" and image_array.dtype != np.uint8:
+            raise ValueError("The histogram engine only supports uint8 images.")
+
+        # each strip is padded at the true border only and filtered in valid mode
+        return tiled_filter(
+            image_array,
+            size,
+            method,
+            self.strip_kernel(engine),
+            out_dtype=PRECISIONS[self.precision],
+            workers=self.workers,
+            progress=self.progress,
+        )
+
+    def strip_kernel(self, engine="auto"):
+        """The kernel(strip, window) tiled_filter runs on each strip"""
+
+        if engine not in ("auto", "histogram", "sort"):
+            raise ValueError("engine must be 'auto', 'histogram' or 'sort'")
+
+        def kernel(strip, window):
+            if engine == "histogram" or (
+                engine == "auto"
+                and strip.dtype == np.uint8
+                and window >= self.HISTOGRAM_MIN_SIZE
+            ):
+                median = self._histogram_median
+            else:
+                median = self._sort_median
+
+            rows = strip.shape[0] - window + 1
+            cols = strip.shape[1] - window + 1
+            if strip.ndim == 3:
+                return np.stack(
+                    [
+                        median(strip[..., channel], window, rows, cols)
+                        for channel in range(strip.shape[2])
+                    ],
+                    axis=-1,
+                )
+            return median(strip, window, rows, cols)
+
+        return kernel
+
+    def _sort_median(self, padded_img, window, rows, cols):
+        """Median of the top-left rows x cols windows of a 2D array, by partial sorting"""
+
+        # the median of an odd number of samples is one of them
+        filtered_img = np.empty((rows, cols), padded_img.dtype if window % 2 else float)
+        windows = sliding_window_view(padded_img, (window, window))
+        # bound the temporary copy np.median makes to a few million samples
+        chunk = max(1, 2**22 // max(1, cols * window * window))
+        for i in range(0, rows, chunk):
+            filtered_img[i : i + chunk] = np.median(
+                windows[i : min(i + chunk, rows), :cols], axis=(-2, -1)
             )
+        return filtered_img
 
-        for i in range(image_array.shape[0]):
-            for j in range(image_array.shape[1]):
-                if method == "crop":
-                    if (
-                        i >= pad
-                        and i < image_array.shape[0] - pad
-                        and j >= pad
-                        and j < image_array.shape[1] - pad
-                    ):
-                        window = image_array[
-                            i - pad : i + pad + 1, j - pad : j + pad + 1
-                        ]
-                        filtered_img[i - pad, j - pad] = np.median(window)
-                else:
-                    window = padded_img[i : i + size, j : j + size]
-                    filtered_img[i, j] = np.median(window)
+    def _histogram_median(self, padded_img, window, rows, cols):
+        """Median of the top-left rows x cols windows of a 2D uint8 array
+
+        One histogram per column covers the current `window` rows. Moving down a row
+        removes one pixel from each column histogram and adds one, and the window
+        histograms of a whole row are differences of the column-wise running sum. The
+        median is located in a 16-bin coarse histogram first and then in the 16 fine
+        bins of that coarse bin only.
+        """
+
+        n = window * window
+        ranks = [(n + 1) // 2] if n % 2 else [n // 2, n // 2 + 1]
+        width = padded_img.shape[1]
+        count_dtype = np.uint16 if n < 2**16 else np.uint32
+        columns = np.arange(width)
+
+        fine = np.zeros((width, 256), dtype=count_dtype)
+        coarse = np.zeros((width, 16), dtype=count_dtype)
+        for r in range(window):
+            fine[columns, padded_img[r]] += 1
+            coarse[columns, padded_img[r] >> 4] += 1
+
+        # running sums over columns, with a leading row of zeros
+        fine_csum = np.zeros((width + 1, 256), dtype=count_dtype)
+        coarse_csum = np.zeros((width + 1, 16), dtype=count_dtype)
+        left = np.arange(cols)[:, np.newaxis]
+        right = left + window
+        fine_offsets = np.arange(16)
+
+        filtered_img = np.empty((rows, cols), np.uint8 if n % 2 else float)
+        for i in range(rows):
+            if i > 0:
+                leaving = padded_img[i - 1]
+                entering = padded_img[i + window - 1]
+                fine[columns, leaving] -= 1
+                fine[columns, entering] += 1
+                coarse[columns, leaving >> 4] -= 1
+                coarse[columns, entering >> 4] += 1
+            np.cumsum(fine, axis=0, out=fine_csum[1:])
+            np.cumsum(coarse, axis=0, out=coarse_csum[1:])
+
+            coarse_cum = np.cumsum(
+                coarse_csum[window : window + cols] - coarse_csum[:cols], axis=1
+            )
+            values = []
+            for rank in ranks:
+                coarse_bin = (coarse_cum < rank).sum(axis=1)
+                below = np.take_along_axis(
+                    coarse_cum, np.maximum(coarse_bin - 1, 0)[:, np.newaxis], axis=1
+                )
+                below[coarse_bin == 0] = 0
+                bins = coarse_bin[:, np.newaxis] * 16 + fine_offsets
+                fine_cum = (
+                    np.cumsum(fine_csum[right, bins] - fine_csum[left, bins], axis=1)
+                    + below
+                )
+                values.append(coarse_bin * 16 + (fine_cum < rank).sum(axis=1))
+            filtered_img[i] = np.mean(values, axis=0)
 
         return filtered_img
 
@@ -88,11 +189,13 @@ class MedianFilter:
 
         filtered_image = Image.fromarray(filtered_image_array.astype(np.uint8))
 
-        output_dir = "filtered"
-        os.makedirs(output_dir, exist_ok=True)
+        # in-memory sources (bytes, arrays, file objects) are not written to disk
+        if isinstance(self.input_path, (str, os.PathLike)):
+            output_dir = "filtered"
+            os.makedirs(output_dir, exist_ok=True)
 
-        output_path = f"{output_dir}/{os.path.basename(self.input_path).split('.')[0]}_median_filtered.jpg"
-        filtered_image.save(output_path)
+            output_path = f"{output_dir}/{os.path.basename(self.input_path).split('.')[0]}_median_filtered.jpg"
+            filtered_image.save(output_path)
 
         return filtered_image
 
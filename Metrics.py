@@ -0,0 +1,168 @@
+"""
+Module Documentation:
+This module measures where requests spend their time.
+Timings collects named stage durations for one request or one compression;
+its totals go to the client in a Server-Timing header. Histogram keeps
+Prometheus-style latency histograms, rendered as text for the /metrics route.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+# upper bounds of the latency buckets, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# upper bounds of the image size label, in megapixels
+SIZE_BUCKETS = (0.25, 1, 4, 16, 64)
+
+
+def size_bucket(width, height):
+    """
+    Function Documentation:
+    A low-cardinality label for an image size
+    Args:
+    width, height: Image size in pixels
+    Returns:
+    A label like "<=4MP", or ">64MP"
+    """
+    megapixels = width * height / 1e6
+    for bound in SIZE_BUCKETS:
+        if megapixels <= bound:
+            return f"<={bound:g}MP"
+    return f">{SIZE_BUCKETS[-1]:g}MP"
+
+
+class Timings:
+    """
+    Class Documentation:
+    Named stage durations, in the order the stages first ran.
+    A stage that runs several times (for instance once per batch of blocks, or
+    on several threads) accumulates its durations.
+
+    Attributes:
+    stages: Dict mapping stage name to total seconds.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        """Time the body of a with statement as stage `name`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def update(self, stages, prefix=""):
+        """Add the stages of another Timings (as a dict), with an optional name prefix."""
+        for name, seconds in stages.items():
+            self.add(prefix + name, seconds)
+
+    def as_dict(self):
+        with self._lock:
+            return dict(self.stages)
+
+    def server_timing(self):
+        """
+        Function Documentation:
+        The stages as a Server-Timing header value
+        Returns:
+        A string like "decode;dur=12.5, filter;dur=340.1"
+        """
+        return ", ".join(
+            f"{name};dur={seconds * 1000:.1f}"
+            for name, seconds in self.as_dict().items()
+        )
+
+
+class Histogram:
+    """
+    Class Documentation:
+    A Prometheus histogram with labels.
+    Args:
+    name: The metric name
+    help: The help text
+    labelnames: The label names, in output order
+    buckets: Upper bounds of the buckets, in seconds
+
+    Attributes:
+    name, help, labelnames, buckets: As given.
+    """
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value, **labels):
+        """Record one value for the given label values."""
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            series = self._series.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        """
+        Function Documentation:
+        The histogram in the Prometheus text format
+        Returns:
+        A list of lines
+        """
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted(
+                (key, (list(counts), total, count))
+                for key, (counts, total, count) in self._series.items()
+            )
+        for key, (counts, total, count) in series:
+            pairs = [
+                f'{name}="{_escape(value)}"'
+                for name, value in zip(self.labelnames, key)
+            ]
+            # bucket counts are cumulative: each value counts in every bucket above it
+            for bound, in_bucket in zip(self.buckets, counts):
+                le = ",".join(pairs + [f'le="{bound:g}"'])
+                lines.append(f"{self.name}_bucket{{{le}}} {in_bucket}")
+            le = ",".join(pairs + ['le="+Inf"'])
+            lines.append(f"{self.name}_bucket{{{le}}} {count}")
+            labels = "{" + ",".join(pairs) + "}" if pairs else ""
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# every Histogram registers itself here
+REGISTRY = []
+
+
+def render_metrics():
+    """
+    Function Documentation:
+    All registered histograms in the Prometheus text format
+    Returns:
+    The exposition text
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -2,125 +2,116 @@ from os import sys, makedirs
 from PIL import Image
 import numpy as np
 import os
+from Image_IO import open_image
+from Tiling import PRECISIONS, check_precision, tiled_filter
 
 
 class MinMaxFilter:
     """
     Applies min, max or range (max-min) filter to an image or array.
+
+    Window extrema come from the van Herk/Gil-Werman algorithm, run separably
+    over rows and then columns: about three comparisons per pixel per axis,
+    whatever the kernel size. Min and max are computed together, so 'range'
+    costs a single pass.
+
+    With workers > 1, strips of the image are filtered on that many threads;
+    the result is identical to the single-threaded one.
+    Extrema are exact in the input dtype; precision ("uint8" or "float32")
+    only sets the output dtype.
+    An optional progress(rows, total) callback follows the strips (see tiled_filter).
     """
 
-    def __init__(self, input_path=None):
+    def __init__(self, input_path=None, workers=1, precision="uint8", progress=None):
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        self.workers = workers
+        self.precision = check_precision(precision)
+        self.progress = progress
         self.input_path = input_path
-        if input_path:
+        if input_path is not None:
             try:
-                self.image = Image.open(input_path).convert("L")
+                self.image = open_image(input_path).convert("L")
             except FileNotFoundError:
                 print("File not found. Please provide a valid path.")
                 sys.exit(1)
         else:
             self.image = None
 
+    def _running_min_max_1d(self, low, high, window, axis):
+        """
+        van Herk/Gil-Werman running min and max of `window` samples along `axis`.
+        Returns arrays shortened by window - 1 along that axis.
+        """
+        low = np.moveaxis(low, axis, 0)
+        high = np.moveaxis(high, axis, 0)
+        n = low.shape[0]
+        out_len = n - window + 1
+        blocks = -(-n // window)
+
+        # split the axis into blocks of `window` samples; the tail values never
+        # reach an output because every output window ends inside the input
+        fill = ((0, blocks * window - n),) + ((0, 0),) * (low.ndim - 1)
+        block_shape = (blocks, window) + low.shape[1:]
+        low = np.pad(low, fill, mode="edge").reshape(block_shape)
+        high = np.pad(high, fill, mode="edge").reshape(block_shape)
+
+        # running extrema from each block start (prefix) and to each block end (suffix)
+        flat_shape = (blocks * window,) + low.shape[2:]
+        prefix_min = np.minimum.accumulate(low, axis=1).reshape(flat_shape)
+        prefix_max = np.maximum.accumulate(high, axis=1).reshape(flat_shape)
+        suffix_min = np.minimum.accumulate(low[:, ::-1], axis=1)[:, ::-1].reshape(
+            flat_shape
+        )
+        suffix_max = np.maximum.accumulate(high[:, ::-1], axis=1)[:, ::-1].reshape(
+            flat_shape
+        )
+
+        # a window [j, j + window) spans at most two blocks: the suffix of the
+        # first and the prefix of the second
+        low = np.minimum(
+            suffix_min[:out_len], prefix_min[window - 1 : window - 1 + out_len]
+        )
+        high = np.maximum(
+            suffix_max[:out_len], prefix_max[window - 1 : window - 1 + out_len]
+        )
+        return np.moveaxis(low, 0, axis), np.moveaxis(high, 0, axis)
+
+    def _running_min_max(self, padded_img, window):
+        """Min and max of every window x window block, separably over rows then columns."""
+        low, high = self._running_min_max_1d(padded_img, padded_img, window, axis=0)
+        return self._running_min_max_1d(low, high, window, axis=1)
+
     def min_max_filter_custom(self, image_array, size=3, mode="min", method="padding"):
         """
         mode: 'min' | 'max' | 'range'
         method: padding | crop | reflect | edge | symmetric
         """
-        pad = size // 2
-        # pad only spatial axes for color images
-        if image_array.ndim == 3:
-            pad_width = ((pad, pad), (pad, pad), (0, 0))
-        else:
-            pad_width = ((pad, pad), (pad, pad))
-
-        if method == "padding":
-            padded_img = np.pad(
-                image_array, pad_width, mode="constant", constant_values=0
-            )
-        elif method == "reflect":
-            padded_img = np.pad(image_array, pad_width, mode="reflect")
-        elif method == "edge":
-            padded_img = np.pad(image_array, pad_width, mode="edge")
-        elif method == "symmetric":
-            padded_img = np.pad(image_array, pad_width, mode="symmetric")
-        elif method == "crop":
-            # output with channel awareness
-            if image_array.ndim == 3:
-                filtered_img = np.zeros(
-                    (
-                        image_array.shape[0] - 2 * pad,
-                        image_array.shape[1] - 2 * pad,
-                        image_array.shape[2],
-                    ),
-                    dtype=float,
-                )
-                for i in range(pad, image_array.shape[0] - pad):
-                    for j in range(pad, image_array.shape[1] - pad):
-                        window = image_array[
-                            i - pad : i + pad + 1, j - pad : j + pad + 1, :
-                        ]
-                        if mode == "min":
-                            filtered_img[i - pad, j - pad] = np.min(window, axis=(0, 1))
-                        elif mode == "max":
-                            filtered_img[i - pad, j - pad] = np.max(window, axis=(0, 1))
-                        elif mode == "range":
-                            filtered_img[i - pad, j - pad] = np.max(
-                                window, axis=(0, 1)
-                            ) - np.min(window, axis=(0, 1))
-                        else:
-                            raise ValueError("mode must be 'min', 'max' or 'range'")
-            else:
-                filtered_img = np.zeros(
-                    (image_array.shape[0] - 2 * pad, image_array.shape[1] - 2 * pad),
-                    dtype=float,
-                )
-                for i in range(pad, image_array.shape[0] - pad):
-                    for j in range(pad, image_array.shape[1] - pad):
-                        window = image_array[
-                            i - pad : i + pad + 1, j - pad : j + pad + 1
-                        ]
-                        if mode == "min":
-                            filtered_img[i - pad, j - pad] = np.min(window)
-                        elif mode == "max":
-                            filtered_img[i - pad, j - pad] = np.max(window)
-                        elif mode == "range":
-                            filtered_img[i - pad, j - pad] = np.max(window) - np.min(
-                                window
-                            )
-                        else:
-                            raise ValueError("mode must be 'min', 'max' or 'range'")
-            return filtered_img.astype(np.uint8)
-        else:
-            raise ValueError(
-                "Invalid method. Choose from 'padding', 'reflect', 'edge', 'symmetric', 'crop'."
-            )
-
-        filtered_img = np.zeros_like(image_array, dtype=float)
-        for i in range(image_array.shape[0]):
-            for j in range(image_array.shape[1]):
-                if image_array.ndim == 3:
-                    window = padded_img[i : i + size, j : j + size, :]
-                    if mode == "min":
-                        filtered_img[i, j] = np.min(window, axis=(0, 1))
-                    elif mode == "max":
-                        filtered_img[i, j] = np.max(window, axis=(0, 1))
-                    elif mode == "range":
-                        filtered_img[i, j] = np.max(window, axis=(0, 1)) - np.min(
-                            window, axis=(0, 1)
-                        )
-                    else:
-                        raise ValueError("mode must be 'min', 'max' or 'range'")
-                else:
-                    window = padded_img[i : i + size, j : j + size]
-                    if mode == "min":
-                        filtered_img[i, j] = np.min(window)
-                    elif mode == "max":
-                        filtered_img[i, j] = np.max(window)
-                    elif mode == "range":
-                        filtered_img[i, j] = np.max(window) - np.min(window)
-                    else:
-                        raise ValueError("mode must be 'min', 'max' or 'range'")
-
-        return filtered_img.astype(np.uint8)
+        # each strip is padded at the true border only and filtered in valid mode
+        return tiled_filter(
+            image_array,
+            size,
+            method,
+            self.strip_kernel(mode),
+            out_dtype=PRECISIONS[self.precision],
+            workers=self.workers,
+            progress=self.progress,
+        )
+
+    def strip_kernel(self, mode="min"):
+        """The kernel(strip, window) tiled_filter runs on each strip."""
+        if mode not in ("min", "max", "range"):
+            raise ValueError("mode must be 'min', 'max' or 'range'")
+
+        def kernel(strip, window):
+            low, high = self._running_min_max(strip, window)
+            if mode == "min":
+                return low
+            if mode == "max":
+                return high
+            return high - low
+
+        return kernel
 
     def process_image(self, size=3, mode="min", method="padding"):
         if self.image is None:
@@ -132,11 +123,13 @@ class MinMaxFilter:
         )
         filtered_image = Image.fromarray(filtered_image_array.astype(np.uint8))
 
-        output_dir = "filtered"
-        os.makedirs(output_dir, exist_ok=True)
+        # in-memory sources (bytes, arrays, file objects) are not written to disk
+        if isinstance(self.input_path, (str, os.PathLike)):
+            output_dir = "filtered"
+            os.makedirs(output_dir, exist_ok=True)
 
-        output_path = f"{output_dir}/{os.path.basename(self.input_path).split('.')[0]}_minmax_filtered.jpg"
-        filtered_image.save(output_path)
+            output_path = f"{output_dir}/{os.path.basename(self.input_path).split('.')[0]}_minmax_filtered.jpg"
+            filtered_image.save(output_path)
 
         return filtered_image
 
@@ -0,0 +1,247 @@
+"""
+Module Documentation:
+This module chains filters (for example a median denoise, a Gaussian blur,
+then a min-max range edge map) and runs them as one fused pass.
+
+The output is produced one horizontal strip at a time. A strip is computed
+backwards from the last stage: each stage needs a few more rows of the
+previous stage's output (its halo), so the first stage reads the strip plus
+the combined halo of every stage. Intermediate results therefore only exist
+strip-sized, never at full-image size, and each stage applies its own edge
+handling at the true border of its own input, exactly as if the filters had
+been run one after another.
+
+The row and column indices of every stage and strip form an execution plan,
+which is compiled once per (stages, image shape) and reused.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import numpy as np
+
+from Average_Filter import AverageFilter
+from Gauss_Filter import GaussFilter
+from Median_Filter import MedianFilter
+from MinMax_Filter import MinMaxFilter
+from Tiling import (
+    PRECISIONS,
+    TILE_PIXELS,
+    border_index,
+    check_precision,
+    gather,
+    strip_bounds,
+    to_uint8,
+    window_layout,
+)
+
+METHODS = ("padding", "crop", "reflect", "edge", "symmetric")
+
+
+def normalize_spec(spec):
+    """
+    Function Documentation:
+    Validate one stage of a pipeline and fill in its defaults
+    Args:
+    spec: A dict with filter_type and optionally size (or kernel_size),
+    method, sigma (Gauss Filter) and mode (Min-Max Filter)
+    Returns:
+    A new dict holding only the parameters of that filter type
+    """
+    filter_type = spec.get("filter_type")
+    size = int(spec.get("size", spec.get("kernel_size", 3)))
+    method = str(spec.get("method", "padding")).lower()
+    if size < 1:
+        raise ValueError("size must be at least 1")
+    if method not in METHODS:
+        raise ValueError(f"method must be one of {METHODS}")
+
+    normalized = {"filter_type": filter_type, "size": size, "method": method}
+    if filter_type == "Gauss Filter":
+        sigma = spec.get("sigma")
+        normalized["sigma"] = None if sigma is None else float(sigma)
+    elif filter_type == "Min-Max Filter":
+        mode = str(spec.get("mode", "min")).lower()
+        if mode not in ("min", "max", "range"):
+            raise ValueError("mode must be 'min', 'max' or 'range'")
+        normalized["mode"] = mode
+    elif filter_type not in ("Median Filter", "Average Filter"):
+        raise ValueError(f"{filter_type} not implemented")
+    return normalized
+
+
+def stage_kernel(spec, precision, image_shape):
+    """
+    Function Documentation:
+    The strip kernel and window of one normalized stage
+    Args:
+    spec: A dict from normalize_spec
+    precision: The precision of the filter
+    image_shape: The shape of the stage's whole input image
+    Returns:
+    kernel: The kernel(strip, window) of the filter
+    window: The window size, or None for the filter's default
+    """
+    filter_type = spec["filter_type"]
+    if filter_type == "Median Filter":
+        return MedianFilter(precision=precision).strip_kernel(), None
+    if filter_type == "Average Filter":
+        return AverageFilter(precision=precision).strip_kernel(), None
+    if filter_type == "Gauss Filter":
+        kernel = GaussFilter(precision=precision).strip_kernel(
+            spec["size"], spec["sigma"], image_shape=image_shape
+        )
+        return kernel, spec["size"]
+    return MinMaxFilter(precision=precision).strip_kernel(spec["mode"]), None
+
+
+class Stage:
+    """
+    Class Documentation:
+    One filter of a compiled plan.
+
+    Attributes:
+    kernel: The kernel(strip, window) of the filter.
+    window: The window size.
+    row_index, col_index: Input position of every padded row and column, from border_index.
+    out_shape: The shape of the stage's whole output.
+    """
+
+    def __init__(self, kernel, window, row_index, col_index, out_shape):
+        self.kernel = kernel
+        self.window = window
+        self.row_index = row_index
+        self.col_index = col_index
+        self.out_shape = out_shape
+
+
+@lru_cache(maxsize=32)
+def compile_plan(specs, shape, precision, tile_pixels=TILE_PIXELS):
+    """
+    Function Documentation:
+    Lay out the stages and strips of a pipeline for one image shape
+    Args:
+    specs: The normalized stages, as a tuple of sorted item tuples
+    shape: The shape of the input image
+    precision: The precision of every stage
+    tile_pixels: Target input samples per strip
+    Returns:
+    stages: A list of Stage
+    strips: For every strip, the (first, last) output rows of each stage,
+    last excluded, from the first stage to the last
+    """
+    stages = []
+    for spec in specs:
+        spec = dict(spec)
+        kernel, window = stage_kernel(spec, precision, shape)
+        window, before, after = window_layout(spec["size"], spec["method"], window)
+        row_index = border_index(shape[0], before, after, spec["method"])
+        col_index = border_index(shape[1], before, after, spec["method"])
+        shape = (
+            row_index.size - window + 1,
+            col_index.size - window + 1,
+        ) + shape[2:]
+        if shape[0] < 1 or shape[1] < 1:
+            raise ValueError("The image is smaller than the pipeline's windows")
+        stages.append(Stage(kernel, window, row_index, col_index, shape))
+
+    # each output row of the pipeline reads this many rows of the input
+    span = 1 + sum(stage.window - 1 for stage in stages)
+    row_pixels = stages[0].col_index.size * int(np.prod(shape[2:]))
+    strips = []
+    for r0, r1 in strip_bounds(shape[0], span, row_pixels, tile_pixels):
+        # walk back from the last stage: the output rows [r0, r1) of a stage
+        # read the rows row_index[r0:r1 + window - 1] of its input, which the
+        # stage before must produce
+        layout = []
+        for stage in reversed(stages):
+            layout.append((r0, r1))
+            rows = stage.row_index[r0 : r1 + stage.window - 1]
+            inside = rows[rows >= 0]
+            r0, r1 = int(inside.min()), int(inside.max()) + 1
+        strips.append(layout[::-1])
+    return stages, strips
+
+
+class FilterPipeline:
+    """
+    Class Documentation:
+    An ordered list of filters run as one fused pass.
+    Args:
+    specs: A list of dicts, see normalize_spec
+    precision: "uint8" (each stage rounds, as when running the filters one
+    after another) or "float32" (intermediates are kept unrounded)
+    workers: Threads filtering strips at the same time; the strips are the
+    same for any value, so the result is too
+    tile_pixels: Target input samples per strip
+    progress: Called as progress(rows, total) with the output rows of every
+    finished strip, as in tiled_filter, or None
+
+    Attributes:
+    specs: The normalized stages.
+    precision, workers, tile_pixels, progress: As given.
+    """
+
+    def __init__(
+        self,
+        specs,
+        precision="uint8",
+        workers=1,
+        tile_pixels=TILE_PIXELS,
+        progress=None,
+    ):
+        if not specs:
+            raise ValueError("A pipeline needs at least one stage")
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        self.specs = [normalize_spec(spec) for spec in specs]
+        self.precision = check_precision(precision)
+        self.workers = workers
+        self.tile_pixels = tile_pixels
+        self.progress = progress
+
+    def plan(self, shape):
+        """The compiled plan of this pipeline for an image shape (cached)."""
+        key = tuple(tuple(sorted(spec.items())) for spec in self.specs)
+        return compile_plan(key, tuple(shape), self.precision, self.tile_pixels)
+
+    def run(self, image_array):
+        """
+        Function Documentation:
+        Apply every stage to an image
+        Args:
+        image_array: The 2D or 3D (channels last) input array
+        Returns:
+        The filtered array as uint8 or float32 (see precision); smaller than
+        the input by the window of every 'crop' stage
+        """
+        stages, strips = self.plan(image_array.shape)
+        out_dtype = PRECISIONS[self.precision]
+        filtered_img = np.empty(stages[-1].out_shape, dtype=out_dtype)
+        out_rows = filtered_img.shape[0]
+        progress = self.progress
+
+        def run(layout):
+            # block holds the rows [first, ...) of the current stage's input
+            block, first = image_array, 0
+            for stage, (r0, r1) in zip(stages, layout):
+                rows = stage.row_index[r0 : r1 + stage.window - 1]
+                local = np.where(rows >= 0, rows - first, -1)
+                strip = gather(block, local, stage.col_index)
+                values = stage.kernel(strip, stage.window)
+                if out_dtype == np.uint8:
+                    values = to_uint8(values)
+                block, first = values.astype(out_dtype, copy=False), r0
+            filtered_img[layout[-1][0] : layout[-1][1]] = block
+            if progress is not None:
+                progress(layout[-1][1] - layout[-1][0], out_rows)
+
+        if progress is not None:
+            progress(0, out_rows)
+        if self.workers > 1 and len(strips) > 1:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                list(executor.map(run, strips))
+        else:
+            for layout in strips:
+                run(layout)
+        return filtered_img
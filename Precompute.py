@@ -0,0 +1,90 @@
+"""
+Module Documentation:
+This module memoizes the small tables the filters and the compressor rebuild
+for every request: Gaussian kernels by (size, sigma) and scaled quantization
+tables by quality. The returned arrays are shared between callers and are
+therefore read-only.
+"""
+
+from functools import lru_cache
+
+import numpy as np
+
+
+def _read_only(array):
+    array.setflags(write=False)
+    return array
+
+
+def default_sigma(size):
+    """The sigma GaussFilter uses when none is given."""
+    return size / 6.0 if size > 1 else 0.5
+
+
+@lru_cache(maxsize=128)
+def _gaussian_kernel_1d(size, sigma):
+    ax = np.arange(-size // 2 + 1.0, size // 2 + 1.0)
+    kernel = np.exp(-(ax**2) / (2.0 * sigma**2))
+    return _read_only(kernel / np.sum(kernel))
+
+
+@lru_cache(maxsize=128)
+def _gaussian_kernel(size, sigma):
+    ax = np.arange(-size // 2 + 1.0, size // 2 + 1.0)
+    xx, yy = np.meshgrid(ax, ax)
+    kernel = np.exp(-(xx**2 + yy**2) / (2.0 * sigma**2))
+    return _read_only(kernel / np.sum(kernel))
+
+
+def gaussian_kernel_1d(size=3, sigma=None):
+    """
+    Function Documentation:
+    Normalized 1D Gaussian kernel
+    Args:
+    size: The kernel size
+    sigma: The standard deviation (default: size / 6)
+    Returns:
+    A read-only array of shape (size,)
+    """
+    if sigma is None:
+        sigma = default_sigma(size)
+    return _gaussian_kernel_1d(int(size), float(sigma))
+
+
+def gaussian_kernel(size=3, sigma=None):
+    """
+    Function Documentation:
+    Normalized 2D Gaussian kernel
+    Args:
+    size: The kernel size
+    sigma: The standard deviation (default: size / 6)
+    Returns:
+    A read-only array of shape (size, size)
+    """
+    if sigma is None:
+        sigma = default_sigma(size)
+    return _gaussian_kernel(int(size), float(sigma))
+
+
+@lru_cache(maxsize=256)
+def _quant_tables(table_bytes, shape, quality):
+    quant_matrix = np.frombuffer(table_bytes, dtype=np.float64).reshape(shape)
+    scaled = np.clip(np.round(quant_matrix * quality / 100), 1, 255).astype(int)
+    return _read_only(scaled), _read_only(1.0 / scaled)
+
+
+def quant_tables(quant_matrix, quality):
+    """
+    Function Documentation:
+    A quantization matrix scaled by the quality, and its reciprocal
+    Baseline JPEG stores 8-bit integer steps, so the scaled steps are rounded
+    and kept in [1, 255]. Quantizing is then a multiply by the reciprocal.
+    Args:
+    quant_matrix: The quantization matrix
+    quality: The quality in percent
+    Returns:
+    scaled: The integer table, as written to the JPEG file (read-only)
+    reciprocal: 1 / scaled (read-only)
+    """
+    quant_matrix = np.ascontiguousarray(quant_matrix, dtype=np.float64)
+    return _quant_tables(quant_matrix.tobytes(), quant_matrix.shape, float(quality))
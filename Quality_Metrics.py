@@ -0,0 +1,179 @@
+"""
+Module Documentation:
+This module measures how far a processed image is from its input: the mean
+squared error, the PSNR and the SSIM (Wang et al., 2004).
+
+SSIM uses the usual 11 x 11 Gaussian window with sigma 1.5, built and applied
+by the same code as GaussFilter (Precompute.gaussian_kernel_1d and
+Gauss_Filter.separable_correlate), on the luminance of colour images. As in
+the authors' reference implementation, both images are first averaged over
+f x f blocks so that their shorter side is about 256 pixels, which is what the
+index is calibrated for and keeps it cheap on large images. MSE and PSNR use
+every pixel and colour channel; an alpha channel is left out of all three.
+"""
+
+import numpy as np
+
+from Gauss_Filter import separable_correlate
+from Precompute import gaussian_kernel_1d
+
+SSIM_WINDOW = 11
+SSIM_SIGMA = 1.5
+# shorter side of the images SSIM compares
+SSIM_SIDE = 256
+# stabilizing constants for 8-bit samples
+C1 = (0.01 * 255) ** 2
+C2 = (0.03 * 255) ** 2
+# samples per chunk when summing squared errors, to bound the temporaries
+MSE_CHUNK = 1 << 20
+
+# BT.601 luma weights of R, G and B
+LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+def centre_crop(reference, shape):
+    """
+    Function Documentation:
+    The centre of an image with the height and width of a smaller result, as
+    the 'crop' edge-handling method leaves it
+    Args:
+    reference: The input image
+    shape: The shape of the result
+    Returns:
+    A view of reference
+    """
+    top = (reference.shape[0] - shape[0]) // 2
+    left = (reference.shape[1] - shape[1]) // 2
+    return reference[top : top + shape[0], left : left + shape[1]]
+
+
+def colour_channels(image_array):
+    """
+    Function Documentation:
+    An image without its alpha channel, which the metrics leave out
+    Args:
+    image_array: A 2D array or a 3D array of 1 to 4 channels (L, LA, RGB, RGBA)
+    Returns:
+    A view of image_array: 2D for grey images, 3 channels for colour images
+    """
+    if image_array.ndim == 3 and image_array.shape[2] in (1, 2):
+        return image_array[..., 0]
+    if image_array.ndim == 3 and image_array.shape[2] == 4:
+        return image_array[..., :3]
+    return image_array
+
+
+def mse(reference, image_array):
+    """
+    Function Documentation:
+    Mean squared error between two images of the same shape
+    Args:
+    reference, image_array: The arrays to compare
+    Returns:
+    The mean over every sample, as a float
+    """
+    reference = reference.reshape(-1)
+    image_array = image_array.reshape(-1)
+    total = 0.0
+    for start in range(0, reference.size, MSE_CHUNK):
+        diff = reference[start : start + MSE_CHUNK].astype(np.float32)
+        diff -= image_array[start : start + MSE_CHUNK]
+        total += float(np.dot(diff, diff))
+    return total / max(reference.size, 1)
+
+
+def psnr(reference, image_array, error=None):
+    """
+    Function Documentation:
+    Peak signal-to-noise ratio of an 8-bit image against a reference
+    Args:
+    reference, image_array: The arrays to compare
+    error: Their mse, if already known
+    Returns:
+    The PSNR in dB (inf for identical images)
+    """
+    if error is None:
+        error = mse(reference, image_array)
+    return float("inf") if error == 0 else float(10 * np.log10(255**2 / error))
+
+
+def _ssim_plane(image_array, factor):
+    """Average f x f blocks of an image and reduce colour to luminance, in float32."""
+    h, w = image_array.shape[:2]
+    h, w = h - h % factor, w - w % factor
+    image_array = image_array[:h, :w]
+    # summing f strided slices is far faster than reducing short block axes;
+    # 8-bit samples add up exactly in integers
+    if image_array.dtype == np.uint8:
+        row_dtype = np.uint16 if factor * 255 <= 0xFFFF else np.uint32
+        block_dtype = np.uint32
+    else:
+        row_dtype = block_dtype = np.float32
+    rows = np.zeros((h // factor,) + image_array.shape[1:], dtype=row_dtype)
+    for k in range(factor):
+        rows += image_array[k::factor]
+    blocks = np.zeros((h // factor, w // factor) + rows.shape[2:], dtype=block_dtype)
+    for k in range(factor):
+        blocks += rows[:, k::factor]
+    plane = blocks.astype(np.float32) / factor**2
+    if plane.ndim == 3:
+        plane = plane @ LUMA
+    return plane
+
+
+def ssim(reference, image_array):
+    """
+    Function Documentation:
+    Mean structural similarity index of two images of the same shape
+    Args:
+    reference, image_array: The 2D or 3D (channels last, RGB) arrays to compare
+    Returns:
+    The mean SSIM, at most 1 (identical images)
+    """
+    factor = max(1, round(min(reference.shape[:2]) / SSIM_SIDE))
+    x = _ssim_plane(reference, factor)
+    y = _ssim_plane(image_array, factor)
+    if min(x.shape) < SSIM_WINDOW:
+        # too small for a window: one window over the whole image
+        blur = lambda plane: plane.mean(dtype=np.float32)
+    else:
+        kernel_1d = gaussian_kernel_1d(SSIM_WINDOW, SSIM_SIGMA).astype(np.float32)
+        blur = lambda plane: separable_correlate(plane, kernel_1d)
+
+    # variances come from samples around 128, which keeps float32 sums precise
+    mu_x, mu_y = blur(x), blur(y)
+    x, y = x - 128, y - 128
+    cx, cy = mu_x - 128, mu_y - 128
+    var_x = blur(x * x) - cx * cx
+    var_y = blur(y * y) - cy * cy
+    cov = blur(x * y) - cx * cy
+
+    index = ((2 * mu_x * mu_y + C1) * (2 * cov + C2)) / (
+        (mu_x * mu_x + mu_y * mu_y + C1) * (var_x + var_y + C2)
+    )
+    return float(index.mean())
+
+
+def quality_metrics(reference, image_array):
+    """
+    Function Documentation:
+    MSE, PSNR and SSIM of a result against its input, as reported by the routes
+    A result smaller than its input (the 'crop' method) is compared with the
+    centre of the input.
+    Args:
+    reference: The input image
+    image_array: The result, as 8-bit samples; an alpha channel is ignored
+    Returns:
+    A dict with mse, psnr (None for identical images: JSON has no infinity) and ssim
+    """
+    reference = colour_channels(reference)
+    image_array = colour_channels(image_array)
+    if reference.shape != image_array.shape:
+        reference = centre_crop(reference, image_array.shape)
+    error = mse(reference, image_array)
+    peak = psnr(reference, image_array, error)
+    return {
+        "mse": round(error, 4),
+        "psnr": None if peak == float("inf") else round(peak, 4),
+        "ssim": round(ssim(reference, image_array), 6),
+    }
@@ -0,0 +1,263 @@
+"""
+Module Documentation:
+This module caches encoded results of the /filter and /compress routes.
+Entries are addressed by a hash of the uploaded bytes and the normalized
+request parameters, so a repeated request is answered without decoding or
+processing the image again.
+
+There are two tiers:
+1. An in-process LRU holding at most max_bytes of results.
+2. An optional directory on disk holding at most max_disk_bytes, evicting the
+   least recently used files first. Disk hits are copied back into memory.
+
+A result can carry details (what the route reports with it, such as the
+quality a size target led to). They are kept in the same entry, so they are
+found and evicted together with the result.
+
+Configuration (environment variables):
+DIP_CACHE_BYTES: Memory tier size in bytes (default: 256 MB, 0 disables it).
+DIP_CACHE_DIR: Directory of the disk tier (default: no disk tier).
+DIP_CACHE_DISK_BYTES: Disk tier size in bytes (default: 2 GB).
+"""
+
+import hashlib
+import json
+import os
+import struct
+import tempfile
+import threading
+from collections import OrderedDict
+
+# disk entries start with this tag and the length of their details JSON
+# (4 bytes, big-endian), then the JSON and the result; files without the tag
+# hold a result alone
+DISK_TAG = b"DIPC"
+
+
+class ResultCache:
+    """
+    Class Documentation:
+    A two-tier (memory, disk) LRU cache of encoded results.
+    Args:
+    max_bytes: Size of the memory tier in bytes.
+    directory: Directory of the disk tier, or None for memory only.
+    max_disk_bytes: Size of the disk tier in bytes.
+
+    Attributes:
+    max_bytes: Size of the memory tier in bytes.
+    directory: Directory of the disk tier, or None.
+    max_disk_bytes: Size of the disk tier in bytes.
+    hits, misses: Lookup counters.
+    disk_hits: Hits served from the disk tier (included in hits).
+    """
+
+    def __init__(self, max_bytes=None, directory=None, max_disk_bytes=None):
+        if max_bytes is None:
+            max_bytes = int(os.environ.get("DIP_CACHE_BYTES", 256 << 20))
+        if directory is None:
+            directory = os.environ.get("DIP_CACHE_DIR") or None
+        if max_disk_bytes is None:
+            max_disk_bytes = int(os.environ.get("DIP_CACHE_DISK_BYTES", 2 << 30))
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk = OrderedDict()
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            self._load_disk_index()
+
+    @staticmethod
+    def digest(data):
+        """
+        Function Documentation:
+        The content hash of an uploaded file
+        Args:
+        data: The uploaded file as bytes
+        Returns:
+        A hex digest
+        """
+        return hashlib.sha256(data).hexdigest()
+
+    @staticmethod
+    def key(digest, **params):
+        """
+        Function Documentation:
+        The cache key of an upload and its parameters
+        Args:
+        digest: ResultCache.digest of the uploaded file
+        params: The normalized parameters that determine the result
+        Returns:
+        A hex digest
+        """
+        content = digest + json.dumps(params, sort_keys=True)
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def _load_disk_index(self):
+        """Index the files already in the disk tier, least recently used first."""
+        entries = []
+        for name in os.listdir(self.directory):
+            path = self._path(name)
+            if len(name) == 64 and os.path.isfile(path):
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self._disk[name] = size
+            self._disk_bytes += size
+
+    def get(self, key):
+        """
+        Function Documentation:
+        Look up a result
+        Args:
+        key: A key from ResultCache.key
+        Returns:
+        The cached bytes, or None
+        """
+        entry = self._lookup(key)
+        return None if entry is None else entry[0]
+
+    def get_with_details(self, key):
+        """
+        Function Documentation:
+        Look up a result and the details stored with it (one lookup)
+        Args:
+        key: A key from ResultCache.key
+        Returns:
+        The (bytes, details dict) pair, or None
+        """
+        entry = self._lookup(key)
+        if entry is None:
+            return None
+        value, details = entry
+        return value, json.loads(details) if details else {}
+
+    def _lookup(self, key):
+        """The (value, details JSON) entry of a key, counted as a hit or a miss."""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return self._memory[key]
+            on_disk = key in self._disk
+            if not on_disk:
+                self.misses += 1
+                return None
+
+        try:
+            with open(self._path(key), "rb") as f:
+                entry = self._unpack(f.read())
+            os.utime(self._path(key))
+        except OSError:
+            # evicted or removed behind our back
+            with self._lock:
+                self._drop_disk(key)
+                self.misses += 1
+            return None
+
+        with self._lock:
+            if key in self._disk:
+                self._disk.move_to_end(key)
+            self.hits += 1
+            self.disk_hits += 1
+            self._put_memory(key, entry)
+        return entry
+
+    def put(self, key, value, details=None):
+        """
+        Function Documentation:
+        Store a result in both tiers
+        Args:
+        key: A key from ResultCache.key
+        value: The result as bytes
+        details: A JSON-serializable dict reported with the result, or None
+        """
+        entry = (value, json.dumps(details).encode() if details else b"")
+        data = self._pack(entry)
+        with self._lock:
+            self._put_memory(key, entry)
+            if self.directory is None or len(data) > self.max_disk_bytes:
+                return
+            if key in self._disk:
+                self._disk.move_to_end(key)
+                return
+
+        # write to a temporary file first so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, self._path(key))
+
+        with self._lock:
+            self._drop_disk(key)
+            self._disk[key] = len(data)
+            self._disk_bytes += len(data)
+            while self._disk_bytes > self.max_disk_bytes:
+                old_key = next(iter(self._disk))
+                self._drop_disk(old_key)
+                try:
+                    os.remove(self._path(old_key))
+                except OSError:
+                    pass
+
+    @staticmethod
+    def _pack(entry):
+        value, details = entry
+        if not details:
+            return value
+        return DISK_TAG + struct.pack(">I", len(details)) + details + value
+
+    @staticmethod
+    def _unpack(data):
+        if not data.startswith(DISK_TAG):
+            return data, b""
+        start = len(DISK_TAG) + 4
+        (length,) = struct.unpack(">I", data[len(DISK_TAG) : start])
+        return data[start + length :], data[start : start + length]
+
+    def _put_memory(self, key, entry):
+        size = len(entry[0]) + len(entry[1])
+        if size > self.max_bytes:
+            return
+        if key in self._memory:
+            old_value, old_details = self._memory.pop(key)
+            self._memory_bytes -= len(old_value) + len(old_details)
+        self._memory[key] = entry
+        self._memory_bytes += size
+        while self._memory_bytes > self.max_bytes:
+            _, (old_value, old_details) = self._memory.popitem(last=False)
+            self._memory_bytes -= len(old_value) + len(old_details)
+
+    def _drop_disk(self, key):
+        size = self._disk.pop(key, None)
+        if size is not None:
+            self._disk_bytes -= size
+
+    def stats(self):
+        """
+        Function Documentation:
+        Counters and sizes of the cache
+        Returns:
+        A dict of hits, misses, disk_hits, entry counts and byte sizes
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "disk_hits": self.disk_hits,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_bytes,
+            }
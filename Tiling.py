@@ -0,0 +1,223 @@
+"""
+Module Documentation:
+This module runs a sliding-window filter over an image one horizontal strip
+at a time. Each strip carries a halo of size // 2 rows so that its windows are
+complete, and padding is applied only where a strip touches the true image
+border. Results are written into a preallocated output array, so peak memory
+is about one strip of working data instead of several full-image copies.
+
+A filter plugs in a kernel(strip, window) function that returns only the
+fully covered ("valid") windows of the strip it is given.
+
+Filters produce one of two precisions: "uint8" (results rounded to nearest,
+halves up, and saturated to [0, 255]) or "float32" (unrounded).
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# np.pad mode for each edge-handling method of the filters
+PAD_MODES = {
+    "padding": "constant",
+    "reflect": "reflect",
+    "edge": "edge",
+    "symmetric": "symmetric",
+}
+
+# pixels (rows x columns) in one strip, halo included
+TILE_PIXELS = 1 << 20
+
+# output dtype of each filter precision
+PRECISIONS = {"uint8": np.uint8, "float32": np.float32}
+
+
+def check_precision(precision):
+    """Validate a filter precision and return it."""
+    if precision not in PRECISIONS:
+        raise ValueError("precision must be 'uint8' or 'float32'")
+    return precision
+
+
+def to_uint8(values):
+    """
+    Function Documentation:
+    Round values to nearest (halves up) and saturate them to [0, 255]
+    Args:
+    values: An array of any numeric dtype
+    Returns:
+    The values as uint8
+    """
+    if values.dtype == np.uint8:
+        return values
+    if np.issubdtype(values.dtype, np.floating):
+        values = np.floor(values + 0.5)
+    return np.clip(values, 0, 255).astype(np.uint8)
+
+
+def border_index(length, before, after, method):
+    """
+    Function Documentation:
+    Map positions of a padded axis to positions of the original axis
+    Args:
+    length: The length of the original axis
+    before: Samples of padding before the axis
+    after: Samples of padding after the axis
+    method: The edge-handling method (anything when there is no padding)
+    Returns:
+    The index of every padded position, -1 where constant padding applies
+    """
+    index = np.arange(length)
+    if before == 0 and after == 0:
+        return index
+    if method == "padding":
+        return np.pad(index, (before, after), mode="constant", constant_values=-1)
+    return np.pad(index, (before, after), mode=PAD_MODES[method])
+
+
+def gather(image_array, rows, cols):
+    """
+    Function Documentation:
+    Copy the given rows and columns of an image, zero where an index is -1
+    Args:
+    image_array: The 2D or 3D input array
+    rows: Row indices, from border_index
+    cols: Column indices, from border_index
+    Returns:
+    The strip as a new array
+    """
+    strip = image_array[np.maximum(rows, 0)][:, np.maximum(cols, 0)]
+    strip[rows < 0] = 0
+    strip[:, cols < 0] = 0
+    return strip
+
+
+def strip_bounds(rows, window, row_pixels, tile_pixels=TILE_PIXELS):
+    """
+    Function Documentation:
+    Split the output rows into strips of about tile_pixels input pixels
+    Args:
+    rows: The number of output rows
+    window: The window height; a strip of n output rows reads n + window - 1 rows
+    row_pixels: Samples in one input row
+    tile_pixels: Target samples per strip
+    Returns:
+    A list of (first, last) output rows, last excluded
+    """
+    # keep strips well above the halo so it is not recomputed too often
+    step = max(tile_pixels // max(row_pixels, 1) - window + 1, 2 * window, 1)
+    return [(r0, min(r0 + step, rows)) for r0 in range(0, rows, step)]
+
+
+def window_layout(size, method, window=None):
+    """
+    Function Documentation:
+    The window of a filter and the padding it needs on each side
+    Args:
+    size: The filter size; the halo is size // 2
+    method: The edge-handling method ('padding', 'reflect', 'edge', 'symmetric' or 'crop')
+    window: The window size, by default size (2 * (size // 2) + 1 for 'crop')
+    Returns:
+    window: The window size
+    before, after: Samples of padding before and after each axis
+    """
+    pad = size // 2
+    if method == "crop":
+        # only pixels whose whole window lies inside the image
+        if window is None:
+            window = 2 * pad + 1
+        return window, 0, 0
+    if method in PAD_MODES:
+        if window is None:
+            window = size
+        return window, pad, window - 1 - pad
+    raise ValueError(
+        "Invalid method. Choose from 'padding', 'reflect', 'edge', 'symmetric', 'crop'."
+    )
+
+
+def output_size(height, width, size, method, window=None):
+    """
+    Function Documentation:
+    The height and width of a filter's output
+    Args:
+    height, width: The size of the input image
+    size: The filter size; the halo is size // 2
+    method: The edge-handling method ('padding', 'reflect', 'edge', 'symmetric' or 'crop')
+    window: The window size, by default size (2 * (size // 2) + 1 for 'crop')
+    Returns:
+    rows, cols: The output size; raises ValueError when 'crop' leaves no pixels
+    """
+    window, before, after = window_layout(size, method, window)
+    rows = height + before + after - window + 1
+    cols = width + before + after - window + 1
+    if rows < 1 or cols < 1:
+        raise ValueError(
+            f"Kernel size {size} is larger than the {width}x{height} image, "
+            "so 'crop' leaves no pixels"
+        )
+    return rows, cols
+
+
+def tiled_filter(
+    image_array,
+    size,
+    method,
+    kernel,
+    window=None,
+    out_dtype=np.uint8,
+    tile_pixels=TILE_PIXELS,
+    workers=1,
+    progress=None,
+):
+    """
+    Function Documentation:
+    Apply a sliding-window kernel to an image strip by strip
+    Args:
+    image_array: The 2D or 3D (channels last) input array
+    size: The filter size; the halo is size // 2
+    method: The edge-handling method ('padding', 'reflect', 'edge', 'symmetric' or 'crop')
+    kernel: kernel(strip, window) returning the valid windows of the strip
+    window: The window size, by default size (2 * (size // 2) + 1 for 'crop')
+    out_dtype: The dtype of the output array; for uint8 the kernel results
+    are rounded with to_uint8
+    tile_pixels: Target samples per strip
+    workers: Threads filtering strips at the same time; the strips are the
+    same for any value, so the result is too
+    progress: Called as progress(rows, total) once before the first strip
+    (with 0 rows) and after every strip with the output rows it finished; it
+    may raise to stop the filter
+    Returns:
+    filtered_img: The filtered array; same height and width as the input,
+    or smaller by the window for 'crop' (a ValueError if nothing is left)
+    """
+    height, width = image_array.shape[:2]
+    out_rows, out_cols = output_size(height, width, size, method, window)
+    window, before, after = window_layout(size, method, window)
+    row_index = border_index(height, before, after, method)
+    col_index = border_index(width, before, after, method)
+    filtered_img = np.empty(
+        (out_rows, out_cols) + image_array.shape[2:], dtype=out_dtype
+    )
+
+    row_pixels = col_index.size * int(np.prod(image_array.shape[2:]))
+    bounds = strip_bounds(out_rows, window, row_pixels, tile_pixels)
+
+    def run(rows):
+        r0, r1 = rows
+        strip = gather(image_array, row_index[r0 : r1 + window - 1], col_index)
+        values = kernel(strip, window)
+        filtered_img[r0:r1] = to_uint8(values) if out_dtype == np.uint8 else values
+        if progress is not None:
+            progress(r1 - r0, out_rows)
+
+    if progress is not None:
+        progress(0, out_rows)
+    if workers > 1 and len(bounds) > 1:
+        # NumPy releases the GIL inside the kernels, so the strips run in parallel
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(run, bounds))
+    else:
+        for rows in bounds:
+            run(rows)
+    return filtered_img
@@ -0,0 +1,419 @@
+"""
+Module Documentation:
+This module runs filter and compression jobs on a pool of worker processes,
+so CPU-bound pixel loops do not hold the GIL of the Flask process.
+Pixel data goes to the workers through shared memory; only the job parameters
+are pickled. The number of jobs running or waiting is bounded: when the pool
+is full, submitting raises PoolSaturated so the route can answer 503.
+Filter jobs can report progress and be cancelled through a SharedProgress.
+
+Configuration (environment variables):
+DIP_WORKERS: Number of worker processes (default: CPU count, 0 runs jobs inline).
+DIP_QUEUE_SIZE: Jobs allowed to wait for a worker (default: 2 per worker).
+DIP_RETRY_AFTER: Seconds suggested to clients in the Retry-After header (default: 1).
+"""
+
+import io
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+
+import numpy as np
+from PIL import Image
+
+from Average_Filter import AverageFilter
+from Gauss_Filter import GaussFilter
+from JPEG_Compression import Compressor
+from Jobs import JobCancelled
+from Median_Filter import MedianFilter
+from MinMax_Filter import MinMaxFilter
+from Pipeline import FilterPipeline
+from Quality_Metrics import quality_metrics
+from Tiling import output_size
+
+FILTER_TYPES = ("Median Filter", "Average Filter", "Gauss Filter", "Min-Max Filter")
+
+
+class PoolSaturated(Exception):
+    """Raised when every worker is busy and the waiting queue is full."""
+
+
+def run_filter(
+    image_array,
+    filter_type,
+    size=3,
+    method="padding",
+    sigma=None,
+    mode="min",
+    workers=1,
+    progress=None,
+):
+    """
+    Function Documentation:
+    Apply one of the filters offered by the /filter route
+    Args:
+    image_array: The 2D or 3D input array
+    filter_type: One of FILTER_TYPES
+    size: The kernel size
+    method: The edge-handling method
+    sigma: Gaussian sigma (Gauss Filter only)
+    mode: 'min', 'max' or 'range' (Min-Max Filter only)
+    workers: Threads filtering strips of the image at the same time
+    progress: Called as progress(rows, total) while filtering, or None
+    Returns:
+    The filtered array as uint8
+    """
+    options = {"workers": workers, "progress": progress}
+    if filter_type == "Median Filter":
+        filtered = MedianFilter(**options).median_filter_custom(
+            image_array, size=size, method=method
+        )
+    elif filter_type == "Average Filter":
+        filtered = AverageFilter(**options).average_filter_custom(
+            image_array, size=size, method=method
+        )
+    elif filter_type == "Gauss Filter":
+        filtered = GaussFilter(**options).gauss_filter_custom(
+            image_array, size=size, method=method, sigma=sigma
+        )
+    elif filter_type == "Min-Max Filter":
+        filtered = MinMaxFilter(**options).min_max_filter_custom(
+            image_array, size=size, mode=mode, method=method
+        )
+    else:
+        raise ValueError(f"{filter_type} not implemented")
+    return filtered.astype(np.uint8, copy=False)
+
+
+def check_filter(shape, filter_type, size=3, method="padding", **params):
+    """
+    Function Documentation:
+    Check that run_filter leaves some pixels of an image, before running it;
+    raises ValueError when a 'crop' window is larger than the image
+    Args:
+    shape: The shape of the input array
+    filter_type: One of FILTER_TYPES
+    size: The kernel size
+    method: The edge-handling method
+    params: The other keyword arguments of run_filter (ignored)
+    """
+    # the Gaussian window is the kernel size, even when that is even
+    window = size if filter_type == "Gauss Filter" else None
+    output_size(shape[0], shape[1], size, method, window)
+
+
+def run_pipeline(image_array, specs, workers=1, progress=None):
+    """
+    Function Documentation:
+    Apply a chain of filters in one fused pass, as the /pipeline route does
+    Args:
+    image_array: The 2D or 3D input array
+    specs: The stages, see Pipeline.normalize_spec
+    workers: Threads filtering strips of the image at the same time
+    progress: Called as progress(rows, total) while filtering, or None
+    Returns:
+    The filtered array as uint8
+    """
+    return FilterPipeline(specs, workers=workers, progress=progress).run(image_array)
+
+
+def run_compress(
+    image_array,
+    quality=50,
+    subsampling="4:2:0",
+    workers=1,
+    target_size=None,
+    target_psnr=None,
+):
+    """
+    Function Documentation:
+    Compress an image array the way the /compress route does
+    Args:
+    image_array: The 2D or 3D input array
+    quality: The quality of the compressed image
+    subsampling: Chroma subsampling of colour images
+    workers: Threads transforming and coding blocks at the same time
+    target_size: Largest file size in bytes; the quality is searched instead
+    target_psnr: Lowest PSNR in dB; the quality is searched instead
+    Returns:
+    encoded: The JPEG file as bytes
+    timings: Seconds spent in each compression stage, as a dict
+    details: What to report with the result, as a dict: the quality used,
+    whether a target was met (target_met, with a target only) and the mse,
+    psnr and ssim of the decoded file against the input
+    """
+    compressor = Compressor(
+        image_array, quality=quality, subsampling=subsampling, workers=workers
+    )
+    compressor.compress(target_size=target_size, target_psnr=target_psnr)
+    details = {"quality": compressor.quality}
+    if compressor.target_met is not None:
+        details["target_met"] = compressor.target_met
+    with compressor.timings.stage("metrics"):
+        # measure the file as viewers decode it: the compressor's own
+        # reconstruction repeats subsampled chroma instead of interpolating it
+        decoded = Image.open(io.BytesIO(compressor.encoded))
+        details.update(quality_metrics(np.array(compressor.image), np.asarray(decoded)))
+    return compressor.encoded, compressor.timings.as_dict(), details
+
+
+def _attach(name):
+    """Open a shared memory block created by the parent process."""
+    # spawned workers share the parent's resource tracker, so the block is
+    # still unlinked exactly once, by the parent
+    return shared_memory.SharedMemory(name=name)
+
+
+class SharedProgress:
+    """
+    Class Documentation:
+    Progress of one filter job (rows done, rows in total) and a cancel flag,
+    kept in shared memory so a worker process can report to the parent and
+    notice a cancellation between strips.
+    Args:
+    name: The block of a SharedProgress to attach to (worker side), or None to
+    create a new one (parent side; only the creator unlinks it)
+
+    Attributes:
+    name: The name of the shared memory block.
+    """
+
+    def __init__(self, name=None):
+        self._owner = name is None
+        if self._owner:
+            self._shm = shared_memory.SharedMemory(create=True, size=3 * 8)
+        else:
+            self._shm = _attach(name)
+        self.name = self._shm.name
+        self._values = np.ndarray((3,), dtype=np.int64, buffer=self._shm.buf)
+        if self._owner:
+            self._values[:] = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, rows, total):
+        """Count rows as done; raises JobCancelled once the job is cancelled."""
+        with self._lock:
+            self._values[0] += rows
+            self._values[1] = total
+        if self._values[2]:
+            raise JobCancelled()
+
+    def rows(self):
+        """(rows done, rows in total)"""
+        return int(self._values[0]), int(self._values[1])
+
+    def cancel(self):
+        self._values[2] = 1
+
+    def close(self):
+        """Release the shared memory; rows() keeps returning the last values."""
+        if self._shm is None:
+            return
+        # the buffer cannot be closed while an array still points into it
+        self._values = self._values.copy()
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+        self._shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _filter_job(in_name, shape, dtype, out_name, func, args, params, progress_name):
+    """Worker side of WorkerPool.filter and .pipeline: returns the shape of the result."""
+    shm_in = _attach(in_name)
+    shm_out = _attach(out_name)
+    progress = None if progress_name is None else SharedProgress(progress_name)
+    try:
+        image_array = np.ndarray(shape, dtype=dtype, buffer=shm_in.buf)
+        filtered = func(image_array, *args, progress=progress, **params)
+        out = np.ndarray(filtered.shape, dtype=np.uint8, buffer=shm_out.buf)
+        out[...] = filtered
+        del image_array, out
+        return filtered.shape
+    finally:
+        shm_in.close()
+        shm_out.close()
+        if progress is not None:
+            progress.close()
+
+
+def _compress_job(in_name, shape, dtype, params):
+    """Worker side of WorkerPool.compress: returns what run_compress does."""
+    shm_in = _attach(in_name)
+    try:
+        image_array = np.ndarray(shape, dtype=dtype, buffer=shm_in.buf)
+        result = run_compress(image_array, **params)
+        del image_array
+        return result
+    finally:
+        shm_in.close()
+
+
+class WorkerPool:
+    """
+    Class Documentation:
+    A bounded pool of worker processes for filter and compression jobs.
+    Args:
+    workers: Number of worker processes; 0 runs jobs inline in the caller.
+    queue_size: Number of jobs allowed to wait when every worker is busy.
+    retry_after: Seconds clients should wait before retrying a rejected job.
+
+    Attributes:
+    workers: Number of worker processes.
+    queue_size: Number of jobs allowed to wait.
+    retry_after: Seconds suggested in Retry-After.
+    """
+
+    def __init__(self, workers=None, queue_size=None, retry_after=None):
+        if workers is None:
+            workers = int(os.environ.get("DIP_WORKERS", os.cpu_count() or 1))
+        if queue_size is None:
+            queue_size = int(os.environ.get("DIP_QUEUE_SIZE", 2 * max(workers, 1)))
+        if retry_after is None:
+            retry_after = int(os.environ.get("DIP_RETRY_AFTER", 1))
+        self.workers = workers
+        self.queue_size = queue_size
+        self.retry_after = retry_after
+        self._slots = threading.BoundedSemaphore(max(workers, 1) + queue_size)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn: forking a threaded server process is not safe
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._executor
+
+    @contextmanager
+    def _slot(self):
+        """Hold a slot for one job, or raise PoolSaturated if none is free."""
+        # taken before any shared memory is allocated, so rejected requests
+        # cost nothing and the blocks in use stay bounded by the slots
+        if not self._slots.acquire(blocking=False):
+            raise PoolSaturated()
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+    def _run(self, job, *args):
+        """Run a job on a worker process, blocking until it finishes."""
+        return self._get_executor().submit(job, *args).result()
+
+    def _share(self, image_array):
+        """Copy an array into a new shared memory block."""
+        shm = shared_memory.SharedMemory(create=True, size=max(image_array.nbytes, 1))
+        shared = np.ndarray(image_array.shape, dtype=image_array.dtype, buffer=shm.buf)
+        shared[...] = image_array
+        del shared
+        return shm
+
+    def filter(self, image_array, filter_type, **params):
+        """
+        Function Documentation:
+        Run run_filter on a worker
+        Args:
+        image_array: The 2D or 3D input array
+        filter_type: One of FILTER_TYPES
+        params: Keyword arguments of run_filter; progress may be a SharedProgress
+        Returns:
+        The filtered array as uint8
+        """
+        return self._filter(run_filter, image_array, (filter_type,), params)
+
+    def pipeline(self, image_array, specs, **params):
+        """
+        Function Documentation:
+        Run run_pipeline on a worker
+        Args:
+        image_array: The 2D or 3D input array
+        specs: The stages, see Pipeline.normalize_spec
+        params: Keyword arguments of run_pipeline; progress may be a SharedProgress
+        Returns:
+        The filtered array as uint8
+        """
+        return self._filter(run_pipeline, image_array, (specs,), params)
+
+    def _filter(self, func, image_array, args, params):
+        """Run func(image_array, *args, **params), which returns uint8, on a worker."""
+        image_array = np.ascontiguousarray(image_array)
+        with self._slot():
+            if self.workers == 0:
+                return func(image_array, *args, **params)
+            return self._filter_on_worker(func, image_array, args, params)
+
+    def _filter_on_worker(self, func, image_array, args, params):
+        """The process side of _filter: shares the pixels and runs _filter_job."""
+        # the worker attaches to the progress block by name
+        progress = params.pop("progress", None)
+
+        shm_in = self._share(image_array)
+        # results are uint8 and never larger than the input
+        shm_out = shared_memory.SharedMemory(create=True, size=max(image_array.size, 1))
+        try:
+            shape = self._run(
+                _filter_job,
+                shm_in.name,
+                image_array.shape,
+                image_array.dtype.str,
+                shm_out.name,
+                func,
+                args,
+                params,
+                None if progress is None else progress.name,
+            )
+            result = np.ndarray(shape, dtype=np.uint8, buffer=shm_out.buf).copy()
+            return result
+        finally:
+            shm_in.close()
+            shm_in.unlink()
+            shm_out.close()
+            shm_out.unlink()
+
+    def compress(self, image_array, **params):
+        """
+        Function Documentation:
+        Run run_compress on a worker
+        Args:
+        image_array: The 2D or 3D input array
+        params: Keyword arguments of run_compress
+        Returns:
+        encoded: The JPEG file as bytes
+        timings: Seconds spent in each compression stage, as a dict
+        details: What to report with the result, as a dict
+        """
+        image_array = np.ascontiguousarray(image_array)
+        with self._slot():
+            if self.workers == 0:
+                return run_compress(image_array, **params)
+            shm_in = self._share(image_array)
+            try:
+                return self._run(
+                    _compress_job,
+                    shm_in.name,
+                    image_array.shape,
+                    image_array.dtype.str,
+                    params,
+                )
+            finally:
+                shm_in.close()
+                shm_in.unlink()
+
+    def shutdown(self):
+        """Stop the worker processes."""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
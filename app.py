@@ -1,136 +1,701 @@
-from flask import Flask, request, jsonify
-from JPEG_Compression import Compressor
-from Median_Filter import MedianFilter
-from Average_Filter import AverageFilter
-from Gauss_Filter import GaussFilter
-from MinMax_Filter import MinMaxFilter
-from PIL import Image
+from flask import Flask, Response, g, request, jsonify
+from Image_IO import downscale, load_pixels, encode_image
+from Worker_Pool import (
+    FILTER_TYPES,
+    PoolSaturated,
+    SharedProgress,
+    WorkerPool,
+    check_filter,
+    run_compress,
+    run_filter,
+)
+from Result_Cache import ResultCache
+from Image_Store import ImageStore
+from JPEG_Compression import SUBSAMPLING
+from Batch import BatchProcessor
+from Pipeline import FilterPipeline, normalize_spec
+from Jobs import JobQueue, JobQueueFull
+from Precompute import default_sigma
+from Metrics import Histogram, Timings, render_metrics, size_bucket
+from Quality_Metrics import quality_metrics
 import numpy as np
-import io
-import base64
-import tempfile
 import os
+import base64
+import functools
+import json
+import time
+import uuid
 
 app = Flask(__name__)
 
+# bytes per chunk when streaming image bodies
+STREAM_CHUNK = 64 * 1024
+
+# filter and compression jobs run here, off the request threads
+pool = WorkerPool()
+# encoded results of repeated requests
+cache = ResultCache()
+# decoded uploads, so clients can send an image once and reuse its image_id
+images = ImageStore()
+# background jobs: async=1 requests and the full-resolution result behind a preview
+jobs = JobQueue()
+# longest side of preview images, in pixels
+PREVIEW_SIDE = int(os.environ.get("DIP_PREVIEW_SIDE", 512))
+# /batch only reads and writes below this directory; it is off until one is set,
+# so a server started anywhere never exposes its working directory
+BATCH_ROOT = os.environ.get("DIP_BATCH_ROOT") or None
+if BATCH_ROOT is not None:
+    BATCH_ROOT = os.path.abspath(BATCH_ROOT)
+# /batch runs on workers of its own, so a batch never takes the slots of
+# interactive requests (and never fails for lack of them)
+batch_pool = WorkerPool(workers=int(os.environ.get("DIP_BATCH_WORKERS", 1)))
+
+# routes whose latency goes to the request histogram
+TIMED_ROUTES = ("compress", "filter_image", "pipeline")
+REQUEST_LABELS = (
+    "route",
+    "filter_type",
+    "kernel_size",
+    "image_size",
+    "cache",
+    "preview",
+)
+REQUEST_SECONDS = Histogram(
+    "dip_request_seconds",
+    "Latency of /compress, /filter and /pipeline requests in seconds",
+    REQUEST_LABELS,
+)
+STAGE_SECONDS = Histogram(
+    "dip_stage_seconds",
+    "Time spent in each stage of /compress, /filter and /pipeline requests in seconds",
+    ("route", "stage"),
+)
+
+
+@app.before_request
+def start_timings():
+    g.start = time.perf_counter()
+    g.timings = Timings()
+    g.labels = {}
+
+
+@app.after_request
+def record_timings(response):
+    """Observe the latency histograms and report the stages in Server-Timing."""
+    if "timings" not in g:
+        return response
+    total = time.perf_counter() - g.start
+    stages = g.timings.as_dict()
+    if request.endpoint in TIMED_ROUTES:
+        route = request.path
+        REQUEST_SECONDS.observe(total, route=route, **g.labels)
+        for stage, seconds in stages.items():
+            STAGE_SECONDS.observe(seconds, route=route, stage=stage)
+    # streamed bodies are still being sent, so total covers the work up to the first byte
+    response.headers["Server-Timing"] = ", ".join(
+        filter(None, [g.timings.server_timing(), f"total;dur={total * 1000:.1f}"])
+    )
+    response.headers["Timing-Allow-Origin"] = "*"
+    return response
+
 
 @app.after_request
 def add_cors(response):
     response.headers["Access-Control-Allow-Origin"] = "*"
-    response.headers["Access-Control-Allow-Methods"] = "POST, OPTIONS"
+    response.headers["Access-Control-Allow-Methods"] = "GET, POST, DELETE, OPTIONS"
     response.headers["Access-Control-Allow-Headers"] = "Content-Type"
+    response.headers["Access-Control-Expose-Headers"] = (
+        "X-Original-Size, X-Compressed-Size, X-Compression-Percentage, "
+        "X-Quality, X-Target-Met, X-Mse, X-Psnr, X-Ssim, X-Preview-Scale, X-Job-Id, "
+        "Server-Timing"
+    )
     return response
 
 
-@app.route("/compress", methods=["POST"])
-def compress():
+def stream_bytes(data):
+    view = memoryview(data)
+    for start in range(0, len(view), STREAM_CHUNK):
+        yield view[start : start + STREAM_CHUNK]
+
+
+def image_response(data, mimetype, metrics, data_key):
+    """
+    Build the response for an encoded image, in the format the client asked for
+    with the 'response' form field (or query parameter):
+    - json (default): metrics plus the image as a base64 data URL under data_key
+    - binary: the raw image bytes, streamed, with metrics in X-* headers
+    - multipart: a streamed multipart/mixed body, JSON metrics then the image
+    """
+    mode = request.values.get("response", "json").lower()
+    if mode == "json":
+        img_data = base64.b64encode(data).decode()
+        return jsonify({**metrics, data_key: f"data:{mimetype};base64,{img_data}"})
+
+    if mode == "binary":
+        headers = {
+            "X-" + "-".join(part.capitalize() for part in key.split("_")): str(value)
+            for key, value in metrics.items()
+        }
+        headers["Content-Length"] = str(len(data))
+        return Response(stream_bytes(data), mimetype=mimetype, headers=headers)
+
+    if mode == "multipart":
+        boundary = uuid.uuid4().hex
+
+        def parts():
+            yield (
+                f"--{boundary}\r\nContent-Type: application/json\r\n\r\n"
+                f"{json.dumps(metrics)}\r\n--{boundary}\r\n"
+                f"Content-Type: {mimetype}\r\nContent-Length: {len(data)}\r\n\r\n"
+            ).encode()
+            yield from stream_bytes(data)
+            yield f"\r\n--{boundary}--\r\n".encode()
+
+        return Response(parts(), mimetype=f"multipart/mixed; boundary={boundary}")
+
+    return jsonify({"error": "response must be 'json', 'binary' or 'multipart'"}), 400
+
+
+def job_accepted(work):
+    """Run work(job) as a background job and answer 202 with where to poll it."""
+    job_id = jobs.submit(work)
+    return (
+        jsonify({"job_id": job_id, "status": "queued"}),
+        202,
+        {"Location": f"/jobs/{job_id}"},
+    )
+
+
+def busy_response():
+    return (
+        jsonify({"error": "Server busy, try again later"}),
+        503,
+        {"Retry-After": str(pool.retry_after)},
+    )
+
+
+def form_flag(name):
+    """Whether a form field such as preview=1 is switched on."""
+    return request.form.get(name, "").lower() in ("1", "true", "yes", "on")
+
+
+def request_image():
+    """
+    The image of a request: a stored 'image_id' form field, or an uploaded 'file'.
+    Returns (digest, file_size, pixels, preview) where pixels() decodes the image
+    only when called, so cached results never pay for decoding, and preview()
+    returns the (pixels, scale) of a copy at most PREVIEW_SIDE pixels wide and
+    high. Raises LookupError when the request names no image or an unknown one.
+    """
+    image_id = request.form.get("image_id")
+    if image_id:
+        stored = images.get(image_id)
+        if stored is None:
+            raise LookupError("Unknown or expired image_id, upload the image again")
+        return (
+            stored.digest,
+            stored.file_size,
+            lambda: decoded(stored.pixels),
+            lambda: stored.preview(PREVIEW_SIDE),
+        )
+
     if "file" not in request.files:
-        return jsonify({"error": "No file"}), 400
+        raise LookupError("No file")
+    with g.timings.stage("read"):
+        data = request.files["file"].read()
+        digest = ResultCache.digest(data)
+
+    @functools.cache
+    def pixels():
+        with g.timings.stage("decode"):
+            return decoded(load_pixels(data))
+
+    def preview():
+        image_array = pixels()
+        with g.timings.stage("downscale"):
+            return downscale(image_array, PREVIEW_SIDE)
+
+    return digest, len(data), pixels, preview
+
+
+def decoded(pixels):
+    """Label the request with the size of its decoded image."""
+    g.labels["image_size"] = size_bucket(pixels.shape[1], pixels.shape[0])
+    return pixels
+
+
+def cached(key):
+    """
+    Look up a result and label the request with the outcome; returns the
+    encoded result and the details stored with it, or (None, None).
+    """
+    with g.timings.stage("cache"):
+        entry = cache.get_with_details(key)
+    g.labels["cache"] = "miss" if entry is None else "hit"
+    return (None, None) if entry is None else entry
+
+
+def form_workers():
+    """The 'workers' form field: threads per job, at most one per core."""
+    return min(max(int(request.form.get("workers", 1)), 1), os.cpu_count() or 1)
+
+
+def preview_params(filter_type, params, scale):
+    """
+    Filter parameters for an image downscaled by scale: the kernel size (kept
+    odd when it was odd) and the Gaussian sigma shrink with the image.
+    """
+    full_size = params["size"]
+    size = max(1, round(full_size * scale))
+    params = {**params, "size": size | 1 if full_size % 2 else size}
+    if filter_type == "Gauss Filter":
+        sigma = params["sigma"]
+        if sigma is None:
+            sigma = default_sigma(full_size)
+        params["sigma"] = sigma * scale
+    return params
+
 
-    file = request.files["file"]
-    quality = int(request.form.get("quality", 50))
+def when_free(job, func):
+    """
+    Call func, waiting while the worker pool is saturated; for background jobs.
+    Raises JobCancelled if the job is cancelled while it waits.
+    """
+    while True:
+        job.check()
+        try:
+            return func()
+        except PoolSaturated:
+            time.sleep(0.05)
 
-    # Create compressed directory if it doesn't exist
-    os.makedirs("compressed", exist_ok=True)
 
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp:
-        file.save(tmp.name)
-        tmp_path = tmp.name
+def compression_metrics(original_size, compressed_size):
+    ratio = round(((original_size - compressed_size) / original_size) * 100, 2)
+    return {
+        "original_size": original_size,
+        "compressed_size": compressed_size,
+        "compression_percentage": ratio,
+    }
 
+
+def filter_details(image_array, filtered):
+    """
+    The quality metrics reported with a filter result; a failure to measure
+    leaves them out rather than failing the request.
+    """
     try:
-        original_size = os.path.getsize(tmp_path)
-        # Convert Windows path to forward slashes for Compressor
-        tmp_path_normalized = tmp_path.replace("\\", "/")
-        compressor = Compressor(tmp_path_normalized, quality=quality)
-        compressed_img = compressor.compress()
-
-        # Compressor saves to compressed/ directory, read it back
-        compressed_filename = (
-            os.path.basename(tmp_path).split(".")[0] + "_compressed.jpg"
+        return quality_metrics(image_array, filtered)
+    except Exception:
+        app.logger.exception("Quality metrics failed")
+        return {}
+
+
+def compress_job(job, key, image_array, original_size, workers, params):
+    """The full-resolution /compress result, computed in the background."""
+    encoded, _, details = when_free(
+        job, lambda: pool.compress(image_array, workers=workers, **params)
+    )
+    cache.put(key, encoded, details)
+    metrics = {**compression_metrics(original_size, len(encoded)), **details}
+    return encoded, "image/jpeg", metrics, "compressed_image"
+
+
+def filter_job(job, key, image_array, filter_type, workers, params):
+    """The full-resolution /filter result, computed in the background."""
+    with SharedProgress() as progress:
+        # the worker counts finished rows here and stops once it is cancelled
+        job.progress = progress
+        filtered = when_free(
+            job,
+            lambda: pool.filter(
+                image_array, filter_type, workers=workers, progress=progress, **params
+            ),
+        )
+    details = filter_details(image_array, filtered)
+    encoded = encode_image(filtered, "PNG")
+    cache.put(key, encoded, details)
+    return encoded, "image/png", details, "filtered_image"
+
+
+def pipeline_job(job, key, image_array, stages, workers):
+    """The /pipeline result, computed in the background."""
+    with SharedProgress() as progress:
+        job.progress = progress
+        filtered = when_free(
+            job,
+            lambda: pool.pipeline(
+                image_array, stages, workers=workers, progress=progress
+            ),
         )
-        compressed_path = os.path.join("compressed", compressed_filename)
-        compressed_size = os.path.getsize(compressed_path)
+    encoded = encode_image(filtered, "PNG")
+    cache.put(key, encoded)
+    return encoded, "image/png", {}, "filtered_image"
+
 
-        with open(compressed_path, "rb") as f:
-            img_data = base64.b64encode(f.read()).decode()
+def missing_image_response(error):
+    status = 404 if request.form.get("image_id") else 400
+    return jsonify({"error": str(error)}), status
 
-        ratio = round(((original_size - compressed_size) / original_size) * 100, 2)
 
-        os.unlink(tmp_path)
-        os.unlink(compressed_path)
+@app.route("/upload", methods=["POST"])
+def upload():
+    if "file" not in request.files:
+        return jsonify({"error": "No file"}), 400
 
+    try:
+        data = request.files["file"].read()
+        pixels = load_pixels(data)
+        image_id = images.add(pixels, ResultCache.digest(data), len(data))
         return jsonify(
             {
-                "original_size": original_size,
-                "compressed_size": compressed_size,
-                "compression_percentage": ratio,
-                "compressed_image": f"data:image/png;base64,{img_data}",
+                "image_id": image_id,
+                "width": pixels.shape[1],
+                "height": pixels.shape[0],
+                "original_size": len(data),
+                "ttl": images.ttl,
             }
         )
+    except MemoryError as e:
+        return jsonify({"error": str(e)}), 413
     except Exception as e:
-        os.unlink(tmp_path)
         return jsonify({"error": str(e)}), 500
 
 
-@app.route("/filter", methods=["POST"])
-def filter_image():
-    if "file" not in request.files:
-        return jsonify({"error": "No file"}), 400
+@app.route("/upload/<image_id>", methods=["DELETE"])
+def delete_upload(image_id):
+    images.discard(image_id)
+    return "", 204
 
-    file = request.files["file"]
-    filter_type = request.form.get("filter_type", "Median Filter")
-    kernel_size = int(request.form.get("kernel_size", 3))
-    method = request.form.get("method", "padding").lower()
 
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp:
-        file.save(tmp.name)
-        tmp_path = tmp.name
+@app.route("/compress", methods=["POST"])
+def compress():
+    try:
+        workers = form_workers()
+        params = {
+            "quality": int(request.form.get("quality", 50)),
+            "subsampling": request.form.get("subsampling", "4:2:0"),
+        }
+        if params["subsampling"] not in SUBSAMPLING:
+            raise ValueError(f"subsampling must be one of {tuple(SUBSAMPLING)}")
+        # a target file size (bytes) or PSNR (dB) replaces the quality, which
+        # is then searched for
+        for name, kind in (("target_size", int), ("target_psnr", float)):
+            if request.form.get(name):
+                params[name] = kind(request.form[name])
+                params.pop("quality", None)
+        if "target_size" in params and "target_psnr" in params:
+            raise ValueError("Give target_size or target_psnr, not both")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
     try:
-        if filter_type == "Median Filter":
-            mf = MedianFilter(tmp_path)
-            img_array = np.array(Image.open(tmp_path))
-            filtered = mf.median_filter_custom(
-                img_array, size=kernel_size, method=method
-            )
-        elif filter_type == "Average Filter":
-            af = AverageFilter(tmp_path)
-            img_array = np.array(Image.open(tmp_path))
-            filtered = af.average_filter_custom(
-                img_array, size=kernel_size, method=method
+        digest, original_size, pixels, preview = request_image()
+    except LookupError as e:
+        return missing_image_response(e)
+
+    try:
+        key = ResultCache.key(digest, route="compress", **params)
+        encoded, details = cached(key)
+        if form_flag("async"):
+            if encoded is not None:
+                metrics = {
+                    **compression_metrics(original_size, len(encoded)),
+                    **details,
+                }
+                result = (encoded, "image/jpeg", metrics, "compressed_image")
+                return job_accepted(lambda job: result)
+            image_array = pixels()
+            return job_accepted(
+                lambda job: compress_job(
+                    job, key, image_array, original_size, workers, params
+                )
             )
-        elif filter_type == "Gauss Filter":
-            gf = GaussFilter(tmp_path)
-            img_array = np.array(Image.open(tmp_path))
-            # optional sigma can be passed via form 'sigma'
-            sigma_val = request.form.get("sigma")
-            sigma = float(sigma_val) if sigma_val is not None else None
-            filtered = gf.gauss_filter_custom(
-                img_array, size=kernel_size, method=method, sigma=sigma
+
+        if encoded is None and form_flag("preview"):
+            small, scale = preview()
+            if scale < 1:
+                # answer with a small copy now; the full result follows as a job
+                image_array = pixels()
+                job_id = jobs.submit(
+                    lambda job: compress_job(
+                        job, key, image_array, original_size, workers, params
+                    )
+                )
+                g.labels["preview"] = "true"
+                small_params = dict(params)
+                if "target_size" in params:
+                    # the preview holds scale**2 of the pixels
+                    small_params["target_size"] = int(params["target_size"] * scale**2)
+                with g.timings.stage("compress"):
+                    encoded, stages, _ = run_compress(small, **small_params)
+                g.timings.update(stages, prefix="compress.")
+                with g.timings.stage("response"):
+                    return image_response(
+                        encoded,
+                        "image/jpeg",
+                        {"preview_scale": round(scale, 4), "job_id": job_id},
+                        "compressed_image",
+                    )
+
+        if encoded is None:
+            image_array = pixels()
+            with g.timings.stage("compress"):
+                encoded, stages, details = pool.compress(
+                    image_array, workers=workers, **params
+                )
+            g.timings.update(stages, prefix="compress.")
+            cache.put(key, encoded, details)
+
+        with g.timings.stage("response"):
+            return image_response(
+                encoded,
+                "image/jpeg",
+                {**compression_metrics(original_size, len(encoded)), **details},
+                "compressed_image",
             )
-        elif filter_type == "Min-Max Filter":
-            mm = MinMaxFilter(tmp_path)
-            img_array = np.array(Image.open(tmp_path))
-            mode = request.form.get("mode", "min").lower()
-            filtered = mm.min_max_filter_custom(
-                img_array, size=kernel_size, mode=mode, method=method
+    except (PoolSaturated, JobQueueFull):
+        return busy_response()
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/filter", methods=["POST"])
+def filter_image():
+    filter_type = request.form.get("filter_type", "Median Filter")
+    if filter_type not in FILTER_TYPES:
+        return jsonify({"error": f"{filter_type} not implemented"}), 400
+
+    try:
+        # the same checks as a pipeline stage: size, method, sigma and mode
+        spec = {"filter_type": filter_type}
+        for name in ("kernel_size", "method", "sigma", "mode"):
+            if name in request.form:
+                spec[name] = request.form[name]
+        params = normalize_spec(spec)
+        del params["filter_type"]
+        workers = form_workers()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    g.labels.update(filter_type=filter_type, kernel_size=params["size"])
+
+    try:
+        digest, _, pixels, preview = request_image()
+    except LookupError as e:
+        return missing_image_response(e)
+
+    try:
+        # workers does not change the result, so it is not part of the key
+        key = ResultCache.key(digest, route="filter", filter_type=filter_type, **params)
+        encoded, details = cached(key)
+        if encoded is None:
+            image_array = pixels()
+            try:
+                # a 'crop' window larger than the image is a bad request, and
+                # must not become a failed background job
+                check_filter(image_array.shape, filter_type, **params)
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+        if form_flag("async"):
+            if encoded is not None:
+                result = (encoded, "image/png", details, "filtered_image")
+                return job_accepted(lambda job: result)
+            return job_accepted(
+                lambda job: filter_job(
+                    job, key, image_array, filter_type, workers, params
+                )
             )
-        else:
-            os.unlink(tmp_path)
-            return jsonify({"error": f"{filter_type} not implemented"}), 400
 
-        filtered_img = Image.fromarray(filtered.astype(np.uint8))
-        buf = io.BytesIO()
-        filtered_img.save(buf, format="PNG")
-        img_data = base64.b64encode(buf.getvalue()).decode()
+        if encoded is None and form_flag("preview"):
+            small, scale = preview()
+            if scale < 1:
+                # answer with a small copy now; the full result follows as a job
+                job_id = jobs.submit(
+                    lambda job: filter_job(
+                        job, key, image_array, filter_type, workers, params
+                    )
+                )
+                g.labels["preview"] = "true"
+                with g.timings.stage("filter"):
+                    filtered = run_filter(
+                        small, filter_type, **preview_params(filter_type, params, scale)
+                    )
+                with g.timings.stage("encode"):
+                    # previews are thrown away soon, so favour speed over size
+                    encoded = encode_image(filtered, "PNG", compress_level=1)
+                with g.timings.stage("response"):
+                    return image_response(
+                        encoded,
+                        "image/png",
+                        {"preview_scale": round(scale, 4), "job_id": job_id},
+                        "filtered_image",
+                    )
+
+        if encoded is None:
+            with g.timings.stage("filter"):
+                # the pixels go to the worker through shared memory
+                filtered = pool.filter(
+                    image_array, filter_type, workers=workers, **params
+                )
+            with g.timings.stage("metrics"):
+                details = filter_details(image_array, filtered)
+            with g.timings.stage("encode"):
+                encoded = encode_image(filtered, "PNG")
+            cache.put(key, encoded, details)
+
+        with g.timings.stage("response"):
+            return image_response(encoded, "image/png", details, "filtered_image")
+    except (PoolSaturated, JobQueueFull):
+        return busy_response()
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/pipeline", methods=["POST"])
+def pipeline():
+    """
+    Run several filters in one pass. The 'stages' form field is a JSON list of
+    {filter_type, kernel_size, method, sigma, mode} objects, applied in order.
+    """
+    try:
+        stages = json.loads(request.form.get("stages", "[]"))
+        if not isinstance(stages, list) or not stages:
+            raise ValueError("stages must be a non-empty JSON list")
+        stages = [normalize_spec(stage) for stage in stages]
+    except (ValueError, TypeError, AttributeError) as e:
+        return jsonify({"error": f"Invalid stages: {e}"}), 400
+
+    try:
+        workers = form_workers()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        digest, _, pixels, _ = request_image()
+    except LookupError as e:
+        return missing_image_response(e)
+
+    try:
+        key = ResultCache.key(digest, route="pipeline", stages=stages)
+        encoded, _ = cached(key)
+        if encoded is None:
+            image_array = pixels()
+            try:
+                # planning checks that the 'crop' stages leave some pixels
+                FilterPipeline(stages).plan(image_array.shape)
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+        if form_flag("async"):
+            if encoded is not None:
+                result = (encoded, "image/png", {}, "filtered_image")
+                return job_accepted(lambda job: result)
+            return job_accepted(
+                lambda job: pipeline_job(job, key, image_array, stages, workers)
+            )
 
-        os.unlink(tmp_path)
+        if encoded is None:
+            with g.timings.stage("filter"):
+                filtered = pool.pipeline(image_array, stages, workers=workers)
+            with g.timings.stage("encode"):
+                encoded = encode_image(filtered, "PNG")
+            cache.put(key, encoded)
 
-        return jsonify({"filtered_image": f"data:image/png;base64,{img_data}"})
+        with g.timings.stage("response"):
+            return image_response(encoded, "image/png", {}, "filtered_image")
+    except (PoolSaturated, JobQueueFull):
+        return busy_response()
     except Exception as e:
-        os.unlink(tmp_path)
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_result(job_id):
+    """
+    The result of a background job, in the format asked for by the 'response'
+    query parameter, once it is done; 202 with its status and progress (rows
+    done of rows_total, for filters) while it is queued or running.
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown or expired job_id"}), 404
+    if job.status == "done":
+        return image_response(*job.result)
+    if job.status == "error":
+        return jsonify(job.as_dict()), 500
+    if job.status == "cancelled":
+        return jsonify(job.as_dict()), 410
+    return jsonify(job.as_dict()), 202
+
+
+@app.route("/jobs/<job_id>", methods=["DELETE"])
+def cancel_job(job_id):
+    """
+    Cancel a background job. A queued job is dropped at once; a running filter
+    stops after its current strip, so its status may read "running" briefly.
+    """
+    job = jobs.cancel(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown or expired job_id"}), 404
+    return jsonify(job.as_dict())
+
+
+def batch_path(path):
+    """Resolve a /batch path below BATCH_ROOT, or raise ValueError."""
+    resolved = os.path.abspath(os.path.join(BATCH_ROOT, path))
+    if os.path.commonpath([resolved, BATCH_ROOT]) != BATCH_ROOT:
+        raise ValueError(f"{path} is outside the batch root")
+    return resolved
+
+
+@app.route("/batch", methods=["POST"])
+def batch():
+    """
+    Run one parameter set over a server-side directory or glob. JSON body:
+    source, output_dir, operation ('filter' or 'compress'), params and resume
+    (default true). Streams one JSON line per image as it finishes. Answers
+    404 unless DIP_BATCH_ROOT is set.
+    """
+    if BATCH_ROOT is None:
+        return (
+            jsonify({"error": "Batch processing is disabled: set DIP_BATCH_ROOT"}),
+            404,
+        )
+    body = request.get_json(silent=True) or {}
+    try:
+        source = batch_path(body["source"])
+        processor = BatchProcessor(
+            body.get("operation", "filter"),
+            body.get("params", {}),
+            batch_path(body["output_dir"]),
+            workers=max(batch_pool.workers, 1),
+            pool=batch_pool,
+        )
+    except KeyError as e:
+        return jsonify({"error": f"Missing {e.args[0]}"}), 400
+    except (ValueError, TypeError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    def lines():
+        try:
+            for result in processor.run(source, resume=body.get("resume", True)):
+                yield json.dumps(result) + "\n"
+        except ValueError as e:
+            yield json.dumps({"status": "error", "error": str(e)}) + "\n"
+
+    return Response(lines(), mimetype="application/x-ndjson")
+
+
+@app.route("/cache/stats", methods=["GET"])
+def cache_stats():
+    return jsonify(cache.stats())
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Latency histograms in the Prometheus text format."""
+    return Response(
+        render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
 if __name__ == "__main__":
     app.run(port=5000, debug=True)
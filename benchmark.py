@@ -0,0 +1,311 @@
+"""
+Module Documentation:
+Benchmark harness for the filters and the JPEG compressor.
+Every case runs on a seeded synthetic image (smooth gradients plus noise), so
+runs on the same machine are comparable. For each case the best of --repeat
+runs gives the throughput in megapixels per second; one extra run under
+tracemalloc gives the peak memory. Compress cases also record the fastest
+time of each Compressor stage, so --compare names the stage that slowed down.
+
+A 12MP photo-sized compress (compress/rgb/photo/q50) runs in every matrix:
+it is the request users wait on, and it regressed unnoticed before as stages
+were added one by one. --budget fails the run when it exceeds a latency.
+
+Usage:
+python benchmark.py --quick                       # small matrix, a minute or two
+python benchmark.py --save baseline.json          # full matrix, store a baseline
+python benchmark.py --compare baseline.json       # flag cases slower than the baseline
+python benchmark.py --quick --budget 3            # fail if the 12MP compress takes over 3 s
+python benchmark.py --filters median --sizes 1024 --kernels 3 15 31
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from functools import partial
+
+import numpy as np
+
+from Average_Filter import AverageFilter
+from Gauss_Filter import GaussFilter
+from JPEG_Compression import Compressor
+from Median_Filter import MedianFilter
+from MinMax_Filter import MinMaxFilter
+
+FILTERS = {
+    "average": lambda image, size, method: AverageFilter().average_filter_custom(
+        image, size=size, method=method
+    ),
+    "gauss": lambda image, size, method: GaussFilter().gauss_filter_custom(
+        image, size=size, method=method
+    ),
+    "median": lambda image, size, method: MedianFilter().median_filter_custom(
+        image, size=size, method=method
+    ),
+    "minmax": lambda image, size, method: MinMaxFilter().min_max_filter_custom(
+        image, size=size, mode="range", method=method
+    ),
+}
+
+METHODS = ("padding", "crop", "reflect", "edge", "symmetric")
+SIZES = (256, 512, 1024, 2048, 4096, 8192)
+KERNELS = (3, 5, 9, 15, 31)
+QUALITIES = (10, 50, 90)
+COLORS = ("gray", "rgb")
+PHOTO = (3000, 4000)  # height and width of a 12MP camera photo
+PHOTO_QUALITY = 50
+PHOTO_CASE = f"compress/rgb/photo/q{PHOTO_QUALITY}"
+# stage slowdowns smaller than this are timer noise, whatever the ratio
+STAGE_NOISE = 0.05
+
+QUICK = {
+    "sizes": (256, 1024),
+    "kernels": (3, 15),
+    "methods": ("padding", "reflect"),
+    "qualities": (50,),
+}
+
+
+def compress(image, quality, stages):
+    """Compress image, keeping the fastest time of each stage in stages."""
+    compressor = Compressor(image, quality=quality)
+    compressor.compress()
+    for stage, seconds in compressor.timings.stages.items():
+        stages[stage] = min(stages.get(stage, float("inf")), seconds)
+
+
+def synthetic_image(size, color, seed=0, width=None):
+    """
+    Function Documentation:
+    A reproducible test image: gradients and a ripple with Gaussian noise
+    Args:
+    size: Height in pixels, and the width unless width is given
+    color: "gray" or "rgb"
+    seed: The noise seed
+    width: Width in pixels
+    Returns:
+    A uint8 array of shape (size, width) or (size, width, 3)
+    """
+    rng = np.random.default_rng(seed)
+    width = width or size
+    y, x = np.mgrid[0:size, 0:width] / max(size, width)
+    base = 128 + 80 * np.sin(6 * x + 3 * y) * np.cos(4 * y)
+    planes = 1 if color == "gray" else 3
+    image = np.stack([base + 30 * (c - 1) * x for c in range(planes)], axis=-1)
+    image = image + rng.normal(0, 12, image.shape)
+    image = np.clip(image, 0, 255).astype(np.uint8)
+    return image[..., 0] if color == "gray" else image
+
+
+def measure(func, repeat, memory=True):
+    """
+    Function Documentation:
+    Time a call and measure its peak traced memory
+    Args:
+    func: The function to call without arguments
+    repeat: Number of timed calls; the fastest counts
+    memory: Also run once under tracemalloc
+    Returns:
+    seconds: The best time
+    peak: Peak allocated bytes during one call (None without memory)
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+
+    peak = None
+    if memory:
+        tracemalloc.start()
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return best, peak
+
+
+def cases(args):
+    """
+    Function Documentation:
+    Every benchmark case selected by args
+    Args:
+    args: The parsed command line
+    Returns:
+    Yields (name, megapixels, func, stages); stages is the dict a compress case
+    fills with its stage timings, None for filter cases
+    """
+    for size in args.sizes:
+        for color in args.colors:
+            image = synthetic_image(size, color)
+            megapixels = size * size / 1e6
+            for name in args.filters:
+                for kernel in args.kernels:
+                    for method in args.methods:
+                        yield (
+                            f"{name}/{color}/{size}/k{kernel}/{method}",
+                            megapixels,
+                            partial(FILTERS[name], image, kernel, method),
+                            None,
+                        )
+            if args.compress:
+                for quality in args.qualities:
+                    stages = {}
+                    yield (
+                        f"compress/{color}/{size}/q{quality}",
+                        megapixels,
+                        partial(compress, image, quality, stages),
+                        stages,
+                    )
+    if args.compress:
+        stages = {}
+        yield (
+            PHOTO_CASE,
+            PHOTO[0] * PHOTO[1] / 1e6,
+            partial(
+                compress,
+                synthetic_image(PHOTO[0], "rgb", width=PHOTO[1]),
+                PHOTO_QUALITY,
+                stages,
+            ),
+            stages,
+        )
+
+
+def compare(results, baseline, threshold):
+    """
+    Function Documentation:
+    Cases whose throughput dropped by more than threshold against a baseline
+    Args:
+    results: The results of this run
+    baseline: A saved benchmark report
+    threshold: Allowed relative slowdown, e.g. 0.1 for 10%
+    Returns:
+    A list of (name, baseline MP/s, current MP/s), then for compress cases a
+    list of (name, stage, baseline seconds, current seconds)
+    """
+    before = {r["name"]: r for r in baseline["results"]}
+    regressions, stages = [], []
+    for result in results:
+        old = before.get(result["name"])
+        if old is None:
+            continue
+        if result["mp_per_s"] < old["mp_per_s"] * (1 - threshold):
+            regressions.append((result["name"], old["mp_per_s"], result["mp_per_s"]))
+        old_stages = old.get("stages") or {}
+        for stage, seconds in (result.get("stages") or {}).items():
+            # a stage missing from the baseline is new work, which counts too
+            was = old_stages.get(stage, 0.0)
+            if seconds > was * (1 + threshold) and seconds - was > STAGE_NOISE:
+                stages.append((result["name"], stage, was, seconds))
+    return regressions, stages
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--quick", action="store_true", help="small case matrix")
+    parser.add_argument(
+        "--filters", nargs="+", choices=tuple(FILTERS), default=tuple(FILTERS)
+    )
+    parser.add_argument("--no-compress", dest="compress", action="store_false")
+    parser.add_argument("--sizes", nargs="+", type=int, default=None)
+    parser.add_argument("--colors", nargs="+", choices=COLORS, default=COLORS)
+    parser.add_argument("--kernels", nargs="+", type=int, default=None)
+    parser.add_argument("--methods", nargs="+", choices=METHODS, default=None)
+    parser.add_argument("--qualities", nargs="+", type=int, default=None)
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per case")
+    parser.add_argument("--no-memory", dest="memory", action="store_false")
+    parser.add_argument("--save", help="write the report to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON report to check against")
+    parser.add_argument(
+        "--threshold", type=float, default=0.1, help="allowed slowdown (default 0.1)"
+    )
+    parser.add_argument(
+        "--budget",
+        type=float,
+        help=f"seconds allowed for the 12MP compress ({PHOTO_CASE})",
+    )
+    args = parser.parse_args(argv)
+
+    defaults = (
+        QUICK
+        if args.quick
+        else {
+            "sizes": SIZES,
+            "kernels": KERNELS,
+            "methods": METHODS,
+            "qualities": QUALITIES,
+        }
+    )
+    for key, value in defaults.items():
+        if getattr(args, key) is None:
+            setattr(args, key, value)
+
+    results = []
+    for name, megapixels, func, stages in cases(args):
+        seconds, peak = measure(func, args.repeat, args.memory)
+        result = {
+            "name": name,
+            "seconds": round(seconds, 6),
+            "mp_per_s": round(megapixels / seconds, 3),
+            "peak_mb": None if peak is None else round(peak / 2**20, 2),
+        }
+        if stages is not None:
+            result["stages"] = {stage: round(t, 6) for stage, t in stages.items()}
+        results.append(result)
+        memory = "" if peak is None else f"  {result['peak_mb']:9.2f} MB"
+        print(f"{name:40s} {result['mp_per_s']:10.3f} MP/s{memory}", flush=True)
+        if stages:
+            print(
+                " " * 41 + "  ".join(f"{s} {t:.3f}s" for s, t in stages.items()),
+                flush=True,
+            )
+
+    report = {
+        "meta": {
+            "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+
+    status = 0
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions, stages = compare(results, baseline, args.threshold)
+        for name, old, new in regressions:
+            print(
+                f"REGRESSION {name}: {old:.3f} -> {new:.3f} MP/s ({new / old - 1:+.0%})"
+            )
+        for name, stage, old, new in stages:
+            print(f"REGRESSION {name} [{stage}]: {old:.3f} -> {new:.3f} s")
+        if regressions or stages:
+            status = 1
+        else:
+            print("No regressions")
+
+    if args.budget is not None:
+        photo = next((r for r in results if r["name"] == PHOTO_CASE), None)
+        if photo is not None and photo["seconds"] > args.budget:
+            print(
+                f"OVER BUDGET {PHOTO_CASE}: {photo['seconds']:.3f} s "
+                f"> {args.budget:.3f} s"
+            )
+            status = 1
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
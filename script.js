@@ -16,6 +16,87 @@ const jpegOutput = document.getElementById("jpeg-output");
 const jpegRun = document.getElementById("jpeg-run");
 const jpegMetrics = document.getElementById("jpeg-metrics");
 let jpegCurrentFile = null;
+let jpegOutputUrl = null;
+const jpegSession = { file: null, imageId: null };
+
+// Responses come back as raw image bytes (response=binary); metrics travel in
+// X-* headers and the image is shown through an object URL.
+function readImageResponse(r) {
+  if (!r.ok) {
+    return r.json().then((data) => ({ error: data.error || r.statusText }));
+  }
+  return r.blob().then((blob) => ({ blob, headers: r.headers }));
+}
+
+// Each selected file is uploaded once (/upload); requests then send its
+// image_id instead of the file. A session is { file, imageId (a promise) }.
+function startUpload(session, file) {
+  session.file = file;
+  const fd = new FormData();
+  fd.append("file", file);
+  session.imageId = fetch("http://127.0.0.1:5000/upload", { method: "POST", body: fd })
+    .then((r) =>
+      r.json().then((data) => {
+        if (!r.ok) throw new Error(data.error || r.statusText);
+        return data.image_id;
+      })
+    )
+    .catch((err) => {
+      session.imageId = null;
+      throw err;
+    });
+  return session.imageId;
+}
+
+// POST the session's image with extra form fields, uploading it again if the
+// server no longer has it (404 once the stored copy expired).
+function postImage(url, session, fields) {
+  const send = (imageId) => {
+    const fd = new FormData();
+    fd.append("image_id", imageId);
+    Object.entries(fields).forEach(([key, value]) => fd.append(key, value));
+    return fetch(url, { method: "POST", body: fd });
+  };
+  const imageId = session.imageId || startUpload(session, session.file);
+  return imageId.then(send).then((r) => {
+    if (r.status !== 404) return r;
+    return startUpload(session, session.file).then(send);
+  });
+}
+
+// Requests ask for a preview (preview=1): a small copy comes back at once with
+// an X-Job-Id header, and the full-resolution result is fetched from
+// /jobs/<id>, which answers 202 until the job is done. Once isCurrent() turns
+// false the job is cancelled (DELETE) instead, and null is returned.
+function pollJob(jobId, isCurrent) {
+  const url = `http://127.0.0.1:5000/jobs/${jobId}`;
+  if (!isCurrent()) {
+    return fetch(url, { method: "DELETE" }).then(() => null);
+  }
+  return fetch(`${url}?response=binary`).then((r) => {
+    if (r.status !== 202) return r;
+    return new Promise((resolve) => setTimeout(resolve, 500)).then(() =>
+      pollJob(jobId, isCurrent)
+    );
+  });
+}
+
+// Show a preview and then the full result; isCurrent() turns false once a
+// newer run started, so late results of older runs are dropped.
+function showProgressive(response, isCurrent, show) {
+  return readImageResponse(response).then((data) => {
+    if (!isCurrent()) return;
+    show(data);
+    const jobId = !data.error && data.headers.get("X-Job-Id");
+    if (!jobId) return;
+    return pollJob(jobId, isCurrent).then((r) => {
+      if (!r) return;
+      return readImageResponse(r).then((full) => {
+        if (isCurrent()) show(full);
+      });
+    });
+  });
+}
 
 jpegFile.addEventListener("change", (e) => {
   jpegCurrentFile = e.target.files?.[0];
@@ -25,37 +106,53 @@ jpegFile.addEventListener("change", (e) => {
       jpegOriginal.innerHTML = `<img src="${event.target.result}" style="max-width: 100%; object-fit: contain;"/>`;
     };
     reader.readAsDataURL(jpegCurrentFile);
+    startUpload(jpegSession, jpegCurrentFile).catch(() => {});
     jpegRun.disabled = false;
     jpegOutput.innerHTML = `<p style="color: #5b6c63;">Ready</p>`;
   }
 });
 
+function showJpegResult(data) {
+  if (data.error) {
+    jpegOutput.innerHTML = `<p style="color: red;">${data.error}</p>`;
+    return;
+  }
+  if (jpegOutputUrl) URL.revokeObjectURL(jpegOutputUrl);
+  jpegOutputUrl = URL.createObjectURL(data.blob);
+  jpegOutput.innerHTML = `<img src="${jpegOutputUrl}" style="max-width: 100%; object-fit: contain;"/>`;
+  // previews carry no sizes; the metrics arrive with the full result
+  if (jpegMetrics && data.headers.has("X-Compressed-Size")) {
+    const originalSize = Number(data.headers.get("X-Original-Size"));
+    const compressedSize = Number(data.headers.get("X-Compressed-Size"));
+    document.getElementById("original-size").textContent =
+      (originalSize / 1024).toFixed(2) + " KB";
+    document.getElementById("compressed-size").textContent =
+      (compressedSize / 1024).toFixed(2) + " KB";
+    document.getElementById("compression-ratio").textContent =
+      data.headers.get("X-Compression-Percentage") + "%";
+    // identical images have no finite PSNR, which the header sends as None
+    const psnr = data.headers.get("X-Psnr");
+    document.getElementById("jpeg-psnr").textContent =
+      psnr === "None" ? "\u221e" : Number(psnr).toFixed(2) + " dB";
+    document.getElementById("jpeg-ssim").textContent =
+      Number(data.headers.get("X-Ssim")).toFixed(4);
+    jpegMetrics.style.display = "grid";
+  }
+}
+
+let jpegRunCount = 0;
+
 jpegRun.addEventListener("click", () => {
   if (!jpegCurrentFile) return;
+  const run = ++jpegRunCount;
   jpegOutput.innerHTML = `<p style="color: #5b6c63;">Compressing...</p>`;
 
-  const fd = new FormData();
-  fd.append("file", jpegCurrentFile);
-  fd.append("quality", 50);
-
-  fetch("http://127.0.0.1:5000/compress", { method: "POST", body: fd })
-    .then((r) => r.json())
-    .then((data) => {
-      if (data.error) {
-        jpegOutput.innerHTML = `<p style="color: red;">${data.error}</p>`;
-        return;
-      }
-      jpegOutput.innerHTML = `<img src="${data.compressed_image}" style="max-width: 100%; object-fit: contain;"/>`;
-      if (jpegMetrics) {
-        document.getElementById("original-size").textContent =
-          (data.original_size / 1024).toFixed(2) + " KB";
-        document.getElementById("compressed-size").textContent =
-          (data.compressed_size / 1024).toFixed(2) + " KB";
-        document.getElementById("compression-ratio").textContent =
-          data.compression_percentage + "%";
-        jpegMetrics.style.display = "grid";
-      }
-    })
+  postImage("http://127.0.0.1:5000/compress", jpegSession, {
+    quality: 50,
+    preview: 1,
+    response: "binary",
+  })
+    .then((r) => showProgressive(r, () => run === jpegRunCount, showJpegResult))
     .catch(
       () =>
         (jpegOutput.innerHTML = `<p style="color: red;">Start Flask: python app.py</p>`)
@@ -71,6 +168,8 @@ const filterType = document.getElementById("filter-type");
 const intensity = document.getElementById("intensity");
 const method = document.getElementById("method");
 let noiseCurrentFile = null;
+let noiseOutputUrl = null;
+const noiseSession = { file: null, imageId: null };
 
 noiseFile.addEventListener("change", (e) => {
   noiseCurrentFile = e.target.files?.[0];
@@ -80,32 +179,39 @@ noiseFile.addEventListener("change", (e) => {
       noiseOriginal.innerHTML = `<img src="${event.target.result}" style="max-width: 100%; object-fit: contain;"/>`;
     };
     reader.readAsDataURL(noiseCurrentFile);
+    startUpload(noiseSession, noiseCurrentFile).catch(() => {});
     noiseRun.disabled = false;
     noiseOutput.innerHTML = `<p style="color: #5b6c63;">Ready</p>`;
   }
 });
 
+function showNoiseResult(data) {
+  if (data.error) {
+    noiseOutput.innerHTML = `<p style="color: red;">${data.error}</p>`;
+    return;
+  }
+  if (noiseOutputUrl) URL.revokeObjectURL(noiseOutputUrl);
+  noiseOutputUrl = URL.createObjectURL(data.blob);
+  noiseOutput.innerHTML = `<img src="${noiseOutputUrl}" style="max-width: 100%; object-fit: contain;"/>`;
+}
+
+let noiseRunCount = 0;
+
 noiseRun.addEventListener("click", () => {
   if (!noiseCurrentFile) return;
+  const run = ++noiseRunCount;
 
   const filter = filterType.value;
   noiseOutput.innerHTML = `<p style="color: #5b6c63;">Filtering...</p>`;
 
-  const fd = new FormData();
-  fd.append("file", noiseCurrentFile);
-  fd.append("filter_type", filter);
-  fd.append("kernel_size", intensity.value);
-  fd.append("method", method.value);
-
-  fetch("http://127.0.0.1:5000/filter", { method: "POST", body: fd })
-    .then((r) => r.json())
-    .then((data) => {
-      if (data.error) {
-        noiseOutput.innerHTML = `<p style="color: red;">${data.error}</p>`;
-        return;
-      }
-      noiseOutput.innerHTML = `<img src="${data.filtered_image}" style="max-width: 100%; object-fit: contain;"/>`;
-    })
+  postImage("http://127.0.0.1:5000/filter", noiseSession, {
+    filter_type: filter,
+    kernel_size: intensity.value,
+    method: method.value,
+    preview: 1,
+    response: "binary",
+  })
+    .then((r) => showProgressive(r, () => run === noiseRunCount, showNoiseResult))
     .catch(
       () =>
         (noiseOutput.innerHTML = `<p style="color: red;">Start Flask: python app.py</p>`)
@@ -0,0 +1,213 @@
+import email
+import email.policy
+import io
+import json
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+# run pool jobs inline, so the routes need no worker processes
+os.environ.setdefault("DIP_WORKERS", "0")
+
+import app
+
+
+def png_file():
+    data = io.BytesIO()
+    Image.fromarray(np.full((16, 16, 3), 100, dtype=np.uint8)).save(data, "PNG")
+    return (io.BytesIO(data.getvalue()), "grey.png")
+
+
+@pytest.mark.parametrize(
+    "form",
+    [
+        {"subsampling": "4:1:1"},
+        {"subsampling": ""},
+        {"quality": "high"},
+        {"target_size": "small"},
+        {"target_size": "1000", "target_psnr": "30"},
+        {"workers": "x"},
+    ],
+)
+def test_compress_rejects_bad_params(form):
+    response = app.app.test_client().post(
+        "/compress", data={"file": png_file(), **form}
+    )
+    assert response.status_code == 400
+    assert response.get_json()["error"]
+
+
+@pytest.mark.parametrize("subsampling", ["4:4:4", "4:2:2", "4:2:0"])
+def test_compress_accepts_each_subsampling(subsampling):
+    response = app.app.test_client().post(
+        "/compress",
+        data={"file": png_file(), "subsampling": subsampling, "response": "json"},
+    )
+    assert response.status_code == 200
+
+
+def test_repeated_compress_is_one_cache_hit_with_its_details():
+    client = app.app.test_client()
+    data = {"quality": "40", "subsampling": "4:4:4", "response": "json"}
+    first = client.post("/compress", data={"file": png_file(), **data})
+    hits = client.get("/cache/stats").get_json()["hits"]
+    second = client.post("/compress", data={"file": png_file(), **data})
+    assert client.get("/cache/stats").get_json()["hits"] == hits + 1
+    for name in ("quality", "mse", "psnr", "ssim"):
+        assert second.get_json()[name] == first.get_json()[name]
+
+
+@pytest.mark.parametrize("target_size, met", [("100", False), ("100000", True)])
+def test_compress_reports_whether_the_target_was_met(target_size, met):
+    data = io.BytesIO()
+    noise = np.random.default_rng(1).integers(0, 256, (64, 64, 3), dtype=np.uint8)
+    Image.fromarray(noise).save(data, "PNG")
+    response = app.app.test_client().post(
+        "/compress",
+        data={
+            "file": (io.BytesIO(data.getvalue()), "noise.png"),
+            "target_size": target_size,
+            "response": "json",
+        },
+    )
+    body = response.get_json()
+    assert body["target_met"] is met
+    assert (body["compressed_size"] <= int(target_size)) is met
+
+
+def test_filter_rejects_bad_workers():
+    response = app.app.test_client().post(
+        "/filter", data={"file": png_file(), "workers": "x"}
+    )
+    assert response.status_code == 400
+    assert response.get_json()["error"]
+
+
+def test_pipeline_rejects_bad_workers():
+    response = app.app.test_client().post(
+        "/pipeline",
+        data={
+            "file": png_file(),
+            "stages": '[{"filter_type": "Median Filter"}]',
+            "workers": "x",
+        },
+    )
+    assert response.status_code == 400
+    assert response.get_json()["error"]
+
+
+@pytest.mark.parametrize(
+    "form",
+    [
+        {"kernel_size": "0"},
+        {"kernel_size": "-3"},
+        {"kernel_size": "three"},
+        {"method": "wrap"},
+        {"filter_type": "Min-Max Filter", "mode": "median"},
+        {"filter_type": "Gauss Filter", "sigma": "wide"},
+        {"filter_type": "Sharpen"},
+    ],
+)
+def test_filter_rejects_bad_params(form):
+    response = app.app.test_client().post("/filter", data={"file": png_file(), **form})
+    assert response.status_code == 400
+    assert response.get_json()["error"]
+
+
+def noise_png(shape):
+    data = io.BytesIO()
+    noise = np.random.default_rng(2).integers(0, 256, shape, dtype=np.uint8)
+    Image.fromarray(noise).save(data, "PNG")
+    return (io.BytesIO(data.getvalue()), "noise.png")
+
+
+@pytest.mark.parametrize(
+    "route, form, mimetype",
+    [
+        ("/compress", {"quality": "70"}, "image/jpeg"),
+        ("/filter", {"filter_type": "Average Filter"}, "image/png"),
+    ],
+)
+def test_binary_response_is_the_image_with_header_metrics(route, form, mimetype):
+    # large enough to be streamed in several chunks
+    response = app.app.test_client().post(
+        route,
+        data={"file": noise_png((300, 300, 3)), "response": "binary", **form},
+    )
+    assert response.status_code == 200
+    assert response.content_type == mimetype
+    assert int(response.headers["Content-Length"]) == len(response.data)
+    assert float(response.headers["X-Psnr"]) > 0
+    image = Image.open(io.BytesIO(response.data))
+    assert (image.format, image.size) == (mimetype.split("/")[1].upper(), (300, 300))
+
+
+def test_multipart_response_holds_metrics_then_the_image():
+    response = app.app.test_client().post(
+        "/compress",
+        data={"file": noise_png((200, 240)), "quality": "70", "response": "multipart"},
+    )
+    assert response.status_code == 200
+    assert response.mimetype == "multipart/mixed"
+    message = email.message_from_bytes(
+        f"Content-Type: {response.content_type}\r\n\r\n".encode() + response.data,
+        policy=email.policy.HTTP,
+    )
+    metrics, image = message.iter_parts()
+    assert metrics.get_content_type() == "application/json"
+    assert json.loads(metrics.get_content())["quality"] == 70
+    assert image.get_content_type() == "image/jpeg"
+    data = image.get_content()
+    assert int(image["Content-Length"]) == len(data)
+    assert Image.open(io.BytesIO(data)).size == (240, 200)
+
+
+def test_unknown_response_format_is_rejected():
+    response = app.app.test_client().post(
+        "/compress", data={"file": png_file(), "response": "xml"}
+    )
+    assert response.status_code == 400
+
+
+def test_filter_rejects_a_crop_kernel_larger_than_the_image():
+    response = app.app.test_client().post(
+        "/filter",
+        data={
+            "file": png_file(),
+            "filter_type": "Gauss Filter",
+            "kernel_size": "17",
+            "method": "crop",
+            "async": "1",
+        },
+    )
+    assert response.status_code == 400
+    assert "larger than the 16x16 image" in response.get_json()["error"]
+
+
+def test_median_crop_larger_than_the_image_is_rejected():
+    client = app.app.test_client()
+    response = client.post(
+        "/filter",
+        data={
+            "file": png_file(),
+            "filter_type": "Median Filter",
+            "kernel_size": "31",
+            "method": "crop",
+        },
+    )
+    assert response.status_code == 400
+    assert "larger than the 16x16 image" in response.get_json()["error"]
+
+    response = client.post(
+        "/pipeline",
+        data={
+            "file": png_file(),
+            "stages": '[{"filter_type": "Median Filter", "kernel_size": 9, '
+            '"method": "crop"}, {"filter_type": "Median Filter", "kernel_size": 9, '
+            '"method": "crop"}]',
+        },
+    )
+    assert response.status_code == 400
+    assert response.get_json()["error"]
@@ -0,0 +1,103 @@
+import os
+import threading
+
+import numpy as np
+import pytest
+from PIL import Image
+
+os.environ.setdefault("DIP_WORKERS", "0")
+os.environ.setdefault("DIP_BATCH_WORKERS", "0")
+
+from Batch import BatchProcessor, normalize_params
+from Worker_Pool import WorkerPool
+
+
+def test_filter_params_are_normalized():
+    params = normalize_params(
+        "filter", {"filter_type": "Median Filter", "kernel_size": "5"}
+    )
+    assert params == {"filter_type": "Median Filter", "size": 5, "method": "padding"}
+
+
+@pytest.mark.parametrize(
+    "operation, params",
+    [
+        ("filter", {"filter_type": "Sharpen"}),
+        ("filter", {"filter_type": "Median Filter", "kernel_size": "x"}),
+        ("compress", {"subsampling": "4:1:1"}),
+        ("compress", {"target_size": 1000, "target_psnr": 30}),
+        ("compress", {"qualty": 50}),
+        ("resize", {}),
+    ],
+)
+def test_invalid_params_are_rejected(operation, params):
+    with pytest.raises(ValueError):
+        normalize_params(operation, params)
+
+
+def test_batch_waits_for_a_saturated_pool(tmp_path):
+    source = tmp_path / "in"
+    source.mkdir()
+    pixels = np.random.default_rng(0).integers(0, 256, (16, 16), dtype=np.uint8)
+    Image.fromarray(pixels).save(source / "a.png")
+
+    pool = WorkerPool(workers=0, queue_size=0)
+    # another user holds the only slot for a moment
+    pool._slots.acquire()
+    threading.Timer(0.2, pool._slots.release).start()
+    processor = BatchProcessor(
+        "filter",
+        {"filter_type": "Median Filter", "size": 3},
+        str(tmp_path / "out"),
+        pool=pool,
+    )
+    results = list(processor.run(str(source)))
+    assert [r["status"] for r in results] == ["done"]
+
+
+def test_batch_route_is_disabled_without_a_root(monkeypatch):
+    import app
+
+    monkeypatch.setattr(app, "BATCH_ROOT", None)
+    response = app.app.test_client().post(
+        "/batch", json={"source": "images", "output_dir": "filtered"}
+    )
+    assert response.status_code == 404
+    assert "DIP_BATCH_ROOT" in response.get_json()["error"]
+
+
+def test_batch_route_stays_below_its_root(tmp_path, monkeypatch):
+    import app
+
+    monkeypatch.setattr(app, "BATCH_ROOT", str(tmp_path))
+    (tmp_path / "in").mkdir()
+    pixels = np.random.default_rng(0).integers(0, 256, (16, 16), dtype=np.uint8)
+    Image.fromarray(pixels).save(tmp_path / "in" / "a.png")
+    client = app.app.test_client()
+    body = {
+        "operation": "filter",
+        "params": {"filter_type": "Median Filter", "kernel_size": 3},
+    }
+
+    response = client.post("/batch", json={**body, "source": "in", "output_dir": ".."})
+    assert response.status_code == 400
+    response = client.post("/batch", json={**body, "source": "in", "output_dir": "out"})
+    assert response.status_code == 200
+    assert '"status": "done"' in response.get_data(as_text=True)
+    assert (tmp_path / "out" / "manifest.jsonl").exists()
+
+
+def test_batch_route_rejects_bad_params(tmp_path, monkeypatch):
+    import app
+
+    monkeypatch.setattr(app, "BATCH_ROOT", str(tmp_path))
+    response = app.app.test_client().post(
+        "/batch",
+        json={
+            "source": "images",
+            "output_dir": "filtered",
+            "operation": "filter",
+            "params": {"filter_type": "Median Filter", "kernel_size": [3]},
+        },
+    )
+    assert response.status_code == 400
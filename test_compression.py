@@ -0,0 +1,138 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from JPEG_Compression import RGB_TO_YCBCR, SUBSAMPLING, Compressor
+from Quality_Metrics import psnr
+
+
+def smooth_image(channels=None, shape=(37, 29)):
+    """A gradient with a little noise, closer to a photo than uniform noise is."""
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[: shape[0], : shape[1]]
+    image = 4 * x + 3 * y + rng.integers(0, 8, shape)
+    if channels:
+        image = np.stack([image, 255 - image, image // 2], axis=-1)
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+
+def compress(tmp_path, monkeypatch, image, **options):
+    """Compress an image file; the result is written below tmp_path."""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "compressed").mkdir(exist_ok=True)
+    path = tmp_path / "input.png"
+    Image.fromarray(image).save(path)
+    compressor = Compressor(str(path), **options)
+    reconstructed = np.asarray(compressor.compress())
+    return compressor, reconstructed
+
+
+@pytest.mark.parametrize("optimize", [False, True])
+@pytest.mark.parametrize("subsampling", ["4:4:4", "4:2:2", "4:2:0"])
+@pytest.mark.parametrize("channels", [None, 3])
+def test_output_decodes_with_pil(
+    tmp_path, monkeypatch, optimize, subsampling, channels
+):
+    image = smooth_image(channels)
+    compressor, reconstructed = compress(
+        tmp_path,
+        monkeypatch,
+        image,
+        quality=90,
+        optimize=optimize,
+        subsampling=subsampling,
+    )
+    decoded = Image.open(io.BytesIO(compressor.encoded))
+    decoded.load()
+    assert decoded.format == "JPEG"
+    assert decoded.mode == ("RGB" if channels else "L")
+    assert decoded.size == (image.shape[1], image.shape[0])
+    decoded = np.asarray(decoded).astype(int)
+    # close to the input, and to what the compressor reconstructed
+    assert np.abs(decoded - image).mean() < 4
+    if subsampling == "4:4:4" or not channels:
+        # PIL interpolates subsampled chroma where the compressor repeats it
+        assert np.abs(decoded - reconstructed.astype(int)).max() <= 2
+
+
+def test_workers_do_not_change_the_file(tmp_path, monkeypatch):
+    image = smooth_image(3, shape=(160, 120))
+    files = []
+    for workers in (1, 3):
+        compressor, _ = compress(
+            tmp_path, monkeypatch, image, quality=75, workers=workers
+        )
+        files.append(compressor.encoded)
+    assert files[0] == files[1]
+
+
+@pytest.mark.parametrize("subsampling", ["4:4:4", "4:2:2", "4:2:0"])
+def test_colour_conversion_matches_the_block_means(subsampling):
+    image = noisy_image(shape=(19, 27))
+    compressor = Compressor(image, subsampling=subsampling)
+    luma, chroma = compressor.rgb_to_ycbcr(image)
+    h_samp, v_samp = SUBSAMPLING[subsampling]
+    padded = np.pad(
+        image, ((0, -19 % (8 * v_samp)), (0, -27 % (8 * h_samp)), (0, 0)), mode="edge"
+    )
+    ycbcr = padded @ RGB_TO_YCBCR.T + [0, 128, 128]
+    rows, cols = padded.shape[0] // v_samp, padded.shape[1] // h_samp
+    means = ycbcr[..., 1:].reshape(rows, v_samp, cols, h_samp, 2).mean(axis=(1, 3))
+    np.testing.assert_allclose(luma[0], ycbcr[..., 0], atol=1e-3)
+    np.testing.assert_allclose(chroma, means.transpose(2, 0, 1), atol=1e-3)
+    rgb = compressor.ycbcr_to_rgb(luma, chroma, (19, 27))
+    assert rgb.shape == (19, 27, 3)
+    if subsampling == "4:4:4":
+        np.testing.assert_allclose(rgb, image, atol=1e-2)
+
+
+def noisy_image(channels=3, shape=(96, 80)):
+    """Uniform noise, which no quality compresses well."""
+    rng = np.random.default_rng(1)
+    return rng.integers(0, 256, shape + ((channels,) if channels else ()), np.uint8)
+
+
+@pytest.mark.parametrize("subsampling", ["4:4:4", "4:2:0"])
+@pytest.mark.parametrize("target_size", [3000, 8000])
+def test_target_size_is_not_exceeded(subsampling, target_size):
+    compressor = Compressor(noisy_image(), subsampling=subsampling)
+    compressor.compress(target_size=target_size)
+    assert compressor.target_met
+    assert len(compressor.encoded) <= target_size
+    # the target was what limited the quality
+    assert compressor.quality > 1
+    assert Image.open(io.BytesIO(compressor.encoded)).size == (80, 96)
+
+
+@pytest.mark.parametrize(
+    "channels, subsampling", [(None, "4:2:0"), (3, "4:4:4"), (3, "4:2:0")]
+)
+@pytest.mark.parametrize("target_psnr", [30, 40])
+def test_target_psnr_is_reached_by_the_decoded_file(channels, subsampling, target_psnr):
+    image = smooth_image(channels, (96, 80))
+    compressor = Compressor(image, subsampling=subsampling)
+    compressor.compress(target_psnr=target_psnr)
+    assert compressor.target_met
+    decoded = np.asarray(Image.open(io.BytesIO(compressor.encoded)))
+    assert psnr(image, decoded) >= target_psnr
+
+
+def test_unreachable_targets_use_the_closest_quality():
+    # the coarsest quality: every step of the luminance table (smallest step
+    # 10) is 255 from quality 2550 on
+    compressor = Compressor(noisy_image(), subsampling="4:4:4")
+    compressor.compress(target_size=500)
+    assert compressor.quality == 2550
+    assert compressor.target_met is False
+    assert len(compressor.encoded) > 500
+
+    compressor = Compressor(noisy_image(), subsampling="4:4:4")
+    compressor.compress(target_psnr=80)
+    assert compressor.quality == 1
+    assert compressor.target_met is False
+
+    compressor = Compressor(noisy_image(), quality=50)
+    compressor.compress()
+    assert compressor.target_met is None
@@ -1,24 +1,277 @@
+import functools
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import Average_Filter
+import Gauss_Filter
+import Median_Filter
+import MinMax_Filter
+import Tiling
+from Average_Filter import AverageFilter
 from Gauss_Filter import GaussFilter
+from Median_Filter import MedianFilter
 from MinMax_Filter import MinMaxFilter
-from PIL import Image
-import numpy as np
+from Pipeline import FilterPipeline
+
+METHODS = ("padding", "crop", "reflect", "edge", "symmetric")
+# np.pad mode of each edge-handling method that pads
+PAD_MODES = {
+    "padding": "constant",
+    "reflect": "reflect",
+    "edge": "edge",
+    "symmetric": "symmetric",
+}
+
+
+def sample_image(channels=None, shape=(17, 23), seed=0):
+    rng = np.random.default_rng(seed)
+    if channels:
+        shape = shape + (channels,)
+    return rng.integers(0, 256, shape, dtype=np.uint8)
+
+
+def reference_filter(image, size, method, reduce):
+    """Apply reduce to every window with a plain loop, as the original filters did."""
+    pad = size // 2
+    if method == "crop":
+        padded = image
+    else:
+        widths = ((pad, pad), (pad, pad)) + ((0, 0),) * (image.ndim - 2)
+        padded = np.pad(image, widths, mode=PAD_MODES[method])
+    window = 2 * pad + 1
+    rows = padded.shape[0] - window + 1
+    cols = padded.shape[1] - window + 1
+    out = np.empty((rows, cols) + image.shape[2:])
+    for i in range(rows):
+        for j in range(cols):
+            block = padded[i : i + window, j : j + window].astype(float)
+            out[i, j] = reduce(block)
+    return out
+
+
+def to_uint8(values):
+    """Round to nearest, halves up, and saturate, as precision='uint8' does."""
+    return np.clip(np.floor(values + 0.5), 0, 255).astype(np.uint8)
+
+
+def test_filters_keep_the_shape_of_colour_images():
+    image = np.array(Image.new("RGB", (10, 10), color=(128, 128, 128)))
+
+    out = GaussFilter().gauss_filter_custom(image, size=3, method="padding")
+    assert out.shape == (10, 10, 3)
+
+    out = MinMaxFilter().min_max_filter_custom(
+        image, size=3, mode="min", method="padding"
+    )
+    assert out.shape == (10, 10, 3)
+    # the zero padding only reaches the border
+    assert (out[1:-1, 1:-1] == 128).all() and (out[0] == 0).all()
+
+    # a window larger than the image still reflects a flat image onto itself
+    out = AverageFilter().average_filter_custom(image, size=31, method="reflect")
+    assert out.shape == (10, 10, 3) and (out == 128).all()
+
+
+@pytest.mark.parametrize("channels", [None, 3])
+@pytest.mark.parametrize("method", METHODS)
+@pytest.mark.parametrize("size", [3, 5])
+def test_average_matches_loop(channels, method, size):
+    image = sample_image(channels)
+    expected = to_uint8(
+        reference_filter(image, size, method, lambda b: b.mean(axis=(0, 1)))
+    )
+    out = AverageFilter().average_filter_custom(image, size, method)
+    assert out.dtype == np.uint8
+    np.testing.assert_array_equal(out, expected)
+
+
+def gauss_reference(image, size, method, sigma=None):
+    kernel = GaussFilter()._gaussian_kernel(size, sigma)
+    if image.ndim == 3:
+        kernel = kernel[..., np.newaxis]
+    return reference_filter(
+        image, size, method, lambda block: (block * kernel).sum(axis=(0, 1))
+    )
+
+
+@pytest.mark.parametrize("engine", ["separable", "fft"])
+@pytest.mark.parametrize("channels", [None, 3])
+@pytest.mark.parametrize("method", METHODS)
+@pytest.mark.parametrize("size", [3, 7])
+def test_gauss_engines_match_loop(engine, channels, method, size):
+    image = sample_image(channels)
+    expected = gauss_reference(image, size, method)
+    out = GaussFilter().gauss_filter_custom(image, size, method, engine=engine)
+    assert out.dtype == np.uint8
+    # the engines sum in another order, so a value right at a rounding
+    # boundary may land one step away
+    diff = np.abs(out.astype(int) - to_uint8(expected).astype(int))
+    assert diff.max() <= 1
+    assert (diff == 0).mean() > 0.99
+
+    exact = GaussFilter(precision="float32").gauss_filter_custom(
+        image, size, method, engine=engine
+    )
+    assert exact.dtype == np.float32
+    np.testing.assert_allclose(exact, expected, atol=1e-3)
+
+
+@pytest.mark.parametrize("engine", ["separable", "fft"])
+def test_gauss_crop_needs_the_kernel_inside_the_image(engine):
+    image = np.zeros((5, 6), dtype=np.uint8)
+    # the Gaussian window is the kernel size, so a 6 x 6 kernel leaves no row
+    for size in (6, 7, 9):
+        with pytest.raises(ValueError, match="larger than the 6x5 image"):
+            GaussFilter().gauss_filter_custom(image, size, "crop", engine=engine)
+    out = GaussFilter().gauss_filter_custom(image, 5, "crop", engine=engine)
+    assert out.shape == (1, 2)
+
+
+@pytest.mark.parametrize("engine", ["histogram", "sort"])
+@pytest.mark.parametrize("channels", [None, 3])
+@pytest.mark.parametrize("method", METHODS)
+@pytest.mark.parametrize("size", [3, 5])
+def test_median_engines_match_loop(engine, channels, method, size):
+    image = sample_image(channels)
+    expected = reference_filter(
+        image, size, method, lambda b: np.median(b, axis=(0, 1))
+    )
+    out = MedianFilter().median_filter_custom(image, size, method, engine=engine)
+    assert out.dtype == np.uint8
+    np.testing.assert_array_equal(out, expected)
+
+
+@pytest.mark.parametrize("engine", ["histogram", "sort"])
+def test_median_crop_needs_the_kernel_inside_the_image(engine):
+    image = np.zeros((5, 6, 3), dtype=np.uint8)
+    # even sizes use the odd window one larger
+    for size in (6, 9, 31):
+        with pytest.raises(ValueError, match="larger than the 6x5 image"):
+            MedianFilter().median_filter_custom(image, size, "crop", engine=engine)
+    out = MedianFilter().median_filter_custom(image, 5, "crop", engine=engine)
+    assert out.shape == (1, 2, 3)
+
+
+@pytest.mark.parametrize("mode", ["min", "max", "range"])
+@pytest.mark.parametrize("channels", [None, 3])
+@pytest.mark.parametrize("method", METHODS)
+@pytest.mark.parametrize("size", [3, 5])
+def test_min_max_matches_loop(mode, channels, method, size):
+    image = sample_image(channels)
+    reduce = {
+        "min": lambda b: b.min(axis=(0, 1)),
+        "max": lambda b: b.max(axis=(0, 1)),
+        "range": lambda b: b.max(axis=(0, 1)) - b.min(axis=(0, 1)),
+    }[mode]
+    expected = reference_filter(image, size, method, reduce)
+    out = MinMaxFilter().min_max_filter_custom(image, size, mode, method)
+    np.testing.assert_array_equal(out, expected)
+
+
+# each filter: its module, whose tiled_filter the strip tests shrink, its
+# class and a call with a 5 x 5 window
+FILTERS = {
+    "average": (
+        Average_Filter,
+        AverageFilter,
+        lambda f, image, method: f.average_filter_custom(image, 5, method),
+    ),
+    "median": (
+        Median_Filter,
+        MedianFilter,
+        lambda f, image, method: f.median_filter_custom(image, 5, method),
+    ),
+    "min-max": (
+        MinMax_Filter,
+        MinMaxFilter,
+        lambda f, image, method: f.min_max_filter_custom(image, 5, "range", method),
+    ),
+    "gauss": (
+        Gauss_Filter,
+        GaussFilter,
+        lambda f, image, method: f.gauss_filter_custom(image, 5, method),
+    ),
+}
+
+
+@pytest.mark.parametrize("name", sorted(FILTERS))
+@pytest.mark.parametrize("method", METHODS)
+def test_strips_do_not_change_the_result(monkeypatch, name, method):
+    module, cls, call = FILTERS[name]
+    image = sample_image(3, shape=(61, 37))
+    whole = call(cls(), image, method)
+    # about 8 rows per strip
+    small_strips = functools.partial(Tiling.tiled_filter, tile_pixels=8 * 37 * 3)
+    monkeypatch.setattr(module, "tiled_filter", small_strips)
+    for workers in (1, 4):
+        strips = call(cls(workers=workers), image, method)
+        np.testing.assert_array_equal(strips, whole)
+
+
+@pytest.mark.parametrize("name", sorted(FILTERS))
+def test_workers_do_not_change_the_result(name):
+    _, cls, call = FILTERS[name]
+    image = sample_image(3, shape=(400, 300))
+    np.testing.assert_array_equal(
+        call(cls(workers=1), image, "reflect"),
+        call(cls(workers=3), image, "reflect"),
+    )
+
+
+def test_uint8_results_round_to_nearest():
+    # the centre window sums to 1149, a mean of 127.67: truncating gave 127
+    image = np.full((3, 3), 127, dtype=np.uint8)
+    image[0, 0] = 133
+    out = AverageFilter().average_filter_custom(image, 3, "crop")
+    assert out.dtype == np.uint8
+    assert out.tolist() == [[128]]
+    exact = AverageFilter(precision="float32").average_filter_custom(image, 3, "crop")
+    assert exact.dtype == np.float32
+    assert exact[0, 0] == pytest.approx(1149 / 9)
+
+    # a flat white image stays white: float32 sums slightly above 255 saturate
+    image = np.full((5, 5), 255, dtype=np.uint8)
+    out = GaussFilter().gauss_filter_custom(image, 3, "edge")
+    assert out.dtype == np.uint8 and (out == 255).all()
+
+    # median crop used to come back as float64
+    out = MedianFilter().median_filter_custom(sample_image(), 3, "crop")
+    assert out.dtype == np.uint8
+
+
+PIPELINE = [
+    {"filter_type": "Median Filter", "size": 5, "method": "reflect"},
+    {"filter_type": "Gauss Filter", "size": 7, "method": "padding"},
+    {"filter_type": "Average Filter", "size": 3, "method": "crop"},
+    {"filter_type": "Min-Max Filter", "size": 3, "mode": "range", "method": "edge"},
+]
+
+
+def run_stages(image, specs):
+    """The stages of a pipeline run one after another."""
+    for spec in specs:
+        size, method = spec["size"], spec["method"]
+        if spec["filter_type"] == "Median Filter":
+            image = MedianFilter().median_filter_custom(image, size, method)
+        elif spec["filter_type"] == "Gauss Filter":
+            image = GaussFilter().gauss_filter_custom(image, size, method)
+        elif spec["filter_type"] == "Average Filter":
+            image = AverageFilter().average_filter_custom(image, size, method)
+        else:
+            image = MinMaxFilter().min_max_filter_custom(
+                image, size, spec["mode"], method
+            )
+    return image
+
 
-print("Loading sample image...")
-img = Image.new("RGB", (10, 10), color=(128, 128, 128))
-arr = np.array(img)
-
-print("Testing GaussFilter...")
-try:
-    gf = GaussFilter()
-    out = gf.gauss_filter_custom(arr, size=3, method="padding")
-    print("Gauss output shape:", out.shape, out.dtype)
-except Exception as e:
-    print("Gauss failed:", e)
-
-print("Testing MinMaxFilter...")
-try:
-    mf = MinMaxFilter()
-    out2 = mf.min_max_filter_custom(arr, size=3, mode="min", method="padding")
-    print("MinMax output shape:", out2.shape, out2.dtype)
-except Exception as e:
-    print("MinMax failed:", e)
+@pytest.mark.parametrize("channels", [None, 3])
+def test_pipeline_equals_filters_in_sequence(channels):
+    image = sample_image(channels, shape=(53, 41))
+    expected = run_stages(image, PIPELINE)
+    for workers in (1, 3):
+        pipeline = FilterPipeline(PIPELINE, workers=workers, tile_pixels=600)
+        out = pipeline.run(image)
+        assert out.shape == expected.shape
+        np.testing.assert_array_equal(out, expected)
@@ -0,0 +1,41 @@
+import numpy as np
+
+from Image_Store import ImageStore
+
+
+def image(side):
+    return np.zeros((side, side, 3), dtype=np.uint8)
+
+
+def test_previews_count_toward_the_size():
+    store = ImageStore(max_bytes=1 << 20)
+    image_id = store.add(image(100), "digest", 1000)
+    small, scale = store.get(image_id).preview(50)
+    assert scale == 0.5
+    assert store.stats() == {"images": 1, "bytes": image(100).nbytes + small.nbytes}
+
+    # a preview is made once, and an image small enough is its own preview
+    store.get(image_id).preview(50)
+    store.get(image_id).preview(200)
+    assert store.stats()["bytes"] == image(100).nbytes + small.nbytes
+
+    store.discard(image_id)
+    assert store.stats() == {"images": 0, "bytes": 0}
+
+
+def test_previews_evict_least_recently_used_images():
+    store = ImageStore(max_bytes=2 * image(100).nbytes)
+    first = store.add(image(100), "first", 1000)
+    second = store.add(image(100), "second", 1000)
+    store.get(second).preview(50)
+    assert store.get(first) is None
+    assert store.get(second) is not None
+    assert store.stats()["bytes"] <= store.max_bytes
+
+
+def test_preview_of_an_evicted_image_is_not_counted():
+    store = ImageStore(max_bytes=image(100).nbytes)
+    entry = store.get(store.add(image(100), "first", 1000))
+    store.add(image(100), "second", 1000)
+    entry.preview(50)
+    assert store.stats() == {"images": 1, "bytes": image(100).nbytes}
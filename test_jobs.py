@@ -0,0 +1,144 @@
+import os
+import threading
+import time
+
+import pytest
+
+# run pool jobs inline, so the routes need no worker processes
+os.environ.setdefault("DIP_WORKERS", "0")
+
+import app
+from Jobs import JobQueue, JobQueueFull
+
+
+class Rows:
+    """A progress object as filter jobs set it: rows done and a cancel switch."""
+
+    def __init__(self, done, total):
+        self.done, self.total = done, total
+        self.cancelled = False
+
+    def rows(self):
+        return self.done, self.total
+
+    def cancel(self):
+        self.cancelled = True
+
+
+def wait(queue, job_id):
+    """Wait for a job to finish and return it."""
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        job = queue.get(job_id)
+        if job is None or job.finished is not None:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+def blocking_job(started, release, progress=None):
+    """A job that waits for release, then stops if it was cancelled."""
+
+    def work(job):
+        job.progress = progress
+        started.set()
+        release.wait(5)
+        job.check()
+        return "result"
+
+    return work
+
+
+def test_a_job_runs_to_its_result():
+    queue = JobQueue(threads=1, queue_size=1, ttl=60)
+    started, release = threading.Event(), threading.Event()
+    job_id = queue.submit(blocking_job(started, release))
+    started.wait(5)
+    assert queue.get(job_id).as_dict() == {"job_id": job_id, "status": "running"}
+    release.set()
+    job = wait(queue, job_id)
+    assert (job.status, job.result) == ("done", "result")
+
+
+def test_a_failed_job_reports_its_error():
+    queue = JobQueue(threads=1, queue_size=1, ttl=60)
+
+    def fail(job):
+        raise ValueError("bad image")
+
+    job = wait(queue, queue.submit(fail))
+    assert job.as_dict()["status"] == "error"
+    assert job.as_dict()["error"] == "bad image"
+
+
+def test_cancel_stops_running_and_queued_jobs():
+    queue = JobQueue(threads=1, queue_size=1, ttl=60)
+    started, release = threading.Event(), threading.Event()
+    progress = Rows(3, 10)
+    running = queue.submit(blocking_job(started, release, progress))
+    queued = queue.submit(blocking_job(threading.Event(), release))
+    started.wait(5)
+    assert queue.cancel(queued).status == "cancelled"
+    queue.cancel(running)
+    assert progress.cancelled
+    release.set()
+    assert wait(queue, running).status == "cancelled"
+    assert queue.get(queued).result is None
+
+
+def test_a_full_queue_refuses_jobs():
+    queue = JobQueue(threads=1, queue_size=1, ttl=60)
+    started, release = threading.Event(), threading.Event()
+    queue.submit(blocking_job(started, release))
+    queue.submit(blocking_job(threading.Event(), release))
+    with pytest.raises(JobQueueFull):
+        queue.submit(blocking_job(threading.Event(), release))
+    release.set()
+
+
+def test_finished_jobs_are_capped_oldest_first():
+    queue = JobQueue(threads=1, queue_size=8, ttl=60, max_results=2)
+    job_ids = [queue.submit(lambda job, n=n: n) for n in range(4)]
+    for job_id in job_ids:
+        wait(queue, job_id)
+    assert [queue.get(job_id) is not None for job_id in job_ids] == [
+        False,
+        False,
+        True,
+        True,
+    ]
+
+
+def test_finished_jobs_expire_after_the_ttl():
+    queue = JobQueue(threads=1, queue_size=1, ttl=0.05)
+    job_id = queue.submit(lambda job: "result")
+    assert wait(queue, job_id).status == "done"
+    time.sleep(0.1)
+    assert queue.get(job_id) is None
+
+
+def test_job_routes_report_progress_and_cancellation(monkeypatch):
+    queue = JobQueue(threads=1, queue_size=1, ttl=60)
+    monkeypatch.setattr(app, "jobs", queue)
+    client = app.app.test_client()
+    started, release = threading.Event(), threading.Event()
+    job_id = queue.submit(blocking_job(started, release, Rows(3, 10)))
+    started.wait(5)
+
+    response = client.get(f"/jobs/{job_id}")
+    assert response.status_code == 202
+    assert response.get_json() == {
+        "job_id": job_id,
+        "status": "running",
+        "rows_done": 3,
+        "rows_total": 10,
+    }
+
+    assert client.delete(f"/jobs/{job_id}").status_code == 200
+    release.set()
+    wait(queue, job_id)
+    response = client.get(f"/jobs/{job_id}")
+    assert response.status_code == 410
+    assert response.get_json()["status"] == "cancelled"
+    assert client.get("/jobs/unknown").status_code == 404
+    assert client.delete("/jobs/unknown").status_code == 404
@@ -0,0 +1,98 @@
+import io
+import os
+import re
+
+import numpy as np
+import pytest
+from PIL import Image
+
+# run pool jobs inline, so the routes need no worker processes
+os.environ.setdefault("DIP_WORKERS", "0")
+
+import app
+import Metrics
+from Metrics import Histogram, Timings, size_bucket
+
+
+@pytest.fixture
+def histogram(monkeypatch):
+    # keep test histograms out of the /metrics output
+    monkeypatch.setattr(Metrics, "REGISTRY", [])
+    return Histogram("test_seconds", "Test latency", ("route",), buckets=(0.1, 1))
+
+
+def test_histogram_buckets_are_cumulative(histogram):
+    for value in (0.05, 0.5, 0.5, 3):
+        histogram.observe(value, route="/a")
+    assert histogram.render() == [
+        "# HELP test_seconds Test latency",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{route="/a",le="0.1"} 1',
+        'test_seconds_bucket{route="/a",le="1"} 3',
+        'test_seconds_bucket{route="/a",le="+Inf"} 4',
+        'test_seconds_sum{route="/a"} 4.05',
+        'test_seconds_count{route="/a"} 4',
+    ]
+
+
+def test_histogram_series_are_sorted_and_escaped(histogram):
+    histogram.observe(2, route='/b"\n')
+    histogram.observe(0.01, route="/a")
+    lines = histogram.render()
+    assert lines[2] == 'test_seconds_bucket{route="/a",le="0.1"} 1'
+    assert 'test_seconds_count{route="/b\\"\\n"} 1' in lines
+    assert Metrics.render_metrics() == "\n".join(lines) + "\n"
+
+
+def test_timings_accumulate_in_server_timing_format():
+    timings = Timings()
+    timings.add("decode", 0.0125)
+    timings.add("filter", 0.1)
+    timings.add("decode", 0.0125)
+    timings.update({"dct": 0.002}, prefix="compress.")
+    assert timings.server_timing() == (
+        "decode;dur=25.0, filter;dur=100.0, compress.dct;dur=2.0"
+    )
+
+
+@pytest.mark.parametrize(
+    "size, label",
+    [((500, 500), "<=0.25MP"), ((4000, 3000), "<=16MP"), ((9000, 9000), ">64MP")],
+)
+def test_size_bucket(size, label):
+    assert size_bucket(*size) == label
+
+
+def test_requests_report_server_timing_and_metrics():
+    data = io.BytesIO()
+    pixels = np.random.default_rng(3).integers(0, 256, (24, 24), dtype=np.uint8)
+    Image.fromarray(pixels).save(data, "PNG")
+    client = app.app.test_client()
+    response = client.post(
+        "/filter",
+        data={
+            "file": (io.BytesIO(data.getvalue()), "image.png"),
+            "filter_type": "Average Filter",
+            "kernel_size": "5",
+        },
+    )
+    assert response.status_code == 200
+    stages = [
+        part.split(";")[0] for part in response.headers["Server-Timing"].split(", ")
+    ]
+    assert stages[:3] == ["read", "cache", "decode"]
+    assert "filter" in stages and stages[-1] == "total"
+    assert re.fullmatch(
+        r"total;dur=\d+\.\d", response.headers["Server-Timing"].split(", ")[-1]
+    )
+
+    response = client.get("/metrics")
+    assert response.content_type.startswith("text/plain; version=0.0.4")
+    text = response.get_data(as_text=True)
+    assert "# TYPE dip_request_seconds histogram" in text
+    assert re.search(
+        r'dip_request_seconds_count\{route="/filter",filter_type="Average Filter",'
+        r'kernel_size="5",image_size="<=0.25MP",cache="miss",preview=""\} [1-9]',
+        text,
+    )
+    assert 'dip_stage_seconds_count{route="/filter",stage="decode"}' in text
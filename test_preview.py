@@ -0,0 +1,122 @@
+import base64
+import io
+import os
+import time
+
+import numpy as np
+import pytest
+from PIL import Image
+
+# run pool jobs inline, so the routes need no worker processes
+os.environ.setdefault("DIP_WORKERS", "0")
+
+import app
+from Worker_Pool import run_filter
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(app, "PREVIEW_SIDE", 16)
+    return app.app.test_client()
+
+
+def png_file(pixels):
+    data = io.BytesIO()
+    Image.fromarray(pixels).save(data, "PNG")
+    return (io.BytesIO(data.getvalue()), "image.png")
+
+
+def sample_image(seed, shape=(48, 64, 3)):
+    return np.random.default_rng(seed).integers(0, 256, shape, dtype=np.uint8)
+
+
+def data_url_image(url):
+    return Image.open(io.BytesIO(base64.b64decode(url.split(",", 1)[1])))
+
+
+def job_result(client, job_id):
+    """Poll /jobs/<job_id> until the job is done."""
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        response = client.get(f"/jobs/{job_id}?response=binary")
+        if response.status_code != 202:
+            return response
+        time.sleep(0.02)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+@pytest.mark.parametrize(
+    "filter_type, params, scale, expected",
+    [
+        ("Median Filter", {"size": 15}, 0.25, {"size": 5}),
+        ("Median Filter", {"size": 3}, 0.1, {"size": 1}),
+        ("Average Filter", {"size": 10}, 0.25, {"size": 2}),
+        ("Gauss Filter", {"size": 9, "sigma": 2.0}, 0.5, {"size": 5, "sigma": 1.0}),
+        ("Gauss Filter", {"size": 9, "sigma": None}, 0.5, {"size": 5, "sigma": 0.75}),
+    ],
+)
+def test_preview_params_scale_the_kernel(filter_type, params, scale, expected):
+    assert app.preview_params(filter_type, params, scale) == expected
+
+
+def test_preview_params_keep_odd_kernels_odd():
+    for size in range(1, 32, 2):
+        for scale in (0.05, 0.13, 0.25, 0.5, 0.77):
+            assert (
+                app.preview_params("Median Filter", {"size": size}, scale)["size"] % 2
+            )
+
+
+def test_filter_preview_then_full_result(client):
+    image = sample_image(11)
+    response = client.post(
+        "/filter",
+        data={
+            "file": png_file(image),
+            "filter_type": "Median Filter",
+            "kernel_size": "5",
+            "preview": "1",
+        },
+    )
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body["preview_scale"] == 0.25
+    assert data_url_image(body["filtered_image"]).size == (16, 12)
+
+    response = job_result(client, body["job_id"])
+    assert response.status_code == 200
+    assert response.content_type == "image/png"
+    full = np.asarray(Image.open(io.BytesIO(response.data)))
+    np.testing.assert_array_equal(full, run_filter(image, "Median Filter", size=5))
+
+
+def test_compress_preview_then_full_result(client):
+    image = sample_image(12)
+    response = client.post(
+        "/compress", data={"file": png_file(image), "quality": "60", "preview": "1"}
+    )
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body["preview_scale"] == 0.25
+    assert data_url_image(body["compressed_image"]).size == (16, 12)
+
+    response = job_result(client, body["job_id"])
+    assert response.status_code == 200
+    assert response.content_type == "image/jpeg"
+    assert Image.open(io.BytesIO(response.data)).size == (64, 48)
+    assert response.headers["X-Quality"] == "60"
+
+
+def test_small_images_skip_the_preview(client):
+    response = client.post(
+        "/filter",
+        data={
+            "file": png_file(sample_image(13, (12, 16))),
+            "filter_type": "Average Filter",
+            "preview": "1",
+        },
+    )
+    assert response.status_code == 200
+    body = response.get_json()
+    assert "job_id" not in body and "preview_scale" not in body
+    assert data_url_image(body["filtered_image"]).size == (16, 12)
@@ -0,0 +1,66 @@
+import io
+import os
+
+import numpy as np
+from PIL import Image
+
+# run pool jobs inline, so the routes need no worker processes
+os.environ.setdefault("DIP_WORKERS", "0")
+
+from Quality_Metrics import quality_metrics
+
+
+def rgba_image(size=40):
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 256, (size, size, 4), dtype=np.uint8)
+
+
+def test_identical_images():
+    image = rgba_image()[..., :3]
+    assert quality_metrics(image, image) == {"mse": 0.0, "psnr": None, "ssim": 1.0}
+
+
+def test_alpha_is_ignored():
+    image = rgba_image()
+    other = image.copy()
+    other[..., 3] = 255 - other[..., 3]
+    assert quality_metrics(image, other)["mse"] == 0.0
+
+    noisy = image.copy()
+    noisy[..., 0] ^= 1
+    metrics = quality_metrics(image, noisy)
+    assert metrics == quality_metrics(image[..., :3], noisy[..., :3])
+    assert metrics["mse"] == round(1 / 3, 4)
+
+
+def test_cropped_result_is_compared_with_centre():
+    image = rgba_image()[..., 0]
+    assert quality_metrics(image, image[2:-2, 2:-2])["mse"] == 0.0
+
+
+def test_filter_route_accepts_rgba():
+    import app
+
+    data = io.BytesIO()
+    Image.fromarray(rgba_image(), "RGBA").save(data, "PNG")
+    response = app.app.test_client().post(
+        "/filter",
+        data={
+            "file": (io.BytesIO(data.getvalue()), "rgba.png"),
+            "filter_type": "Median Filter",
+            "kernel_size": "3",
+        },
+    )
+    assert response.status_code == 200
+    body = response.get_json()
+    assert {"mse", "psnr", "ssim"} <= body.keys()
+    assert 0 < body["ssim"] <= 1
+
+
+def test_compression_metrics_measure_the_decoded_file():
+    from Worker_Pool import run_compress
+
+    image = rgba_image(48)[..., :3]
+    encoded, _, details = run_compress(image, quality=50, subsampling="4:2:0")
+    decoded = np.asarray(Image.open(io.BytesIO(encoded)))
+    assert details == {"quality": 50, **quality_metrics(image, decoded)}
@@ -0,0 +1,96 @@
+from Result_Cache import ResultCache
+
+
+def test_details_are_kept_with_their_result(tmp_path):
+    cache = ResultCache(max_bytes=1 << 20, directory=str(tmp_path))
+    cache.put("a" * 64, b"result", {"quality": 42})
+    assert cache.get_with_details("a" * 64) == (b"result", {"quality": 42})
+    assert cache.get("a" * 64) == b"result"
+    assert cache.stats()["hits"] == 2
+
+    # the disk tier keeps them too
+    cache = ResultCache(max_bytes=1 << 20, directory=str(tmp_path))
+    assert cache.get_with_details("a" * 64) == (b"result", {"quality": 42})
+    assert cache.stats()["disk_hits"] == 1
+
+
+def test_result_without_details(tmp_path):
+    cache = ResultCache(max_bytes=1 << 20, directory=str(tmp_path))
+    cache.put("b" * 64, b"result")
+    # written as the bare result, as before details were stored
+    assert (tmp_path / ("b" * 64)).read_bytes() == b"result"
+    assert cache.get_with_details("b" * 64) == (b"result", {})
+    assert cache.get_with_details("c" * 64) is None
+
+
+def key(n):
+    return f"{n:064x}"
+
+
+def test_memory_tier_evicts_least_recently_used():
+    cache = ResultCache(max_bytes=10)
+    cache.put(key(1), b"aaaa")
+    cache.put(key(2), b"bbbb")
+    assert cache.get(key(1)) == b"aaaa"
+    cache.put(key(3), b"cccc")
+    assert cache.get(key(2)) is None
+    assert cache.get(key(1)) == b"aaaa"
+    assert cache.get(key(3)) == b"cccc"
+    assert cache.stats()["memory_bytes"] == 8
+
+    # a result larger than the tier is not kept
+    cache.put(key(4), b"x" * 11)
+    assert cache.get(key(4)) is None
+    assert cache.stats()["memory_entries"] == 2
+
+
+def test_disk_tier_evicts_least_recently_used(tmp_path):
+    cache = ResultCache(max_bytes=0, directory=str(tmp_path), max_disk_bytes=10)
+    cache.put(key(1), b"aaaa")
+    cache.put(key(2), b"bbbb")
+    assert cache.get(key(1)) == b"aaaa"
+    cache.put(key(3), b"cccc")
+    assert sorted(p.name for p in tmp_path.iterdir()) == [key(1), key(3)]
+    assert cache.stats()["disk_bytes"] == 8
+
+    # a new cache indexes the files already there
+    cache = ResultCache(max_bytes=0, directory=str(tmp_path), max_disk_bytes=10)
+    assert cache.stats()["disk_entries"] == 2
+    assert cache.get(key(3)) == b"cccc"
+
+
+def test_disk_hits_are_promoted_to_memory(tmp_path):
+    ResultCache(max_bytes=1 << 20, directory=str(tmp_path)).put(key(1), b"result")
+    cache = ResultCache(max_bytes=1 << 20, directory=str(tmp_path))
+    assert cache.get(key(1)) == b"result"
+    (tmp_path / key(1)).unlink()
+    # served from memory now, although the file is gone
+    assert cache.get(key(1)) == b"result"
+    stats = cache.stats()
+    assert (stats["hits"], stats["disk_hits"], stats["memory_entries"]) == (2, 1, 1)
+
+
+def test_a_removed_disk_entry_is_a_miss(tmp_path):
+    ResultCache(max_bytes=0, directory=str(tmp_path)).put(key(1), b"result")
+    cache = ResultCache(max_bytes=0, directory=str(tmp_path))
+    (tmp_path / key(1)).unlink()
+    assert cache.get(key(1)) is None
+    assert cache.stats()["disk_entries"] == 0
+
+
+def test_each_lookup_counts_once():
+    cache = ResultCache(max_bytes=1 << 20)
+    cache.put(key(1), b"result", {"quality": 50})
+    assert cache.get_with_details(key(1)) == (b"result", {"quality": 50})
+    assert cache.get(key(1)) == b"result"
+    assert cache.get(key(2)) is None
+    assert cache.stats() == {
+        "hits": 2,
+        "misses": 1,
+        "disk_hits": 0,
+        "hit_rate": 0.6667,
+        "memory_entries": 1,
+        "memory_bytes": len(b"result") + len(b'{"quality": 50}'),
+        "disk_entries": 0,
+        "disk_bytes": 0,
+    }
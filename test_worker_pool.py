@@ -0,0 +1,101 @@
+import io
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+# run pool jobs inline, so the routes need no worker processes
+os.environ.setdefault("DIP_WORKERS", "0")
+
+import app
+from Worker_Pool import (
+    PoolSaturated,
+    SharedProgress,
+    WorkerPool,
+    run_compress,
+    run_filter,
+)
+
+
+@pytest.fixture(scope="module")
+def process_pool():
+    pool = WorkerPool(workers=1, queue_size=1)
+    yield pool
+    pool.shutdown()
+
+
+def sample_image(shape=(40, 30, 3)):
+    return np.random.default_rng(0).integers(0, 256, shape, dtype=np.uint8)
+
+
+def test_share_copies_the_array_into_shared_memory():
+    image = sample_image()
+    shm = WorkerPool(workers=0)._share(image)
+    try:
+        shared = np.ndarray(image.shape, dtype=image.dtype, buffer=shm.buf)
+        np.testing.assert_array_equal(shared, image)
+        del shared
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def test_worker_processes_match_inline_filters(process_pool):
+    image = sample_image()
+    with SharedProgress() as progress:
+        filtered = process_pool.filter(
+            image, "Median Filter", size=5, method="reflect", progress=progress
+        )
+        rows = progress.rows()
+    expected = run_filter(image, "Median Filter", size=5, method="reflect")
+    np.testing.assert_array_equal(filtered, expected)
+    # the worker reported every row through the shared progress block
+    assert rows == (image.shape[0], image.shape[0])
+
+
+def test_worker_processes_match_inline_compression(process_pool):
+    image = sample_image()
+    encoded, timings, details = process_pool.compress(image, quality=60)
+    expected, _, expected_details = run_compress(image, quality=60)
+    assert encoded == expected
+    assert details == expected_details
+    assert "dct" in timings
+
+
+def test_a_full_pool_rejects_jobs_before_sharing_memory(monkeypatch):
+    pool = WorkerPool(workers=1, queue_size=0)
+
+    def share(image_array):
+        raise AssertionError("shared memory allocated for a rejected job")
+
+    monkeypatch.setattr(pool, "_share", share)
+    pool._slots.acquire()
+    with pytest.raises(PoolSaturated):
+        pool.compress(sample_image())
+    with pytest.raises(PoolSaturated):
+        pool.filter(sample_image(), "Median Filter")
+    pool._slots.release()
+
+
+@pytest.mark.parametrize(
+    "route, form",
+    [
+        ("/filter", {"filter_type": "Median Filter"}),
+        ("/compress", {"quality": "50"}),
+        ("/pipeline", {"stages": '[{"filter_type": "Median Filter"}]'}),
+    ],
+)
+def test_a_saturated_pool_answers_503_with_retry_after(monkeypatch, route, form):
+    pool = WorkerPool(workers=0, queue_size=0, retry_after=7)
+    monkeypatch.setattr(app, "pool", pool)
+    data = io.BytesIO()
+    Image.fromarray(sample_image()).save(data, "PNG")
+    pool._slots.acquire()
+    response = app.app.test_client().post(
+        route, data={"file": (io.BytesIO(data.getvalue()), "image.png"), **form}
+    )
+    pool._slots.release()
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "7"
+    assert response.get_json()["error"]